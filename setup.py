@@ -24,7 +24,7 @@ setup(name='pyRobots',
       url='https://github.com/chili-epfl/pyrobots',
       install_requires=["futures", "numpy"],
       package_dir = {'': 'src'},
-      packages=['robots', 'robots.helpers', 'robots.mw', 'robots.concurrency', 'robots.events', 'robots.poses', 'robots.resources'],
+      packages=['robots', 'robots.helpers', 'robots.mw', 'robots.concurrency', 'robots.events', 'robots.poses', 'robots.resources', 'robots.state'],
       scripts=['bin/robot_introspection'], 
       data_files=[
                   ('share/doc/pyrobots', ['AUTHORS', 'LICENSE', 'README.md'])]
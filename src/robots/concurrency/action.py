@@ -1,6 +1,7 @@
 # coding=utf-8
 import logging; logger = logging.getLogger("robots.actions")
 import time
+import inspect
 
 import threading
 
@@ -8,8 +9,12 @@ import robots
 from robots.introspection import introspection
 from .signals import ActionCancelled
 from .concurrency import FakeFuture
+from .cache import ActionCache
+from .tracing import trace, WAIT_RESOURCE, ACQUIRED_RESOURCE, START
+from .metrics import thread_time
+from .clock import get_clock
 
-def action(fn):
+def action(fn = None, priority = None, preempt = False, timeout = None, process = False, cache = None):
     """ When applied to a function, this decorator turns it into
     a asynchronous task, starts it in a different thread, and returns
     a 'future' object that can be used to query the result/cancel it/etc.
@@ -43,12 +48,48 @@ def action(fn):
     This sends the signal :class:`.ActionCancelled` to the
     action, that can appropriately terminate.
 
+    The decorator also accepts options (``@action(priority = ...)``):
+
+    - ``priority``: actions with a higher priority are handed over the
+      resources they wait for first (cf :class:`.Resource`), and actions with a
+      priority above :data:`.PRIORITY_NORMAL` are not limited by
+      :data:`.MAX_FUTURES`. Actions without explicit priority inherit the
+      priority of the action that starts them.
+    - ``preempt``: if ``True``, the action cancels the owners of the
+      resources it needs if they have a lower priority.
+    - ``timeout``: the action is cancelled if it is still running ``timeout``
+      seconds after being started (the time spent waiting for its resources
+      does not count). Waiting for it then raises :class:`TimeoutError`.
+      Cf also :meth:`.RobotAction.wait`.
+    - ``process``: if ``True``, the body of the action runs in a worker
+      process (for CPU-bound actions, that would otherwise hold the GIL).
+      Cf :mod:`robots.concurrency.processes` for the restrictions.
+    - ``cache``: memoizes the action (cf :mod:`robots.concurrency.cache`):
+      calls with the same arguments return the same future. Either the time
+      (in seconds) results are kept, ``True`` to keep them until evicted, or
+      an :class:`.ActionCache`.
+
+    .. code-block:: python
+
+        @action(priority = PRIORITY_CRITICAL, preempt = True)
+        @lock(WHEELS)
+        def stop_on_bumper(robot):
+            robot.stop()
+
+    Generator functions are run as cooperative actions, all sharing a single
+    thread (cf :mod:`robots.concurrency.coroutines`).
+
     """
+    if fn is None:
+        # used as @action(...)
+        return lambda fn: action(fn, priority, preempt, timeout, process, cache)
 
     # wrapper for the original function that locks/unlocks shared
     # resources
     def lockawarefn(future,actionname,*args, **kwargs):
 
+        cpu = thread_time() if thread_time else None
+
         try:
             # we acquire resources *within the future thread* that
             # we want to *wait* for.
@@ -60,8 +101,17 @@ def action(fn):
                         if res.owner is not None:
                             need_to_wait = True
                             logger.info("Robot action <%s> is waiting on resource %s" % (actionname, res)) #fn.__name__
-                        res.acquire(wait, acquirer = fn.__name__)
+                            trace(future, WAIT_RESOURCE, res.name)
+                        start = get_clock().time()
+                        try:
+                            res.acquire(wait, acquirer = fn.__name__,
+                                        priority = future.priority,
+                                        action = future,
+                                        preempt = preempt)
+                        finally:
+                            future.resource_wait += get_clock().time() - start
                         if need_to_wait:
+                            trace(future, ACQUIRED_RESOURCE, res.name)
                             logger.info("Robot action <%s> has acquired resource %s" % (actionname, res)) #fn.__name__
                         else:
                             logger.info("Robot action <%s> acquired free resource %s  " %(actionname, res))
@@ -75,10 +125,17 @@ def action(fn):
  
         try:
             future.has_acquired_resource = True
+            if timeout is not None:
+                future.set_deadline(get_clock().time() + timeout)
             threading.current_thread().name = "Robot Action %s (running)" % actionname #fn.__name__
             logger.debug("Starting action <%s> now." % actionname) #fn.__name__
+            trace(future, START)
             try:
-                result = fn(*args, **kwargs)
+                if process:
+                    robot = args[0]
+                    result = robot.executor.processes.run(fn, *args[1:], **kwargs)
+                else:
+                    result = fn(*args, **kwargs)
             except TypeError:
                 logger.error("Exception when invoking action <%s>. Did you forget to add the parameter 'robot'?" % actionname) #fn.__name__
                 raise
@@ -92,11 +149,34 @@ def action(fn):
                 for res, wait in fn._locked_res:
                     res.release()
 
+            if cpu is not None:
+                future.cpu_time = thread_time() - cpu
+
             threading.current_thread().name = "Idle Robot action thread"
 
 
+    # wrapper for generator functions, run as coroutines by the executor
+    def coroutinefn(future, actionname, *args, **kwargs):
+        future.has_acquired_resource = True
+        if timeout is not None:
+            future.set_deadline(get_clock().time() + timeout)
+        trace(future, START)
+        if hasattr(fn, "_locked_res"):
+            # resources locked without waiting are released on completion
+            future.add_done_callback(lambda f: [res.release() for res, wait in fn._locked_res])
+        return fn(*args, **kwargs)
+
+    if inspect.isgeneratorfunction(fn):
+        if process:
+            raise Exception("Coroutine action <%s> can not run in a worker process" % fn.__name__)
+        if any(wait for res, wait in getattr(fn, "_locked_res", [])):
+            raise Exception("Coroutine action <%s> can only lock resources with 'wait = False'" % fn.__name__)
+        lockawarefn = coroutinefn
+        lockawarefn._coroutine = True
+
     lockawarefn.__name__ = fn.__name__
     lockawarefn.__doc__ = fn.__doc__
+    lockawarefn._priority = priority
 
 
     # wrapper that submits the function to the executor and returns
@@ -144,9 +224,26 @@ def action(fn):
 
             return future
 
+    if cache is not None and cache is not False:
+        if not isinstance(cache, ActionCache):
+            cache = ActionCache(ttl = None if cache is True else cache)
+
+        submitfn = innerfunc
+
+        # wrapper that returns the cached future, if any
+        def innerfunc(*args, **kwargs):
+            key = ActionCache.key(args[0] if args else None, args[1:], kwargs)
+            if key is None: # unhashable arguments
+                return submitfn(*args, **kwargs)
+            return cache.get(key, lambda: submitfn(*args, **kwargs), args[0])
+
+        innerfunc.cache = cache
+
     innerfunc.__name__ = fn.__name__
     innerfunc.__doc__ = fn.__doc__
     innerfunc._action = True
+    innerfunc._priority = priority
+    innerfunc._fn = fn # the worker processes run the original function
 
     return innerfunc
 
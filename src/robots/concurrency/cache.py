@@ -0,0 +1,160 @@
+# coding=utf-8
+"""
+Memoization of the results of robot actions.
+
+Actions that are pure queries (looking up the pose of a place, computing a
+path...) can be declared with ``@action(cache = ...)``: calling them again
+with the same arguments returns the future of a previous call instead of
+starting a new action.
+
+.. code-block:: python
+
+    @action(cache = 10) # results are kept 10 seconds
+    def lookup_place(robot, name):
+        ...
+
+    robot.lookup_place("kitchen") # starts the action
+    robot.lookup_place("kitchen") # returns the same RobotAction
+
+Calls made while the action is still running share the same future as well:
+cancelling it cancels it for every caller. Actions that fail (exception,
+cancellation, missed deadline) are not cached.
+"""
+import logging; logger = logging.getLogger("robots.actions")
+
+import threading
+import weakref
+from collections import OrderedDict
+
+from .clock import current_waker, get_clock
+
+class ActionCache:
+    """ A LRU cache of action futures, keyed by the arguments of the action.
+
+    :param ttl: how long (in seconds of the pyRobots clock) the result of a
+      completed action is kept. ``None`` means forever.
+    :param maxsize: maximum number of entries (the least recently used
+      entries are evicted first)
+    """
+
+    def __init__(self, ttl = None, maxsize = 128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        # key -> [future, expiry, wakers of the calls waiting for the action
+        # to start (None once started)]
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+        # robots are only referenced by their id in the keys (the cache must
+        # not keep them alive): their entries are dropped once collected.
+        self._robots = {} # id(robot) -> weak reference to the robot
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "action cache (%d entries, %d hits, %d misses)" % (len(self._entries), self.hits, self.misses)
+
+    @staticmethod
+    def key(robot, args, kwargs):
+        """ Returns the cache key of a call, or ``None`` if the arguments
+        are not hashable.
+        """
+        key = (id(robot), args, frozenset(kwargs.items()))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key, start, robot = None):
+        """ Returns the cached future for ``key`` if any, or calls
+        ``start()`` to start the action, and caches its future.
+
+        :param robot: the robot the action is started for: its entries are
+          dropped once it is garbage collected.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and (entry[1] is None or get_clock().time() < entry[1]):
+                self._entries[key] = entry # most recently used
+                self.hits += 1
+                starting = False
+            else:
+                # the slot is reserved, and the action started outside the
+                # lock: concurrent calls with the same key wait for it
+                self.misses += 1
+                entry = [None, None, set()]
+                self._entries[key] = entry
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last = False)
+
+                if robot is not None and id(robot) not in self._robots:
+                    self._robots[id(robot)] = weakref.ref(robot, lambda ref, robot_id = id(robot): self._forget(robot_id))
+                starting = True
+
+        if not starting:
+            # parked on the clock: the wait can be interrupted by a signal
+            # (ie, cancelled), and does not hold a simulated time back
+            clock = get_clock()
+            waker = current_waker()
+            while True:
+                with self._lock:
+                    if entry[2] is None:
+                        break
+                    entry[2].add(waker)
+                clock.park(waker)
+
+            if entry[0] is None: # the call that reserved the slot did not cache it
+                return self.get(key, start, robot)
+            return entry[0]
+
+        future = None
+        try:
+            future = start()
+        finally:
+            with self._lock:
+                if hasattr(future, "add_done_callback"):
+                    entry[0] = future
+                elif self._entries.get(key) is entry:
+                    # not run by the executor (immediate mode, resource not
+                    # available...) or failed to start: not cached
+                    del self._entries[key]
+                waiters, entry[2] = entry[2], None
+
+            for waker in waiters:
+                waker.set()
+
+        if entry[0] is not None:
+            future.add_done_callback(lambda f: self._completed(key, entry))
+        return future
+
+    def _forget(self, robot_id):
+        """ Drops the entries of a garbage collected robot.
+        """
+        with self._lock:
+            self._robots.pop(robot_id, None)
+            for key in [k for k in self._entries if k[0] == robot_id]:
+                del self._entries[key]
+
+    def _completed(self, key, entry):
+        future = entry[0]
+        failed = future.cancelled() or future.exception(0) is not None \
+                 or future._cancel_signaled is not None or future.deadline_missed
+
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                return # already evicted
+
+            if failed:
+                del self._entries[key]
+            elif self.ttl is not None:
+                entry[1] = get_clock().time() + self.ttl
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
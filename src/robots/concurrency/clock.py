@@ -0,0 +1,297 @@
+# coding=utf-8
+"""
+Clocks used by pyRobots to read the time and to wait.
+
+By default, pyRobots uses a :class:`RealClock` (ie, the wall clock). A
+:class:`SimulatedClock` can be installed instead, typically when testing
+mission scripts in dummy mode:
+
+.. code-block:: python
+
+    with MyRobot(dummy = True, clock = SimulatedClock()) as robot:
+        robot.patrol().wait() # takes 2 hours of simulated time, a few seconds
+                              # of wall clock time
+
+With a simulated clock, the time only advances when all the robot actions (and
+event monitors) are blocked, and it then jumps straight to the next deadline.
+
+Threads block on the clock by *parking* on their :class:`Waker`. A waker is set
+either by the clock itself (when the deadline is reached), or by whatever the
+thread was waiting for (a signal like cancellation, a future that completes,
+etc.).
+"""
+import logging; logger = logging.getLogger("robots.clock")
+
+import time
+import heapq
+import itertools
+import threading
+
+class Waker(object):
+    """ A per-thread wake-up flag, used to unblock a thread parked on the clock.
+
+    Robot actions and event monitors (instances of
+    :class:`~robots.concurrency.concurrency.SignalingThread`) own a waker
+    (``thread.wakeup``) that is also set when the thread is signaled. Other
+    threads get one from :func:`current_waker`.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+        # bookkeeping of the clocks
+        self._parked_thread = None
+        self._timer = None
+
+    def set(self):
+        _clock.wake(self)
+
+    def is_set(self):
+        return self._event.is_set()
+
+_local = threading.local()
+
+def current_waker():
+    """ Returns the :class:`Waker` of the calling thread.
+    """
+    waker = getattr(threading.current_thread(), "wakeup", None)
+    if isinstance(waker, Waker):
+        return waker
+
+    waker = getattr(_local, "waker", None)
+    if waker is None:
+        waker = _local.waker = Waker()
+    return waker
+
+
+class Clock(object):
+    """ Base class for clocks.
+    """
+
+    def time(self):
+        raise NotImplementedError()
+
+    def park(self, waker, deadline = None):
+        """ Blocks the calling thread until ``waker`` is set, or until the clock
+        reaches ``deadline`` (if not ``None``).
+
+        Spurious wake-ups may occur: callers must check again the condition
+        they are waiting for.
+        """
+        raise NotImplementedError()
+
+    def wake(self, waker):
+        """ Sets the waker, thus unblocking its thread if parked.
+        """
+        waker._event.set()
+
+    def add_participant(self, thread):
+        """ Registers a thread (a robot action or an event monitor) whose
+        activity prevents the time from advancing (only meaningful for
+        simulated clocks).
+
+        Must be called *before* the thread is started.
+        """
+        pass
+
+    def remove_participant(self, thread):
+        pass
+
+    def sleep(self, duration):
+        """ Blocks the calling thread for ``duration`` seconds.
+
+        If the calling thread is a robot action, the sleep is interrupted as
+        soon as the action is signaled (eg, cancelled), and the signal is
+        raised.
+        """
+        waker = current_waker()
+        deadline = self.time() + duration
+        while self.time() < deadline:
+            # if we have been woken up by a signal, it is raised as soon as we
+            # are back in this frame.
+            self.park(waker, deadline)
+
+class RealClock(Clock):
+    """ The wall clock. This is the default clock.
+    """
+
+    # maximum duration of a single wait of the main thread, so that it still
+    # gets a chance to process KeyboardInterrupt (Python 2 locks can not be
+    # interrupted).
+    MAX_PARK_DURATION = 1. # sec
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._timers = None
+
+    def time(self):
+        return time.time()
+
+    def _timer_wheel(self):
+        with self._lock:
+            if self._timers is None:
+                # imported here: the timers module imports this one
+                from .timers import TimerWheel
+                self._timers = TimerWheel(resolution = 0.005, slots = 1024, clock = self)
+            return self._timers
+
+    def park(self, waker, deadline = None):
+        thread = threading.current_thread()
+        if not isinstance(thread, threading._MainThread):
+            # Python 2 waits with a timeout poll the lock (with up to 50ms
+            # of latency): only use a timeout when needed. Deadlines are
+            # handed over to a single timer thread that sets the waker, so
+            # that only this thread polls, whatever the number of sleepers.
+            if deadline is None:
+                waker._event.wait()
+                waker._event.clear()
+                return
+
+            timers = self._timer_wheel()
+            if thread is not timers._thread:
+                if deadline > time.time():
+                    # the timer is cancelled by whoever wakes us up (cf
+                    # wake): a signal (like a cancellation) is raised as soon
+                    # as we are back in this frame
+                    with self._lock:
+                        if not waker._event.is_set():
+                            waker._timer = timers.schedule(deadline, waker.set)
+                    waker._event.wait()
+                waker._event.clear()
+                return
+
+        timeout = self.MAX_PARK_DURATION
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+
+        if timeout > 0:
+            waker._event.wait(timeout)
+        waker._event.clear()
+
+    def wake(self, waker):
+        with self._lock:
+            timer, waker._timer = waker._timer, None
+            waker._event.set()
+        if timer is not None:
+            self._timers.cancel(timer)
+
+class SimulatedClock(Clock):
+    """ A clock whose time only advances when every participant (robot
+    actions and event monitors) is parked on the clock.
+
+    Threads that are not participants (like the main thread) only count
+    while they are themselves parked: a main thread doing something else
+    (including calling :func:`time.sleep`) does not hold the time back.
+
+    When everyone is blocked, the time immediately jumps to the earliest
+    deadline, and the corresponding threads are woken up.
+
+    Note that actions blocked on something else than the clock (a plain
+    :func:`time.sleep`, a middleware call...) hold the time until they return.
+
+    :param start: initial time of the clock (default: 0)
+    """
+
+    def __init__(self, start = 0.):
+        self._now = float(start)
+
+        self._lock = threading.RLock()
+        self._timers = [] # heap of [deadline, seq, waker]
+        self._seq = itertools.count()
+
+        self._participants = set()
+        self._parked = {} # thread -> waker
+
+    def time(self):
+        return self._now
+
+    def add_participant(self, thread):
+        with self._lock:
+            self._participants.add(thread)
+
+    def remove_participant(self, thread):
+        with self._lock:
+            self._participants.discard(thread)
+            self._advance()
+
+    def park(self, waker, deadline = None):
+        with self._lock:
+            if waker._event.is_set() or (deadline is not None and deadline <= self._now):
+                waker._event.clear()
+                return
+
+            thread = threading.current_thread()
+            waker._parked_thread = thread
+            self._parked[thread] = waker
+            if deadline is not None:
+                waker._timer = [deadline, next(self._seq), waker]
+                heapq.heappush(self._timers, waker._timer)
+
+            self._advance()
+
+        # the unparking bookkeeping is done by whoever wakes us up (cf wake),
+        # so that the time can not advance while we are about to run again.
+        # (no timeout here: Python 2 timed waits are polling loops, far too
+        # slow for a clock that may jump thousands of times per second)
+        waker._event.wait()
+        waker._event.clear()
+
+    def wake(self, waker):
+        with self._lock:
+            self._unpark(waker)
+            waker._event.set()
+
+    def _unpark(self, waker):
+        if waker._parked_thread is not None:
+            self._parked.pop(waker._parked_thread, None)
+            waker._parked_thread = None
+        waker._timer = None
+
+    def _advance(self):
+        """ If every participant is parked, moves the time to the next deadline
+        and wakes up the corresponding threads.
+
+        Must be called with the lock held.
+        """
+        if not self._parked:
+            return
+
+        for thread in self._participants:
+            if thread not in self._parked:
+                return
+
+        # discard timers of threads that have been woken up in the meantime
+        while self._timers and self._timers[0][2]._timer is not self._timers[0]:
+            heapq.heappop(self._timers)
+
+        if not self._timers:
+            # everybody waits without deadline: only an external event can
+            # unblock us
+            return
+
+        self._now = max(self._now, self._timers[0][0])
+
+        while self._timers and self._timers[0][0] <= self._now:
+            timer = heapq.heappop(self._timers)
+            waker = timer[2]
+            if waker._timer is timer:
+                self._unpark(waker)
+                waker._event.set()
+
+_clock = RealClock()
+
+def get_clock():
+    """ Returns the clock currently used by pyRobots.
+    """
+    return _clock
+
+def set_clock(clock):
+    """ Sets the clock used by pyRobots (executor, events, resources,
+    ``robot.sleep``...).
+
+    The clock is global to the process: it applies to all the robots (a
+    robot created with ``GenericRobot(clock = ...)`` sets it, and restores
+    the previous one when closed). It should be set before any action is
+    started.
+    """
+    global _clock
+    _clock = clock
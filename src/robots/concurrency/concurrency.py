@@ -22,6 +22,7 @@ Helpful debugging commands::
 import logging; logger = logging.getLogger("robots.actions")
 
 import sys
+import time
 
 import uuid
 
@@ -29,8 +30,15 @@ MAX_FUTURES = 20
 MAX_TIME_TO_COMPLETE = 1 # sec: time allowed to tasks to complete when cancelled. If they take more than that, force termination.
 ACTIVE_SLEEP_RESOLUTION = 0.1 # sec
 
+# action priorities (higher values take precedence). Actions with a priority
+# above PRIORITY_NORMAL are not subject to MAX_FUTURES.
+PRIORITY_LOW = -10
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10
+PRIORITY_CRITICAL = 100
+
 try:
-    from concurrent.futures import Future, TimeoutError
+    from concurrent.futures import Future, TimeoutError, wait as wait_futures
 except ImportError:
     import sys
     sys.stderr.write("[error] install python-concurrent.futures\n")
@@ -45,6 +53,12 @@ from collections import deque
 import traceback
 
 from .signals import ActionCancelled, ActionPaused
+from .clock import Waker, current_waker, get_clock
+from .timers import TimerWheel
+from .processes import ProcessPool
+from .tracing import Tracer, trace, SUBMIT, PARENT, END, CANCEL
+from .metrics import ActionMetrics
+from .profiler import SamplingProfiler
 
 
 class SignalingThread(threading.Thread):
@@ -52,10 +66,28 @@ class SignalingThread(threading.Thread):
         threading.Thread.__init__(self, *args, **kwargs)
         self.debugger_trace = None
 
+        # set every time a signal is sent to the thread, to wake it up if it
+        # is currently parked on the clock (sleeping, waiting for a
+        # sub-action...)
+        self.wakeup = Waker()
+
+    def start(self):
+        # robot actions and event monitors prevent the (simulated) time from
+        # advancing while they are not blocked on the clock. This must be
+        # registered before the thread actually starts.
+        get_clock().add_participant(self)
+        try:
+            threading.Thread.start(self)
+        except:
+            get_clock().remove_participant(self)
+            raise
+
     def cancel(self):
         self.__cancel = True
+        self.wakeup.set()
     def pause(self):
         self.__pause = True
+        self.wakeup.set()
 
     def _Thread__bootstrap(self):
         """ The name come from Python name mangling for 
@@ -74,17 +106,34 @@ class SignalingThread(threading.Thread):
         sys.settrace(self.__signal_emitter)
 
         self.name = "Ranger action thread (initialization)"
-        super(SignalingThread, self)._Thread__bootstrap()
+        try:
+            super(SignalingThread, self)._Thread__bootstrap()
+        finally:
+            # this frame is not traced (the trace function has been set
+            # within it), but the functions it calls would be: no signal
+            # must interrupt the clean-up.
+            sys.settrace(None)
+            self.on_exit()
+            get_clock().remove_participant(self)
+
+    def on_exit(self):
+        """ Called when the thread terminates, whatever the signals it
+        received.
+        """
+        pass
 
     def __signal_emitter(self, frame, event, arg):
         if self.__cancel:
-            if frame.f_globals["__name__"] == "threading":
+            if frame.f_globals["__name__"] == "threading" or \
+               (frame.f_back is not None and frame.f_back.f_globals["__name__"] == "threading"):
                 # Raising exception at uncontrolled time is a dangerous sport,
                 # especially if the thread is in the middle of locking/unlocking shared resources
                 # like (in our case) setting result in futures and reading them.
                 # After thinking about it for a day, I could not find any good solution except for
                 # postponing raising the signals until out of the threading module. This is not
                 # very nice, but seem to work out well.
+                # Same for the entry point of the thread (eg RobotActionThread.run), that
+                # does the bookkeeping of the thread: the signal would escape the thread.
 
                 #logger.debug("Thread <%s> in threading module. Postponing cancelation" % self.name)
                 pass
@@ -121,21 +170,39 @@ class RobotActionThread(SignalingThread):
 
     def run(self):
 
-        if not self.future.set_running_or_notify_cancel():
+        try:
+            if not self.future.set_running_or_notify_cancel():
+                return
+        except ActionCancelled:
+            # cancelled before the action could even start (the future is
+            # completed in on_exit)
             return
 
         try:
             result = self.fn(self.future, str(self.future),*self.args, **self.kwargs)
             self.future.set_result(result)
             logger.debug("Action <%s>: completed." % str(self.future))
+        except ActionCancelled:
+            # cancelled outside of the action itself (while starting it, or
+            # completing its future)
+            if not self.future.done():
+                self.future.set_result(None)
         except BaseException:
             e = sys.exc_info()[1]
             logger.error("Exception in action <%s>: %s"%(str(self.future), e)) #self.fn.__name__
             logger.error(traceback.format_exc())
             self.future.set_exception(e)
 
+    def on_exit(self):
+        if not self.future.done():
+            logger.debug("Action <%s>: cancelled before starting." % str(self.future))
+            self.future.set_result(None)
+
 
 class RobotAction(Future):
+
+    coroutine = False
+
     def __init__(self, actionname):
         Future.__init__(self)
 
@@ -149,6 +216,90 @@ class RobotAction(Future):
 
         self.has_acquired_resource = False
 
+        self.priority = PRIORITY_NORMAL
+
+        self.executor = None
+        self.deadline = None # clock time at which the action is cancelled if still running
+        self.deadline_missed = False
+        self._timer = None
+
+        self.cancel_latency = None # time between the cancellation signal and the completion
+        self._cancel_signaled = None
+
+        self.waiting_for = None # the sub-action whose result this action currently waits for
+
+        # timings (cf robots.concurrency.metrics)
+        self.submitted_at = get_clock().time()
+        self.wall_time = None # set on completion
+        self.resource_wait = 0.
+        self.subaction_wait = 0.
+        self.cpu_time = None
+
+    def set_deadline(self, deadline):
+        """ Cancels the action if it is still running at time ``deadline``
+        (as given by the pyRobots clock). If several deadlines are set, the
+        earliest applies.
+
+        The deadline is enforced by the timer wheel of the executor.
+        """
+        if self.executor is None or self.done():
+            return
+        if self.deadline is not None and self.deadline <= deadline:
+            return
+
+        timers = self.executor.timers
+        if self._timer is not None:
+            timers.cancel(self._timer)
+        else:
+            self.add_done_callback(self._clear_deadline)
+
+        self.deadline = deadline
+        self._timer = timers.schedule(deadline, self._deadline_reached)
+
+    def _clear_deadline(self, future):
+        timer = self._timer
+        if timer is not None:
+            self.executor.timers.cancel(timer)
+
+    def _deadline_reached(self):
+        if self.done():
+            return
+        self.deadline_missed = True
+        self.executor.deadline_misses += 1
+        logger.warning("Action <%s> missed its deadline: cancelling it" % self)
+        self.signal_cancel()
+
+    def signal_cancel(self):
+        """ Sends the cancellation signal to the action and all its
+        sub-actions, without waiting for them to complete.
+        """
+        thread = self.thread() if self.thread else None # weakref!
+        if thread is not None:
+            if self._cancel_signaled is None:
+                self._cancel_signaled = time.time()
+                self.add_done_callback(self._record_cancel_latency)
+                trace(self, CANCEL)
+            thread.cancel()
+
+        for weak_subaction in self.subactions:
+            subaction = weak_subaction()
+            if subaction:
+                subaction.signal_cancel()
+
+    def _record_cancel_latency(self, future):
+        self.cancel_latency = time.time() - self._cancel_signaled
+        logger.debug("Action <%s>: completed %.3fs after cancellation" % (self, self.cancel_latency))
+
+    def subtree(self):
+        """ Returns the list of this action and all its (live) descendants.
+        """
+        actions = [self]
+        for weak_subaction in self.subactions:
+            subaction = weak_subaction()
+            if subaction:
+                actions += subaction.subtree()
+        return actions
+
     def add_subaction(self, action):
         self.subactions = [a for a in self.subactions if a() is not None and a().thread() is not None]
         self.subactions.append(action)
@@ -156,12 +307,13 @@ class RobotAction(Future):
 
     def set_parent(self, action):
         self.parent_action = action
+        trace(self, PARENT, action().id)
 
     def childof(self, action):
         """ Returns true if this action is a child of the given action, ie, has
         been spawned from the given action or any of its descendants.
         """
-        parent = self.parent_action() # weakref!
+        parent = self.parent_action() if self.parent_action else None # weakref!
         if parent is None:
             return False
         if parent is action:
@@ -181,29 +333,20 @@ class RobotAction(Future):
             logger.debug("Action <%s>: already done" % self)
             return
 
-        # first, cancel myself (to make sure I won't restart subactions)
-        logger.debug("Action <%s>: signaling cancelation to action's thread" % self)
-        thread.cancel()
-
-        # then, tell all the subactions that they should stop
-        # (can not do that in the thread's cancel (_signal_emitter), because the
-        # thread may hold locks that are not released until the exception is raised and
-        # the context manager are left)
-        logger.debug("Action <%s>: %s subactions to cancel" % (self, len(self.subactions))) #self.actionname
-
-        for weak_subaction in self.subactions:
-            subaction = weak_subaction()
-            if subaction:
-                logger.debug("Action <%s>: Cancelling subaction %s..." % (self, subaction))
-                subaction.cancel()
-
-
-        # then, make sure everybody actually terminates
-        logger.debug("Action <%s>: now waiting for completion" % self)
-        try:
-            self.exception(timeout = MAX_TIME_TO_COMPLETE) # waits this amount of time for the task to effectively complete
-        except TimeoutError:
-            raise RuntimeError("Unable to cancel action %s (still running %s after cancellation)!" % (self, MAX_TIME_TO_COMPLETE))
+        # first, signal the whole subtree at once, starting with myself (to
+        # make sure I won't restart subactions). The signals are only raised
+        # once each thread is out of the threading module, so threads
+        # holding locks are not interrupted while doing so.
+        logger.debug("Action <%s>: signaling cancelation to the action's thread and its subactions" % self)
+        self.signal_cancel()
+
+        # then, make sure everybody actually terminates: all the actions are
+        # waited for concurrently, with a single deadline
+        pending = [a for a in self.subtree() if not a.done()]
+        logger.debug("Action <%s>: now waiting for completion of %s actions" % (self, len(pending)))
+        done, not_done = wait_futures(pending, timeout = MAX_TIME_TO_COMPLETE)
+        if not_done:
+            raise RuntimeError("Unable to cancel action %s (%s still running %s after cancellation)!" % (self, ", ".join(str(a) for a in not_done), MAX_TIME_TO_COMPLETE))
         logger.debug("Action <%s>: successfully cancelled" % self)
         #t = 0
         #while t < MAX_TIME_TO_COMPLETE:
@@ -215,24 +358,55 @@ class RobotAction(Future):
         #raise RuntimeError("Unable to cancel action %s (still running %s after cancellation)!" % (self.actionname, MAX_TIME_TO_COMPLETE))
 
     def result(self):
+        if not self.done() and getattr(threading.current_thread(), "scheduler", None) is not None:
+            raise RuntimeError("Coroutine actions can not block on %s: use 'yield action' instead" % self)
+
         if self.parent_action and self.parent_action():
             threading.current_thread().name = "Action %s (waiting for sub-action %s)" % (self.parent_action(), self)
         else:
             threading.current_thread().name = "Main thread (waiting for sub-action %s)" % self
 
 
-        # active wait! Instead of blocking on the condition variable in super.result()
-        # we do an active wait to make sure we can cancel/suspend the action via our
-        # __signal_emitter trace function
-        while True:
-            try:
-                return super(RobotAction, self).result(ACTIVE_SLEEP_RESOLUTION)
-            except TimeoutError:
-                pass
+        # Instead of blocking on the condition variable in super.result(), we
+        # park on the clock: this way, the wait is interrupted when the action
+        # is cancelled/suspended via our __signal_emitter trace function.
+        waker = current_waker()
+        self.add_done_callback(lambda f: waker.set())
+
+        # record who waits for us, for the wait-for graph (cf robots.resources.metrics)
+        current = threading.current_thread()
+        waiter = current.future if isinstance(current, RobotActionThread) else None
+        if waiter is not None:
+            waiter.waiting_for = self
 
-    def wait(self):
-        """ alias for result()
+        clock = get_clock()
+        start = clock.time()
+        try:
+            while not self.done():
+                clock.park(waker)
+        finally:
+            if waiter is not None:
+                waiter.waiting_for = None
+                waiter.subaction_wait += clock.time() - start
+
+        result = super(RobotAction, self).result()
+        if self.deadline_missed:
+            raise TimeoutError("Action %s cancelled: deadline missed" % self)
+        return result
+
+    def wait(self, timeout = None, deadline = None):
+        """ Waits for the action to complete, and returns its result.
+
+        If ``timeout`` (in seconds) or ``deadline`` (a time of the pyRobots
+        clock) are given, the action is cancelled if it does not complete
+        in time, and :class:`TimeoutError` is raised.
         """
+        if timeout is not None:
+            end = get_clock().time() + timeout
+            deadline = end if deadline is None else min(deadline, end)
+        if deadline is not None:
+            self.set_deadline(deadline)
+
         return self.result()
 
     def __lt__(self, other):
@@ -270,9 +444,35 @@ class FakeFuture:
         self._result = result
     def result(self):
         return self._result
-    def wait(self):
+    def wait(self, timeout = None, deadline = None):
         return self._result
 
+class Cancellation:
+    """ Handle on a set of actions being cancelled, returned by
+    :meth:`RobotActionExecutor.cancel_all`.
+    """
+
+    def __init__(self, actions):
+        self.actions = actions
+
+    def pending(self):
+        """ Returns the list of the actions that are not stopped yet.
+        """
+        return [a for a in self.actions if not a.done()]
+
+    def done(self):
+        return not self.pending()
+
+    def wait(self, timeout = MAX_TIME_TO_COMPLETE):
+        """ Blocks until all the actions are stopped.
+
+        :raises RuntimeError: if some actions are still running after
+          ``timeout`` seconds.
+        """
+        done, not_done = wait_futures(self.pending(), timeout = timeout)
+        if not_done:
+            raise RuntimeError("Unable to cancel actions %s (still running %s after cancellation)!" % (", ".join(str(a) for a in not_done), timeout))
+
 class RobotActionExecutor():
 
     def __init__(self):
@@ -281,12 +481,35 @@ class RobotActionExecutor():
         self.futures = []
 
         self.futures_lock = threading.Lock()
+        self._pruned_size = 0 # size of the list of futures after the last pruning
+
+        # deadlines of all the actions
+        self.timers = TimerWheel()
+        self.deadline_misses = 0
+
+        # imported here, as coroutines depend on this module
+        from .coroutines import CoroutineScheduler
+        self.scheduler = CoroutineScheduler()
+
+        # worker processes of the CPU-bound actions
+        self.processes = ProcessPool()
+
+        self.tracer = None # cf start_tracing
+
+        # timings of the completed actions, by action name
+        self.metrics = ActionMetrics()
+
+        self.profiler = None # cf start_profiling
 
     def submit(self, fn, *args, **kwargs):
 
         with self.futures_lock:
-            self.futures = [f for f in self.futures if not f.done()]
-
+            # completed futures are pruned once the list has doubled since
+            # the last pruning: submitting stays O(1) amortized, even with
+            # thousands of (coroutine) actions alive.
+            if len(self.futures) >= 2 * self._pruned_size:
+                self.futures = [f for f in self.futures if not f.done()]
+                self._pruned_size = max(len(self.futures), 16)
 
         name = fn.__name__
         if args and not kwargs:
@@ -297,10 +520,44 @@ class RobotActionExecutor():
             name += "(%s, " % ", ".join([str(a) for a in args[1:]])
             name += "%s)" % ", ".join(["%s=%s" % (str(k), str(v)) for k, v in kwargs.items()])
 
-        if len([f for f in self.futures if f.has_acquired_resource]) > MAX_FUTURES:
+        current_action = self.get_current_action()
+
+        # actions without explicit priority inherit the priority of the
+        # action that spawns them
+        priority = getattr(fn, "_priority", None)
+        if priority is None:
+            priority = current_action.priority if current_action else PRIORITY_NORMAL
+
+        # coroutine actions do not need a thread each: they are not limited
+        coroutine = getattr(fn, "_coroutine", False)
+
+        if not coroutine and priority <= PRIORITY_NORMAL and len(self.futures) > MAX_FUTURES \
+           and len([f for f in self.futures if f.has_acquired_resource and not f.coroutine and not f.done()]) > MAX_FUTURES:
             raise RuntimeError("You have more than %s actions running in parallel! Likely a bug in your application logic!" % MAX_FUTURES)
 
-        f = RobotAction(name)
+        if coroutine:
+            from .coroutines import CoroutineAction
+            f = CoroutineAction(name, self.scheduler)
+        else:
+            f = RobotAction(name)
+        f.priority = priority
+        f.executor = self
+        f.add_done_callback(lambda f: self.metrics.record(fn.__name__, f))
+
+        if self.tracer is not None:
+            self.tracer.record(SUBMIT, f)
+            f.add_done_callback(lambda f: trace(f, END))
+
+        if coroutine:
+            if current_action:
+                f.set_parent(weakref.ref(current_action))
+                current_action.add_subaction(weakref.ref(f))
+
+            with self.futures_lock:
+                self.futures.append(f)
+
+            self.scheduler.spawn(f, fn(f, str(f), *args, **kwargs))
+            return f
 
         initialized = threading.Event()
 
@@ -309,72 +566,126 @@ class RobotActionExecutor():
         f.set_thread(weakref.ref(t))
 
 
-        current_action = self.get_current_action()
         if current_action:
             f.set_parent(weakref.ref(current_action))
             current_action.add_subaction(weakref.ref(f))
 
 
+        # registered before starting, so that the action can be found by
+        # get_current_action() (eg, to be the parent of its own sub-actions)
+        with self.futures_lock:
+            self.futures.append(f)
+
         t.start()
 
         while not initialized.is_set():
             # waits for the thread to actually start
             pass
 
-        with self.futures_lock:
-            self.futures.append(f)
-
         return f
 
     def get_current_action(self):
         """Returns the RobotAction linked to the current thread.
         """
-        thread_id = threading.current_thread().ident
-
-        with self.futures_lock:
+        current = threading.current_thread()
 
-            for f in self.futures:
-                if not f.done():
+        scheduler = getattr(current, "scheduler", None)
+        if scheduler is not None:
+            # the thread running the coroutine actions
+            return scheduler.current
 
-                    thread = f.thread() # weak ref
-                    if thread is not None and thread.ident == thread_id:
-                        return f
+        if isinstance(current, RobotActionThread) and not current.future.done():
+            return current.future
 
         logger.debug("The current thread (<%s>) is not a robot action (main thread?)" % threading.current_thread().name)
         return None
 
-    def cancel_all(self):
-        """ Blocks until all the currently running actions are actually stopped.
+    def start_tracing(self, capacity = 65536):
+        """ Starts recording the lifecycle events of the actions (cf
+        :mod:`robots.concurrency.tracing`).
+
+        :param capacity: maximum number of events kept (the oldest ones are
+          overwritten)
+        :returns: the :class:`.Tracer`
         """
+        self.tracer = Tracer(capacity)
+        return self.tracer
 
+    def stop_tracing(self):
+        """ Stops recording the lifecycle events of the actions.
+
+        :returns: the :class:`.Tracer`, with the recorded events
+        """
+        tracer, self.tracer = self.tracer, None
+        return tracer
+
+    def start_profiling(self, interval = 0.01, **kwargs):
+        """ Starts sampling the stacks of the running actions every
+        ``interval`` seconds (cf :mod:`robots.concurrency.profiler`).
+
+        Other keyword arguments are passed to :class:`.SamplingProfiler`.
+
+        :returns: the :class:`.SamplingProfiler`
+        """
+        self.stop_profiling()
+        self.profiler = SamplingProfiler(self, interval, **kwargs)
+        self.profiler.start()
+        return self.profiler
+
+    def stop_profiling(self):
+        """ Stops the sampling profiler.
+
+        :returns: the :class:`.SamplingProfiler`, with its samples (``None``
+          if the profiler was not started)
+        """
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None:
+            profiler.stop()
+        return profiler
+
+    def cancel_all(self, wait = True):
+        """ Cancels all the currently running actions.
+
+        The actions are all signaled at once, without holding the executor's
+        lock (new actions can be started, and running ones looked up, in the
+        meantime).
+
+        :param wait: if ``True`` (default), blocks until all the actions are
+          actually stopped. Otherwise, returns right after signaling them.
+        :returns: a :class:`Cancellation` handle to wait for the actions to
+          be stopped.
+        """
         with self.futures_lock:
-            for f in self.futures:
-                if not f.done():
-                    f.cancel()
+            futures = [f for f in self.futures if not f.done()]
 
-            self.futures = []
+        return self._cancel(futures, wait)
 
-    def cancel_all_others(self):
-        """ Blocks until all the currently running actions *except the calling
-        one* are actually stopped.
+    def cancel_all_others(self, wait = True):
+        """ Cancels all the currently running actions *except the calling
+        one* (cf :meth:`cancel_all`).
 
         """
 
-        thread_id = threading.current_thread().ident
+        # compares actions, not threads: coroutine actions all share the
+        # thread of the scheduler
+        current = self.get_current_action()
 
+        futures = []
         with self.futures_lock:
             for f in self.futures:
-                if not f.done():
-                    thread = f.thread() # weak ref
-                    if thread is not None and thread.ident == thread_id:
-                        myself = f
-                        continue
-
-                    f.cancel()
+                if not f.done() and f is not current:
+                    futures.append(f)
 
-            self.futures = [myself]
+        return self._cancel(futures, wait)
 
+    def _cancel(self, futures, wait):
+        for f in futures:
+            f.signal_cancel()
 
+        cancellation = Cancellation(futures)
+        if wait:
+            cancellation.wait()
+        return cancellation
 
     def actioninfo(self, future_id):
 
@@ -404,6 +715,9 @@ class RobotActionExecutor():
 
     def __str__(self):
         with self.futures_lock:
+            now = get_clock().time()
             return "Running tasks:\n" + \
-                    "\n".join(["Task %s (id: %s, thread: <%s>)" % (f, id(f), str(f.thread())) for f in self.futures if not f.done()])
+                    "\n".join(["Task %s (id: %s, thread: <%s>): running for %.2fs (%.2fs waiting for resources, %.2fs for sub-actions)" % \
+                                (f, id(f), str(f.thread()), now - f.submitted_at, f.resource_wait, f.subaction_wait) \
+                                for f in self.futures if not f.done()])
 
@@ -0,0 +1,221 @@
+# coding=utf-8
+"""
+Cooperative robot actions: generator-based actions that all run on a single
+scheduler thread.
+
+A robot action written as a generator function is run as a coroutine: each
+``yield`` is a wait point, where the action gives the hand back to the
+scheduler until what it waits for is available:
+
+- ``yield <number>``: sleeps for that many seconds (of the pyRobots clock),
+- ``yield <action>``: waits for the completion of another action (a
+  :class:`.RobotAction`, or any future), and returns its result (or raises
+  its exception),
+- ``yield``: simply lets the other coroutines run.
+
+.. code-block:: python
+
+    @action
+    def blink(robot, times):
+        for i in range(times):
+            robot.state.led = not robot.state.led
+            yield 0.5
+        distance = yield robot.measure_distance() # waits for the sub-action
+        raise StopIteration(distance) # Python 2 generators can not 'return' values
+
+Thousands of such mostly-waiting actions cost one thread. Coroutine actions
+return the same :class:`.RobotAction` futures as the other actions (that can
+be waited for, cancelled, have sub-actions...). Cancellation raises
+:class:`.ActionCancelled` at the current wait point of the coroutine.
+
+Coroutine actions must never block (no ``robot.sleep``, ``action.wait()``,
+``robot.wait()``, nor blocking I/O): this would block every other coroutine
+action. For the same reason, they can only lock resources with
+``wait = False``.
+"""
+import logging; logger = logging.getLogger("robots.actions")
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from .signals import ActionCancelled
+from .clock import Waker, get_clock
+from .concurrency import Future, RobotAction, SignalingThread
+from .tracing import trace, CANCEL
+from .metrics import thread_time
+
+class CoroutineAction(RobotAction):
+    """ The future of a coroutine action.
+    """
+
+    coroutine = True
+
+    def __init__(self, actionname, scheduler):
+        RobotAction.__init__(self, actionname)
+        self.scheduler = scheduler
+        self.gen = None
+        self._resumes = 0 # number of times the coroutine has been resumed
+        self._blocked_since = None # clock time at which it yielded a sub-action
+
+        # like the weak reference to the thread of the other actions: the
+        # scheduler thread while the action is running, None afterwards.
+        self.thread = lambda: scheduler.thread if not self.done() else None
+
+    def signal_cancel(self):
+        if not self.done():
+            if self._cancel_signaled is None:
+                self._cancel_signaled = time.time()
+                self.add_done_callback(self._record_cancel_latency)
+                trace(self, CANCEL)
+            self.scheduler.throw(self, ActionCancelled())
+
+        for weak_subaction in self.subactions:
+            subaction = weak_subaction()
+            if subaction:
+                subaction.signal_cancel()
+
+class CoroutineScheduler:
+    """ Runs coroutine actions on a single thread.
+
+    The thread is started on demand, and stops when no coroutine action is
+    alive.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waker = Waker()
+
+        self._ready = deque() # (action, resumes, value, exception)
+        self._sleeping = [] # heap of (wake-up time, seq, action, resumes)
+        self._seq = itertools.count()
+        self._alive = 0
+
+        self.thread = None
+        self.current = None # the coroutine action currently running
+        self._step_cpu = None # CPU time of the scheduler thread when the current step started
+
+    def spawn(self, action, gen):
+        action.gen = gen
+        with self._lock:
+            self._alive += 1
+        self._resume(action, None)
+
+    def throw(self, action, exception):
+        """ Raises ``exception`` in the coroutine, at its current wait point.
+        """
+        self._resume(action, None, None, exception)
+
+    def _resume(self, action, resumes, value = None, exception = None):
+        """ Schedules the resumption of the coroutine. ``resumes`` is the
+        number of resumptions the coroutine had when it started waiting: stale
+        resumptions (for instance, the completion of a sub-action the
+        coroutine does not wait for anymore since it has been cancelled) are
+        ignored. ``None`` always resumes the coroutine.
+        """
+        with self._lock:
+            self._ready.append((action, resumes, value, exception))
+            if self.thread is None:
+                self.thread = SignalingThread(target = self._run, name = "Coroutine actions")
+                self.thread.scheduler = self
+                self.thread.daemon = True
+                self.thread.start()
+        self._waker.set()
+
+    def _run(self):
+        threading.current_thread().name = "Coroutine actions"
+        clock = get_clock()
+
+        while True:
+            with self._lock:
+                now = clock.time()
+                while self._sleeping and self._sleeping[0][0] <= now:
+                    wakeup, seq, action, resumes = heapq.heappop(self._sleeping)
+                    self._ready.append((action, resumes, None, None))
+
+                ready, self._ready = self._ready, deque()
+
+                if not ready:
+                    if not self._alive:
+                        self.thread = None
+                        return
+                    deadline = self._sleeping[0][0] if self._sleeping else None
+
+            if not ready:
+                clock.park(self._waker, deadline)
+                continue
+
+            for action, resumes, value, exception in ready:
+                if action.done() or (resumes is not None and resumes != action._resumes):
+                    continue
+                self._step(action, value, exception)
+
+    def _step(self, action, value, exception):
+        action._resumes += 1
+        if action._blocked_since is not None:
+            action.subaction_wait += get_clock().time() - action._blocked_since
+            action._blocked_since = None
+
+        self.current = action
+        self._step_cpu = thread_time() if thread_time else None
+        try:
+            if exception is not None:
+                waitfor = action.gen.throw(exception)
+            else:
+                waitfor = action.gen.send(value)
+        except StopIteration as e:
+            self._done(action, e.args[0] if e.args else None)
+        except ActionCancelled:
+            logger.debug("Coroutine action <%s> cancelled." % action)
+            self._done(action, None)
+        except BaseException as e:
+            # not only Exception: whatever the action raises (SystemExit...),
+            # the scheduler thread must keep running the other coroutines
+            logger.exception("Exception in action <%s>" % action)
+            self._done(action, exception = e)
+        else:
+            self._wait(action, waitfor)
+        finally:
+            self.current = None
+            self._account_cpu(action)
+
+    def _account_cpu(self, action):
+        """ Adds the CPU time of the current step to the action.
+        """
+        if self._step_cpu is not None:
+            action.cpu_time = (action.cpu_time or 0.) + thread_time() - self._step_cpu
+            self._step_cpu = None
+
+    def _done(self, action, result = None, exception = None):
+        with self._lock:
+            self._alive -= 1
+        self._account_cpu(action)
+        if exception is not None:
+            action.set_exception(exception)
+        else:
+            action.set_result(result)
+
+    def _wait(self, action, waitfor):
+        resumes = action._resumes
+
+        if waitfor is None:
+            self._resume(action, resumes)
+
+        elif isinstance(waitfor, (int, float)):
+            with self._lock:
+                heapq.heappush(self._sleeping, (get_clock().time() + waitfor, next(self._seq), action, resumes))
+
+        elif hasattr(waitfor, "add_done_callback"):
+            action._blocked_since = get_clock().time()
+            def on_done(future):
+                exception = future.exception(0)
+                if exception is not None:
+                    self._resume(action, resumes, exception = exception)
+                else:
+                    self._resume(action, resumes, Future.result(future, 0))
+            waitfor.add_done_callback(on_done)
+
+        else:
+            self._resume(action, resumes, exception = TypeError("Coroutine action <%s> yielded %r: expected a duration, an action or None" % (action, waitfor)))
@@ -0,0 +1,160 @@
+# coding=utf-8
+"""
+Accounting of the time spent by the robot actions.
+
+Each :class:`.RobotAction` records where its time goes:
+
+- ``wall_time``: from its submission to its completion (in seconds of the
+  pyRobots clock),
+- ``resource_wait``: waiting for the resources it locks,
+- ``subaction_wait``: blocked on the results of its sub-actions,
+- ``cpu_time``: CPU time consumed by the thread of the action (or by the
+  coroutine steps of a coroutine action). ``None`` if the platform has no
+  per-thread CPU clock. For ``process = True`` actions, the CPU time of the
+  worker process is not included.
+
+Once completed, the actions are aggregated by name in the executor
+(``robot.executor.metrics``, cf :class:`ActionMetrics`):
+
+.. code-block:: python
+
+    >>> robot.stats()
+    plan_path: 42 runs (0 failed, 1 cancelled, 0 timed out)
+        wall: 42 samples, mean 0.756s, p50 1.000s, p99 2.568s, max 2.568s
+        cpu: 42 samples, mean 0.740s, p50 1.000s, p99 2.545s, max 2.545s
+        resources: 42 samples, mean 0.000s, p50 0.000s, p99 0.000s, max 0.000s
+        sub-actions: 42 samples, mean 0.000s, p50 0.000s, p99 0.000s, max 0.000s
+    ...
+
+The timings are kept in :class:`.Histogram` with 1-2-5 buckets (0.1ms, 0.2ms,
+0.5ms, 1ms...): the percentiles are the upper bounds of their buckets
+(capped by the maximum), and may overestimate the actual percentiles by up
+to 2.5 times (a p50 of 1.000s means between 0.5s and 1s).
+"""
+import logging; logger = logging.getLogger("robots.actions")
+
+import sys
+import time
+import threading
+
+from robots.helpers.misc import Histogram
+from .clock import get_clock
+
+def _thread_time():
+    """ Returns a function returning the CPU time of the calling thread, or
+    ``None`` if not supported on this platform.
+    """
+    if hasattr(time, "thread_time"): # Python >= 3.7
+        return time.thread_time
+
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        import ctypes, ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library("rt") or "librt.so.1")
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    CLOCK_THREAD_CPUTIME_ID = 3
+
+    def thread_time():
+        t = timespec()
+        clock_gettime(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(t))
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+    return thread_time
+
+thread_time = _thread_time()
+
+class ActionStats:
+    """ Timings of the completed actions with a given name.
+
+    :ivar count: number of completed actions
+    :ivar failed: number of actions that raised an exception
+    :ivar cancelled: number of actions that have been cancelled (including
+      the actions preempted by a higher priority action)
+    :ivar timed_out: number of actions cancelled because they missed their
+      deadline
+    :ivar wall: :class:`.Histogram` of the wall times
+    :ivar cpu: :class:`.Histogram` of the CPU times
+    :ivar resource_wait: :class:`.Histogram` of the times spent waiting for
+      resources
+    :ivar subaction_wait: :class:`.Histogram` of the times spent blocked on
+      sub-actions
+    """
+    def __init__(self):
+        self.count = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self.wall = Histogram()
+        self.cpu = Histogram()
+        self.resource_wait = Histogram()
+        self.subaction_wait = Histogram()
+
+    def __str__(self):
+        return "%d runs (%d failed, %d cancelled, %d timed out)\n" % (self.count, self.failed, self.cancelled, self.timed_out) + \
+               "    wall: %s\n" % self.wall + \
+               "    cpu: %s\n" % self.cpu + \
+               "    resources: %s\n" % self.resource_wait + \
+               "    sub-actions: %s\n" % self.subaction_wait
+
+class ActionMetrics:
+    """ Aggregates the timings of the completed actions by action name.
+    """
+
+    def __init__(self):
+        self._stats = {} # action name -> ActionStats
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        return self._stats[name]
+
+    def __contains__(self, name):
+        return name in self._stats
+
+    def names(self):
+        return self._stats.keys()
+
+    def record(self, name, action):
+        """ Records the timings of the (completed) ``action``, named ``name``.
+        """
+        action.wall_time = get_clock().time() - action.submitted_at
+
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = ActionStats()
+
+            stats.count += 1
+            # (missing its deadline cancels the action)
+            if action.deadline_missed:
+                stats.timed_out += 1
+            elif action.cancelled() or action._cancel_signaled is not None:
+                stats.cancelled += 1
+            elif action.exception(0) is not None:
+                stats.failed += 1
+            stats.wall.add(action.wall_time)
+            stats.resource_wait.add(action.resource_wait)
+            stats.subaction_wait.add(action.subaction_wait)
+            if action.cpu_time is not None:
+                stats.cpu.add(action.cpu_time)
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+    def report(self):
+        """ Returns a human-readable summary of the timings, the actions
+        using the most CPU (then the most wall time) first.
+        """
+        with self._lock:
+            stats = sorted(self._stats.items(), key = lambda s: (s[1].cpu.total, s[1].wall.total), reverse = True)
+        return "".join("%s: %s" % (name, s) for name, s in stats)
@@ -0,0 +1,192 @@
+# coding=utf-8
+"""
+A pool of worker processes, to run CPU-bound robot actions (grasp planning,
+point cloud segmentation...) without holding the GIL of the robot process.
+
+Such actions are declared with ``@action(process = True)``. The action still
+gets its :class:`.RobotAction` (and its thread, that locks the resources
+and waits for the result), but the body of the action runs in a worker
+process:
+
+.. code-block:: python
+
+    @action(process = True)
+    def plan_grasp(robot, cloud):
+        # runs in another process: 'robot' is None here
+        return heavy_computation(cloud)
+
+    grasp = robot.plan_grasp(cloud).result()
+
+The result (or the exception) of the function is sent back to the robot
+process, and cancelling the action (or missing its deadline) terminates the
+worker process.
+
+The robot instance (its threads, middleware connections...) can not be sent
+to another process: process actions are called with ``robot = None`` and only
+work on their arguments. The arguments and the result must be picklable, and
+the action must be a module-level function.
+"""
+import logging; logger = logging.getLogger("robots.actions")
+
+import sys
+import threading
+import traceback
+import multiprocessing
+from Queue import Queue
+
+from .signals import ActionCancelled
+from .clock import current_waker, get_clock
+
+def _worker_main(conn):
+    """ Main loop of the worker processes: receives the actions to run, and
+    sends back their results.
+    """
+    while True:
+        try:
+            module, name, args, kwargs = conn.recv()
+        except (EOFError, IOError, KeyboardInterrupt):
+            return
+
+        try:
+            __import__(module)
+            fn = getattr(sys.modules[module], name)
+            fn = getattr(fn, "_fn", fn) # the function wrapped by @action
+            value = fn(None, *args, **kwargs)
+            status, tb = "result", None
+        except Exception as e:
+            status, value, tb = "exception", e, traceback.format_exc()
+
+        try:
+            conn.send((status, value, tb))
+        except Exception as e: # unpicklable result or exception
+            conn.send(("exception", RuntimeError("Unable to send back the result of %s: %s" % (name, e)), tb))
+
+class _Job:
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.waker = current_waker()
+
+        self.cancelled = False
+        self.done = False
+        self.status = None
+        self.value = None
+
+    def complete(self, status, value):
+        self.status, self.value = status, value
+        self.done = True
+        self.waker.set()
+
+class _Worker:
+    """ A worker process, and the thread that feeds it with jobs.
+    """
+    def __init__(self, pool, idx):
+        self.pool = pool
+        self.name = "Process worker %d" % idx
+        self.process = None
+        self.conn = None
+        self.job = None
+        self.lock = threading.Lock() # protects the process and the current job
+
+        self.thread = threading.Thread(target = self._run, name = self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _start_process(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target = _worker_main, args = (child_conn,), name = self.name)
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def terminate(self, job = None):
+        """ Terminates the process (if it is running ``job``, when given).
+        """
+        with self.lock:
+            if self.process is not None and (job is None or self.job is job):
+                self.process.terminate()
+
+    def _run(self):
+        while True:
+            job = self.pool._jobs.get()
+
+            with self.lock:
+                if job.cancelled:
+                    continue
+                self.job = job
+                if self.process is None or not self.process.is_alive():
+                    self._start_process()
+
+            try:
+                self.conn.send((job.fn.__module__, job.fn.__name__, job.args, job.kwargs))
+                status, value, tb = self.conn.recv()
+                if tb is not None:
+                    logger.debug("Exception in worker process:\n%s" % tb)
+            except (EOFError, IOError):
+                # the process died: terminated on cancellation, or crashed
+                with self.lock:
+                    self.process.join()
+                    self.process = None
+                status, value = "exception", RuntimeError("Worker process died while running %s" % job.fn.__name__)
+            except Exception as e: # eg, unpicklable arguments
+                status, value = "exception", e
+
+            with self.lock:
+                self.job = None
+            job.complete(status, value)
+
+class ProcessPool:
+    """ Runs functions in worker processes.
+
+    Workers (and their processes) are started on demand, up to
+    ``max_workers`` (by default, the number of CPUs), and then reused.
+    """
+
+    def __init__(self, max_workers = None):
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self._workers = []
+        self._jobs = Queue()
+        self._lock = threading.Lock()
+        self._busy = 0
+
+    def run(self, fn, *args, **kwargs):
+        """ Runs ``fn(None, *args, **kwargs)`` in a worker process, and returns
+        its result (or raises its exception).
+
+        Blocks until the result is available. If the calling action is
+        cancelled in the meantime, the worker process is terminated and
+        :class:`.ActionCancelled` is raised.
+        """
+        job = _Job(fn, args, kwargs)
+
+        with self._lock:
+            self._busy += 1
+            if self._busy > len(self._workers) and len(self._workers) < self.max_workers:
+                self._workers.append(_Worker(self, len(self._workers)))
+        self._jobs.put(job)
+
+        clock = get_clock()
+        try:
+            while not job.done:
+                clock.park(job.waker)
+        except ActionCancelled:
+            job.cancelled = True
+            if not job.done:
+                logger.debug("Terminating the worker process running %s" % fn.__name__)
+                for worker in self._workers:
+                    worker.terminate(job)
+            raise
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+        if job.status == "exception":
+            raise job.value
+        return job.value
+
+    def shutdown(self):
+        """ Terminates all the worker processes.
+        """
+        for worker in self._workers:
+            worker.terminate()
@@ -0,0 +1,180 @@
+# coding=utf-8
+"""
+A sampling profiler for the robot actions.
+
+Every ``interval`` seconds, a background thread samples the stacks of the
+action threads (via ``sys._current_frames()``, like
+:meth:`.RobotActionExecutor.actioninfo`) and counts the samples by action
+name and call stack:
+
+.. code-block:: python
+
+    profiler = robot.executor.start_profiling(interval = 0.01)
+    robot.mission().wait()
+    robot.executor.stop_profiling()
+
+    print(profiler.by_action())
+    profiler.export("mission.folded")
+
+The export uses the 'collapsed stacks' format (one line per stack, frames
+separated by ``;``, followed by the number of samples), that
+``flamegraph.pl``, https://www.speedscope.app and most flamegraph tools read.
+The root of each stack is the name of the action.
+
+Unlike tracing functions, the profiler does not slow down the actions
+themselves: its cost is the sampling of the stacks, paid on its own thread,
+once per interval. With the default interval (10ms) it is low enough to
+leave the profiler running on the robot. ``overhead()`` returns the share
+of the time spent sampling.
+"""
+import logging; logger = logging.getLogger("robots.actions")
+
+import os
+import sys
+import time
+import threading
+
+class SamplingProfiler:
+    """ Samples the stacks of the running actions of ``executor``.
+
+    :param interval: time between two samples, in seconds (real time, whatever
+      the pyRobots clock)
+    :param max_depth: maximum number of frames kept per stack (the
+      outermost ones)
+    :param include_waiting: if ``False``, threads blocked in the threading
+      module (sleeping, waiting for a resource or a sub-action...) are not
+      sampled: the profile only shows where the CPU time goes.
+    :param lines: if ``True``, frames include their line number (otherwise,
+      only the function and the file name, which gives more readable
+      flamegraphs)
+    """
+
+    def __init__(self, executor, interval = 0.01, max_depth = 64, include_waiting = True, lines = False):
+        self.executor = executor
+        self.interval = interval
+        self.max_depth = max_depth
+        self.include_waiting = include_waiting
+        self.lines = lines
+
+        self.samples = {} # (action name, frames) -> number of samples
+        self.count = 0 # number of sampling rounds
+        self._sampling_time = 0.
+        self._running_time = 0. # total time the profiler ran, until its last start
+        self._started = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._started = time.time()
+        self._thread = threading.Thread(target = self._run, name = "Action profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+        self._running_time += time.time() - self._started
+
+    def clear(self):
+        self.samples = {}
+        self.count = 0
+        self._sampling_time = 0.
+        self._running_time = 0.
+        if self._thread is not None:
+            self._started = time.time()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            t = time.time()
+            self.sample()
+            self._sampling_time += time.time() - t
+
+    def _actions(self):
+        """ Returns the ``{thread id: action}`` of the running actions.
+        """
+        actions = {}
+        for thread in threading.enumerate():
+            scheduler = getattr(thread, "scheduler", None)
+            if scheduler is not None:
+                action = scheduler.current # the coroutine action being stepped, if any
+            else:
+                action = getattr(thread, "future", None)
+            if action is not None and action.executor is self.executor and not action.done():
+                actions[thread.ident] = action
+        return actions
+
+    def _frame_name(self, frame):
+        code = frame.f_code
+        if self.lines:
+            return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno)
+        return "%s (%s)" % (code.co_name, os.path.basename(code.co_filename))
+
+    def sample(self):
+        """ Samples once the stacks of all the running actions.
+        """
+        actions = self._actions()
+        frames = sys._current_frames()
+
+        for ident, action in actions.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+
+            if not self.include_waiting and frame.f_globals.get("__name__") == "threading":
+                continue
+
+            stack = []
+            while frame is not None:
+                if frame.f_globals.get("__name__") != "threading":
+                    stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            stack = tuple(reversed(stack[-self.max_depth:]))
+
+            key = (action.actionname.split("(")[0], stack) # action name, without the arguments
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+        self.count += 1
+
+    def by_action(self):
+        """ Returns the number of samples of each action, as a dictionary.
+        """
+        result = {}
+        for (name, stack), count in self.samples.items():
+            result[name] = result.get(name, 0) + count
+        return result
+
+    def overhead(self):
+        """ Returns the share of the profiling time spent sampling the
+        stacks.
+        """
+        running = self._running_time
+        if self._thread is not None:
+            running += time.time() - self._started
+        return self._sampling_time / running if running else 0.
+
+    def collapsed(self):
+        """ Returns the samples in the collapsed stacks format.
+        """
+        lines = []
+        for (name, stack), count in sorted(self.samples.items()):
+            lines.append("%s %d" % (";".join((name,) + stack), count))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def export(self, path):
+        """ Writes the samples in the collapsed stacks format to ``path`` (a
+        file name or a file object).
+        """
+        if hasattr(path, "write"):
+            path.write(self.collapsed())
+        else:
+            with open(path, "w") as f:
+                f.write(self.collapsed())
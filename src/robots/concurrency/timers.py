@@ -0,0 +1,144 @@
+# coding=utf-8
+"""
+A timer wheel, used by the executor to enforce the deadlines of the actions.
+"""
+import logging; logger = logging.getLogger("robots.actions")
+
+import math
+import threading
+
+from .clock import Waker, get_clock
+
+class TimerWheel:
+    """ Calls functions at given times (as given by the pyRobots clock), from
+    a single thread, whatever the number of pending timers.
+
+    Timers are hashed into ``slots`` buckets of ``resolution`` seconds each:
+    scheduling and cancelling a timer are O(1), and the thread only wakes up
+    for the ticks that have expiring timers (or once per revolution of the
+    wheel). Timers fire at most ``resolution`` seconds late.
+
+    The thread is started on demand, and stops when no timer is pending.
+
+    :param clock: the clock giving the time of the timers (by default, the
+      clock currently used by pyRobots)
+    """
+
+    def __init__(self, resolution = 0.05, slots = 256, clock = None):
+        self.resolution = resolution
+        self.nb_slots = slots
+
+        self._slots = [[] for i in range(slots)] # lists of [tick, fn]
+        self._pending = 0
+        self._current = None # last processed tick
+
+        self._lock = threading.Lock()
+        self._waker = Waker()
+        self._thread = None
+
+        self._clock = clock
+
+    def __len__(self):
+        return self._pending
+
+    def _tick(self, t):
+        return int(math.floor(t / self.resolution))
+
+    def schedule(self, deadline, fn):
+        """ Calls ``fn()`` (from the timer thread) once the clock reaches
+        ``deadline``.
+
+        :returns: a handle, to be passed to :meth:`cancel`
+        """
+        tick = int(math.ceil(deadline / self.resolution))
+        with self._lock:
+            if self._current is not None:
+                tick = max(tick, self._current + 1)
+            timer = [tick, fn]
+            self._slots[tick % self.nb_slots].append(timer)
+            self._pending += 1
+
+            if self._thread is None:
+                # imported here: concurrency imports this module
+                from .concurrency import SignalingThread
+                self._current = self._tick((self._clock or get_clock()).time())
+                self._thread = SignalingThread(target = self._run, name = "Timer wheel")
+                self._thread.daemon = True
+                self._thread.start()
+
+        # the thread may need to wake up earlier than planned
+        self._waker.set()
+        return timer
+
+    def cancel(self, timer):
+        """ Cancels a timer, if it has not fired yet.
+        """
+        with self._lock:
+            slot = self._slots[timer[0] % self.nb_slots]
+            for idx, t in enumerate(slot):
+                if t is timer:
+                    del slot[idx]
+                    self._pending -= 1
+                    break
+            else:
+                return
+
+            last = not self._pending
+
+        if last:
+            # lets the thread stop now, instead of sleeping until its next
+            # planned wake-up (which would make a simulated clock advance)
+            self._waker.set()
+
+    def _next_tick(self):
+        """ Returns the next tick with an expiring timer, looking at most one
+        revolution ahead. Must be called with the lock held.
+        """
+        for tick in range(self._current + 1, self._current + self.nb_slots + 1):
+            for timer in self._slots[tick % self.nb_slots]:
+                if timer[0] <= tick:
+                    return tick
+        return self._current + self.nb_slots
+
+    def _run(self):
+        threading.current_thread().name = "Timer wheel"
+        clock = self._clock or get_clock()
+
+        wakeup_tick, wakeup = None, None
+        while True:
+            current_time = clock.time()
+            now = self._tick(current_time)
+            if wakeup is not None and current_time >= wakeup:
+                # tick * resolution may be rounded below the tick: the tick
+                # we waited for has been reached, whatever _tick says
+                now = max(now, wakeup_tick)
+            expired = []
+            with self._lock:
+                # process every tick elapsed since the last one (at most one
+                # full revolution)
+                first = max(self._current + 1, now - self.nb_slots + 1)
+                for tick in range(first, now + 1):
+                    slot = self._slots[tick % self.nb_slots]
+                    if slot:
+                        expired += [t for t in slot if t[0] <= now]
+                        slot[:] = [t for t in slot if t[0] > now]
+                self._pending -= len(expired)
+                self._current = max(self._current, now)
+
+                if not self._pending and not expired:
+                    self._thread = None
+                    return
+
+                wakeup_tick = self._next_tick()
+                wakeup = wakeup_tick * self.resolution
+
+            for tick, fn in expired:
+                try:
+                    fn()
+                except Exception as e:
+                    logger.error("Exception in timer %s: %s" % (fn, e))
+
+            if expired:
+                continue
+
+            clock.park(self._waker, wakeup)
@@ -0,0 +1,161 @@
+# coding=utf-8
+"""
+Tracing of the lifecycle of the robot actions, to understand where the time
+goes in a tree of actions.
+
+.. code-block:: python
+
+    tracer = robot.executor.start_tracing()
+    robot.mission().wait()
+    robot.executor.stop_tracing()
+
+    tracer.export("mission.json")
+
+The exported file uses the Chrome trace format: open it in
+``chrome://tracing`` or https://ui.perfetto.dev. Each action is displayed as
+a span (from its start to its end, preceded by the time it waited to be
+started), with the time spent waiting for resources, its cancellation, and
+arrows from the parent actions to the sub-actions they started.
+
+Events are stored in a fixed-size ring buffer: recording an event is cheap
+and never allocates more memory, but only the most recent events are kept.
+"""
+import logging; logger = logging.getLogger("robots.actions")
+
+import os
+import json
+import thread # for get_ident
+import itertools
+
+from .clock import get_clock
+
+# events recorded for each action
+SUBMIT = "submit"
+PARENT = "parent" # arg: id of the parent action
+WAIT_RESOURCE = "wait_resource" # arg: name of the resource
+ACQUIRED_RESOURCE = "acquired_resource" # arg: name of the resource
+START = "start"
+END = "end"
+CANCEL = "cancel"
+
+def _span(common, ph, cat, name, spanid, args = None):
+    """ An event of an async span (Chrome trace format).
+    """
+    e = dict(common, ph = ph, cat = cat, name = name, id = spanid)
+    if args:
+        e["args"] = args
+    return e
+
+class Tracer:
+    """ Records the lifecycle events of the actions in a ring buffer of
+    ``capacity`` events.
+
+    Events are timestamped with the pyRobots clock.
+    """
+
+    def __init__(self, capacity = 65536):
+        self.capacity = capacity
+        self._events = [None] * capacity
+        self._counter = itertools.count() # next() is atomic: no lock needed
+        self._next = 0 # index of the next event (once the ones in progress are recorded)
+        self._first = 0 # index of the first event since the last clear()
+
+    def __len__(self):
+        return min(self._next - self._first, self.capacity)
+
+    def record(self, event, action, arg = None):
+        idx = next(self._counter)
+        self._events[idx % self.capacity] = (idx, get_clock().time(), event, action.id, action.actionname, thread.get_ident(), arg)
+        if idx >= self._next:
+            self._next = idx + 1
+
+    def events(self):
+        """ Returns the recorded events, oldest first, as tuples ``(index,
+        time, event, action id, action name, thread id, argument)``.
+        """
+        return sorted(e for e in self._events if e is not None)
+
+    def clear(self):
+        self._events = [None] * self.capacity
+        self._first = self._next
+
+    def chrome_trace(self):
+        """ Returns the recorded events in the Chrome trace format (a
+        JSON-serializable dictionary).
+        """
+        events = self.events()
+        if not events:
+            return {"traceEvents": []}
+
+        pid = os.getpid()
+        t0 = events[0][1]
+        submitted = {} # action id -> (ts, tid) of its submission
+        linked = set() # actions with a parent
+        waiting = {} # action id -> resource it waits for
+        started = set()
+        trace = []
+
+        for idx, t, event, aid, name, tid, arg in events:
+            ts = (t - t0) * 1e6
+            aid = str(aid)
+            common = {"pid": pid, "tid": tid, "ts": ts}
+
+            if event == SUBMIT:
+                submitted[aid] = (ts, tid)
+                trace.append(_span(common, "b", "queued", name, aid))
+
+            elif event == PARENT:
+                # arrow from the parent (where the sub-action is submitted)
+                # to the sub-action
+                linked.add(aid)
+                ts_submit, tid_submit = submitted.get(aid, (ts, tid))
+                trace.append({"ph": "s", "cat": "subaction", "name": "subaction",
+                              "id": aid, "pid": pid, "tid": tid_submit, "ts": ts_submit})
+
+            elif event == START:
+                if aid in submitted:
+                    trace.append(_span(common, "e", "queued", name, aid))
+                if aid in linked:
+                    trace.append(dict(common, ph = "f", bp = "e", cat = "subaction", name = "subaction", id = aid))
+                started.add(aid)
+                trace.append(_span(common, "b", "action", name, aid, {"id": aid}))
+
+            elif event == WAIT_RESOURCE:
+                waiting[aid] = arg
+                trace.append(_span(common, "b", "resource", "waiting for %s" % arg, aid + arg))
+
+            elif event == ACQUIRED_RESOURCE:
+                waiting.pop(aid, None)
+                trace.append(_span(common, "e", "resource", "waiting for %s" % arg, aid + arg))
+
+            elif event == CANCEL:
+                trace.append(dict(common, ph = "i", s = "t", name = "cancel %s" % name))
+
+            elif event == END:
+                if aid in waiting: # cancelled while waiting for a resource
+                    res = waiting.pop(aid)
+                    trace.append(_span(common, "e", "resource", "waiting for %s" % res, aid + res))
+                if aid in started:
+                    trace.append(_span(common, "e", "action", name, aid))
+                elif aid in submitted:
+                    # cancelled before starting
+                    trace.append(_span(common, "e", "queued", name, aid))
+
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def export(self, path):
+        """ Writes the trace in the Chrome trace format to ``path`` (a file
+        name or a file object).
+        """
+        if hasattr(path, "write"):
+            json.dump(self.chrome_trace(), path)
+        else:
+            with open(path, "w") as f:
+                json.dump(self.chrome_trace(), f)
+
+def trace(action, event, arg = None):
+    """ Records an event of ``action``, if its executor is tracing.
+    """
+    executor = getattr(action, "executor", None)
+    if executor is not None and executor.tracer is not None:
+        executor.tracer.record(event, action, arg)
@@ -0,0 +1,276 @@
+# coding=utf-8
+"""
+Composite event expressions, evaluated incrementally on state updates.
+"""
+import threading
+
+from robots.concurrency import get_clock
+
+class EventExpression(object):
+    """ A logical combination of state-based event conditions.
+
+    Expressions are built from :class:`.EventMonitor` conditions with the
+    ``&`` (and), ``|`` (or) and ``~`` (not) operators, and with
+    :meth:`then` (sequences), and are monitored like any other event:
+
+    .. code-block:: python
+
+        near = robot.on("sonar", below = 0.4)
+        fast = robot.on("speed", above = 1.)
+        robot.whenever(near & fast).do(slow_down)
+
+        # bumped less than 2 sec after the obstacle was detected
+        robot.on(near.then(robot.on("bumper", becomes = True), within = 2.)).wait()
+
+    Expressions are not polled: while monitored, the expression listens to
+    the state updates, re-evaluates only the conditions on the updated entry
+    and caches the truth value of each sub-expression, so that evaluating the
+    expression costs about as much as evaluating a single condition.
+
+    Each condition keeps the truth value computed on the last update of its
+    entry. Conditions on transitions (``becomes=``, ``increase=``,
+    ``decrease=``) and sequences only hold at the update that triggers them.
+
+    A sub-expression (or condition) must not appear twice in the same
+    expression, nor be monitored in two expressions at the same time.
+    """
+
+    momentary = False # only holds at the update that triggers it
+
+    def __init__(self):
+        self.keys = set() # state entries the expression depends on
+        self.value = False
+
+        # only used by the root of the expression
+        self.hits = 0 # number of updates after which the expression held
+        self._watchers = set()
+        self._state = None
+        self._lock = threading.Lock()
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def then(self, other, within = None):
+        """ Returns an expression that holds when ``other`` starts holding
+        after this expression held, within at most ``within`` seconds (if not
+        ``None``).
+        """
+        return Sequence(self, other, within)
+
+    def _update(self, key, value, now):
+        """ Re-evaluates the sub-expressions depending on ``key``, after it
+        has been set to ``value``.
+
+        :returns: the new truth value of the expression
+        """
+        raise NotImplementedError()
+
+    def _settle(self, key):
+        """ Called once the update of ``key`` has been processed: momentary
+        sub-expressions stop holding.
+        """
+        raise NotImplementedError()
+
+    def watch(self, robot, monitor):
+        """ Starts evaluating the expression on the updates of the robot
+        state, on behalf of ``monitor`` (whose ``_notify()`` method is called
+        each time the expression holds after an update).
+        """
+        with self._lock:
+            if not self._watchers:
+                state = robot.state
+                state.add_listener(self._on_state_update)
+                self._state = state
+
+                # initial evaluation
+                now = get_clock().time()
+                for key in self.keys:
+                    if key in state:
+                        self._update(key, state[key], now)
+                        self._settle(key)
+
+            self._watchers.add(monitor)
+
+    def unwatch(self, monitor):
+        with self._lock:
+            self._watchers.discard(monitor)
+            if self._watchers or self._state is None:
+                return
+            state, self._state = self._state, None
+        state.remove_listener(self._on_state_update)
+
+    def _on_state_update(self, key, value):
+        if key not in self.keys:
+            return
+
+        with self._lock:
+            if self._state is None:
+                return
+            ok = self._update(key, value, get_clock().time())
+            self._settle(key)
+            if not ok:
+                return
+            self.hits += 1
+            watchers = list(self._watchers)
+
+        for monitor in watchers:
+            monitor._notify()
+
+def as_expression(event):
+    """ Returns ``event`` if it already is an :class:`EventExpression`, or
+    wraps an event monitor in a :class:`Condition`.
+    """
+    if isinstance(event, EventExpression):
+        return event
+    return Condition(event)
+
+class Condition(EventExpression):
+    """ Leaf of an expression: the condition of a state-based event monitor.
+    """
+    def __init__(self, monitor):
+        EventExpression.__init__(self)
+
+        if callable(monitor.var) or isinstance(monitor.var, EventExpression):
+            raise Exception("Only events on the robot state can be composed (got %s)" % monitor)
+        if monitor.filter is not None and (monitor.filter.debounce or monitor.filter.min_duration):
+            raise Exception("Debounced events can not be composed (got %s)" % monitor)
+
+        self.monitor = monitor
+        self.keys = set([monitor.var])
+        self.momentary = monitor.mode in (monitor.BECOMES, monitor.INCREASE, monitor.DECREASE)
+
+    def _update(self, key, value, now):
+        # the unfiltered condition: with hysteresis, it holds while latched
+        self.value = self.monitor._check_raw(value)
+        return self.value
+
+    def _settle(self, key):
+        if self.momentary:
+            self.value = False
+
+    def __str__(self):
+        return "(%s %s %s)" % (self.monitor.var, self.monitor.mode, self.monitor.target)
+
+class _Binary(EventExpression):
+
+    def __init__(self, left, right):
+        EventExpression.__init__(self)
+        self.left = as_expression(left)
+        self.right = as_expression(right)
+        self.keys = self.left.keys | self.right.keys
+
+    def _update_children(self, key, value, now):
+        left, right = self.left.value, self.right.value
+        # no short-circuit: stateful conditions must see every update
+        if key in self.left.keys:
+            left = self.left._update(key, value, now)
+        if key in self.right.keys:
+            right = self.right._update(key, value, now)
+        return left, right
+
+    def _settle_children(self, key):
+        if key in self.left.keys:
+            self.left._settle(key)
+        if key in self.right.keys:
+            self.right._settle(key)
+
+class And(_Binary):
+
+    def _update(self, key, value, now):
+        left, right = self._update_children(key, value, now)
+        self.value = left and right
+        return self.value
+
+    def _settle(self, key):
+        self._settle_children(key)
+        self.value = self.left.value and self.right.value
+
+    def __str__(self):
+        return "(%s & %s)" % (self.left, self.right)
+
+class Or(_Binary):
+
+    def _update(self, key, value, now):
+        left, right = self._update_children(key, value, now)
+        self.value = left or right
+        return self.value
+
+    def _settle(self, key):
+        self._settle_children(key)
+        self.value = self.left.value or self.right.value
+
+    def __str__(self):
+        return "(%s | %s)" % (self.left, self.right)
+
+class Not(EventExpression):
+
+    def __init__(self, event):
+        EventExpression.__init__(self)
+        self.event = as_expression(event)
+        self.keys = self.event.keys
+        self.value = True
+
+    def _update(self, key, value, now):
+        self.value = not self.event._update(key, value, now)
+        return self.value
+
+    def _settle(self, key):
+        self.event._settle(key)
+        self.value = not self.event.value
+
+    def __str__(self):
+        return "~%s" % self.event
+
+class Sequence(_Binary):
+    """ Holds when ``right`` starts holding, if ``left`` held before (within
+    ``within`` seconds, if not ``None``). Each occurrence of ``left`` is
+    consumed by the sequence it triggers.
+    """
+
+    momentary = True
+
+    def __init__(self, left, right, within = None):
+        _Binary.__init__(self, left, right)
+        self.within = within
+
+        self._left_held = False # left held after the last update
+        self._right_held = False
+        self._last_left = None # last time left was known to hold
+        self._updated_at = None
+
+    def _update(self, key, value, now):
+        left, right = self._update_children(key, value, now)
+
+        if self._left_held:
+            # left held until this update
+            self._last_left = now
+
+        self.value = right and not self._right_held \
+                     and self._last_left is not None \
+                     and (self.within is None or now - self._last_left <= self.within)
+        if self.value:
+            self._last_left = None
+
+        self._left_held = left
+        self._updated_at = now
+        return self.value
+
+    def _settle(self, key):
+        self._settle_children(key)
+
+        if self._left_held:
+            # also records momentary occurrences of left
+            self._last_left = self._updated_at
+        self._left_held = self.left.value
+        self._right_held = self.right.value
+        self.value = False
+
+    def __str__(self):
+        within = " within %ss" % self.within if self.within is not None else ""
+        return "(%s then %s%s)" % (self.left, self.right, within)
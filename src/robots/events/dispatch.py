@@ -0,0 +1,123 @@
+# coding=utf-8
+"""
+Bounded dispatching of event callbacks.
+"""
+import logging; logger = logging.getLogger("robots.events")
+
+import threading
+from collections import deque
+
+class CallbackQueue:
+    """ Runs the callbacks of an event monitor without blocking the
+    monitor, with a bounded amount of concurrent work.
+
+    At most ``concurrency`` firings of the event have their callbacks running
+    at the same time (a firing is running until all the actions started by
+    its callbacks have completed). Further firings wait in a queue of at most
+    ``max_queued`` firings. When the queue is full, the ``overflow`` policy
+    applies:
+
+    - :data:`DROP`: the new firing is discarded,
+    - :data:`DROP_OLDEST`: the oldest queued firing is discarded to make
+      room for the new one.
+
+    The counters :attr:`dispatched` and :attr:`dropped` are updated
+    accordingly.
+    """
+
+    DROP = "drop"
+    DROP_OLDEST = "drop_oldest"
+
+    def __init__(self, robot, concurrency = 1, max_queued = 10, overflow = DROP):
+
+        if overflow not in (CallbackQueue.DROP, CallbackQueue.DROP_OLDEST):
+            raise Exception("Unknown overflow policy <%s>" % overflow)
+
+        self.robot = robot
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.overflow = overflow
+
+        self.running = 0
+        self._queue = deque()
+
+        self.dispatched = 0
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def push(self, cbs):
+        """ Requests the execution of the callbacks ``cbs`` (one firing of the
+        event).
+        """
+        with self._lock:
+            if self.running >= self.concurrency:
+                if len(self._queue) < self.max_queued:
+                    self._queue.append(cbs)
+                else:
+                    self.dropped += 1
+                    if self.overflow == CallbackQueue.DROP_OLDEST:
+                        self._queue.popleft()
+                        self._queue.append(cbs)
+                return
+            self.running += 1
+            self.dispatched += 1
+
+        self._start(cbs)
+
+    def clear(self):
+        """ Discards the queued firings (running callbacks are not affected).
+        """
+        with self._lock:
+            self._queue.clear()
+
+    def _start(self, cbs):
+        """ Runs the callbacks of a firing, already counted as running and
+        dispatched.
+        """
+        futures = []
+        for cb in cbs:
+            try:
+                future = cb(self.robot)
+            except Exception as e:
+                logger.error("Exception in event callback %s: %s" % (cb, e))
+                continue
+            if hasattr(future, "add_done_callback"):
+                futures.append(future)
+
+        if not futures:
+            self._done()
+            return
+
+        remaining = [len(futures)]
+        def on_done(future):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self._done()
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    def _done(self):
+        """ Called when the callbacks of a firing have completed: starts the
+        next queued firing, if any.
+        """
+        with self._lock:
+            if not self._queue:
+                self.running -= 1
+                return
+            cbs = self._queue.popleft()
+            self.dispatched += 1
+
+        self._start(cbs)
+
+    def stats(self):
+        return {"dispatched": self.dispatched,
+                "dropped": self.dropped,
+                "running": self.running,
+                "queued": len(self._queue)}
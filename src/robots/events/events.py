@@ -4,11 +4,17 @@ pyRobots' events implementation
 """
 
 import logging; logger = logging.getLogger("robots.events")
-import time
 import weakref
 
 import threading # for current_thread()
-from robots.concurrency import SignalingThread, ACTIVE_SLEEP_RESOLUTION
+from robots.concurrency import SignalingThread, ActionCancelled, ACTIVE_SLEEP_RESOLUTION, get_clock
+from robots.concurrency.clock import current_waker
+
+from .thresholds import ThresholdIndex
+from .ratelimit import TokenBucket
+from .dispatch import CallbackQueue
+from .filters import ConditionFilter
+from .composite import EventExpression, Condition
 
 from robots.introspection import introspection
 
@@ -21,7 +27,17 @@ class Events:
     def __init__(self, robot):
 
         self.robot = robot
-        self.eventmonitors = []
+
+        # live monitors only: monitors are removed when they complete, are
+        # closed or garbage-collected
+        self.eventmonitors = weakref.WeakSet()
+        self._monitors_lock = threading.Lock()
+
+        # 'value', 'above' and 'below' monitors, indexed by state entry. They
+        # are woken up by the state updates that satisfy their condition.
+        self._indices = {} # state entry -> ThresholdIndex
+        self._indexed_state = None
+        self._indices_lock = threading.Lock()
 
     def on(self, var, **kwargs):
         """
@@ -32,10 +48,32 @@ class Events:
         :returns: a new instance of :class:`EventMonitor` for this event.
         """
         monitor = EventMonitor(self.robot, var, oneshot=True, **kwargs)
-        self.eventmonitors.append(weakref.ref(monitor))
+        self._register(monitor)
         return monitor
 
 
+    def wait(self, var, **kwargs):
+        """ Blocks until the event occurs. Equivalent to
+        ``on(var, **kwargs).wait()``, but simple conditions on a state entry
+        (one of ``value=``, ``becomes=``, ``above=``, ``below=``,
+        ``increase=``, ``decrease=``, without any other option) do not create
+        an :class:`EventMonitor`: a one-off :class:`StateWaiter` waits
+        directly for the updates of the entry.
+        """
+        state = self.robot.state
+        if len(kwargs) == 1 and not self.robot.dummy \
+           and not callable(var) and not isinstance(var, EventExpression) \
+           and hasattr(state, "wait_for_version") \
+           and var in state and state[var] is not None:
+
+            kw, target = list(kwargs.items())[0]
+            mode = StateWaiter.MODES.get(kw)
+            if mode is not None and target is not None:
+                StateWaiter(self.robot, var, mode, target).wait()
+                return
+
+        self.on(var, **kwargs).wait()
+
     def every(self, var, max_firing_freq = 10, blocking = True, **kwargs):
         """ Alias for :meth:`whenever`.
         """
@@ -68,22 +106,95 @@ class Events:
                 return robot.state["speed"] > 1.0 and now > evening
 
             robot.whenever(is_tired).do(go_to_sleep)
+
+            # using a combination of state conditions:
+            near = robot.on("sonar", below = 0.4)
+            fast = robot.on("speed", above = 1.)
+            robot.whenever(near & ~fast).do(go_closer)
+
+        Predicates are re-evaluated every ``ACTIVE_SLEEP_RESOLUTION`` seconds.
+        If the predicate only depends on the robot state, pass
+        ``track_dependencies = True``: the state entries read by the
+        predicate are then recorded during each evaluation, and the predicate
+        is only re-evaluated when one of them is written.
+
+        Combinations of state conditions (:class:`.EventExpression`) are
+        evaluated incrementally, on each update of the state entries they
+        depend on.
     
-        :param var: either a predicate (callable) or one of the key of
-                    ``robot.state``.
+        :param var: either a predicate (callable), one of the key of
+                    ``robot.state`` or an :class:`.EventExpression`.
         :param max_firing_freq: set how many times pe second this event may be
                                 triggered (default to 10Hz. 0 means as many as
-                                possible).
+                                possible). If a trigger is dropped by the
+                                rate limiting, the condition is checked again
+                                as soon as the event may fire: as long as the
+                                condition holds, the event keeps firing at
+                                ``max_firing_freq``.
         :param blocking: if ``True``, the event callback is blocking, preventing
                          new event to be triggered until the callback has
                          completed (defaults to ``True``).
+        :param burst: (keyword argument, default to 1) number of times the
+                      event may fire back to back before ``max_firing_freq``
+                      applies (cf :class:`.TokenBucket`).
+        :param rate_policy: (keyword argument, default to ``"drop"``) what to
+                            do with triggers exceeding the rate limit:
+                            ``"drop"`` them, keep the ``"latest"`` one to fire
+                            it later, or ``"queue"`` up to ``max_pending`` of
+                            them.
+        :param concurrency: (keyword argument) if set, callbacks are run
+                            through a bounded :class:`.CallbackQueue` instead
+                            (``blocking`` is then ignored): the monitor keeps
+                            detecting the event while at most ``concurrency``
+                            firings have their callbacks running. Up to
+                            ``max_queued`` further firings are queued; on
+                            ``overflow``, the new firing is dropped
+                            (``"drop"``, default) or replaces the oldest queued
+                            one (``"drop_oldest"``).
+        :param hysteresis: (keyword argument, ``above=``/``below=`` only) once
+                           the condition holds, it only stops holding when the
+                           value crosses back the threshold by more than
+                           ``hysteresis``.
+        :param debounce: (keyword argument, state-based events only) the
+                         condition must be stable for ``debounce`` seconds
+                         before being considered to hold (or not to hold
+                         anymore).
+        :param min_duration: (keyword argument, state-based events only) the
+                             condition must hold for ``min_duration`` seconds
+                             before the event fires.
+
+                             With any of these three options, the event fires
+                             only once each time the (filtered) condition
+                             starts holding, instead of continuously while it
+                             holds (cf :class:`.ConditionFilter`).
         :param kwargs: the monitor behaviour (cf above)
         :returns: a new instance of :class:`EventMonitor` for this event.
         """
         monitor = EventMonitor(self.robot, var, oneshot=False, max_firing_freq = max_firing_freq, blocking = blocking, **kwargs)
-        self.eventmonitors.append(weakref.ref(monitor))
+        self._register(monitor)
         return monitor
 
+    def _register(self, monitor):
+        if monitor.valid:
+            with self._monitors_lock:
+                self.eventmonitors.add(monitor)
+
+    def _unregister(self, monitor):
+        with self._monitors_lock:
+            self.eventmonitors.discard(monitor)
+
+    def monitors(self):
+        """ Returns the list of live event monitors (created and not
+        completed, closed nor garbage-collected yet).
+        """
+        with self._monitors_lock:
+            return list(self.eventmonitors)
+
+    def count(self):
+        """ Returns the number of live event monitors.
+        """
+        return len(self.eventmonitors)
+
     def stop_all_monitoring(self):
         """ Stops all event monitoring, but do not interrupt event callbacks,
         if any is running.
@@ -94,10 +205,8 @@ class Events:
         callback as well).
 
         """
-        for m in self.eventmonitors:
-            monitor = m() # weakref!
-            if monitor:
-                monitor.stop_monitoring()
+        for monitor in self.monitors():
+            monitor.stop_monitoring()
 
     def cancel_all(self):
         """ Cancels all event monitors and interrupt running event callbacks (if
@@ -106,18 +215,53 @@ class Events:
         # first, we tell *all* monitors not to trigger any events anymore
         # then we actually stop the monitors by interupting the callbacks
         # they may be processing.
-        self.stop_all_monitoring()
+        monitors = self.monitors()
+        for monitor in monitors:
+            monitor.stop_monitoring()
 
-        for m in self.eventmonitors:
-            monitor = m() # weakref!
-            if monitor:
-                monitor.close()
+        for monitor in monitors:
+            monitor.close()
 
 
     def close(self):
         self.cancel_all()
 
-class EventMonitor:
+    def _threshold_index(self, var):
+        """ Returns the :class:`.ThresholdIndex` of the state entry ``var``,
+        or ``None`` if the robot state does not notify its updates.
+        """
+        state = self.robot.state
+        if not hasattr(state, "add_listener"):
+            return None
+
+        with self._indices_lock:
+            if state is not self._indexed_state:
+                # first indexed monitor, or the robot state has been replaced
+                if self._indexed_state is not None:
+                    self._indexed_state.remove_listener(self._on_state_update)
+                state.add_listener(self._on_state_update)
+                self._indexed_state = state
+                self._indices = {}
+
+            index = self._indices.get(var)
+            if index is None:
+                index = self._indices[var] = ThresholdIndex()
+            return index
+
+    def _on_state_update(self, key, value):
+        index = self._indices.get(key)
+        if index:
+            for monitor in index.matching(value):
+                monitor._notify()
+
+class _ConditionChecks:
+    """ The conditions on a state entry, shared by :class:`EventMonitor`
+    and :class:`StateWaiter`.
+
+    Checks are evaluated on successive values of the entry, and rely on
+    ``last_value``, ``start_inc_value``, ``start_dec_value``, ``hysteresis``
+    and ``_latched``.
+    """
 
     VALUE = "="
     BECOMES = "becomes"
@@ -126,6 +270,72 @@ class EventMonitor:
     INCREASE = "+="
     DECREASE = "-="
 
+    # keyword arguments defining the condition
+    MODES = {"value": VALUE,
+             "becomes": BECOMES,
+             "above": ABOVE,
+             "below": BELOW,
+             "increase": INCREASE,
+             "decrease": DECREASE}
+
+    hysteresis = 0.
+    _latched = False
+
+    def _checker(self, mode):
+        return {
+                self.VALUE: self._check_value,
+                self.BECOMES: self._check_becomes,
+                self.ABOVE: self._check_above,
+                self.BELOW: self._check_below,
+                self.INCREASE: self._check_increase,
+                self.DECREASE: self._check_decrease,
+                None: None
+                }[mode]
+
+    def _check_value(self, val):
+        self.last_value = val
+        return val == self.target
+
+    def _check_becomes(self, val):
+        ok = self.last_value != val and val == self.target
+        self.last_value = val
+        return ok
+
+    def _check_above(self, val):
+        self.last_value = val
+        threshold = self.target - self.hysteresis if self._latched else self.target
+        self._latched = val > threshold
+        return self._latched
+
+    def _check_below(self, val):
+        self.last_value = val
+        threshold = self.target + self.hysteresis if self._latched else self.target
+        self._latched = val < threshold
+        return self._latched
+
+    def _check_increase(self, val):
+        # (glitches are filtered out by the ConditionFilter of the monitor,
+        # with debounce = ... or min_duration = ...)
+        self.last_value = val
+        if val > (self.start_inc_value + self.target):
+            self.start_inc_value = val
+            return True
+        if val < self.start_inc_value:
+            self.start_inc_value = val
+        return False
+
+    def _check_decrease(self, val):
+        self.last_value = val
+        if val < (self.start_dec_value - self.target):
+            self.start_dec_value = val
+            return True
+        if val > self.start_dec_value:
+            self.start_dec_value = val
+        return False
+
+
+class EventMonitor(_ConditionChecks):
+
     def __init__(self, robot, var, 
                         value = None, 
                         becomes = None,
@@ -135,14 +345,26 @@ class EventMonitor:
                         decrease = None,
                         oneshot = False,
                         max_firing_freq = 10,
-                        blocking = True):
+                        blocking = True,
+                        track_dependencies = False,
+                        burst = 1,
+                        rate_policy = TokenBucket.DROP,
+                        max_pending = 10,
+                        concurrency = None,
+                        max_queued = 10,
+                        overflow = CallbackQueue.DROP,
+                        hysteresis = 0.,
+                        debounce = 0.,
+                        min_duration = 0.):
         self.cbs= [] # callbacks
 
         self.robot = robot
 
         self.valid = False
 
-        if not callable(var):
+        self.composite = isinstance(var, EventExpression)
+
+        if not callable(var) and not self.composite:
             if var not in robot.state:
                 raise Exception("%s is neither a member of the robot's state or a predicate" % var)
 
@@ -157,19 +379,35 @@ class EventMonitor:
         self.oneshot = oneshot
         self.max_firing_freq= max_firing_freq
         self.blocking = blocking
+        self.track_dependencies = track_dependencies
+        self._dependencies = (None, None) # state entries read by the predicate, and version
 
         self.monitoring = False
         self.thread = None
 
+        self._waker = None # waker of the thread waiting for the condition
+        self._deadline = None # time at which the current wait gives up
+
+        # rate limiting of the firings. The condition keeps being monitored
+        # while the limit is reached.
+        self.limiter = None
+        if not oneshot:
+            self.limiter = TokenBucket(max_firing_freq, burst, rate_policy, max_pending)
+
+        # bounded, non-blocking execution of the callbacks
+        self.callbacks = None
+        if concurrency is not None:
+            self.callbacks = CallbackQueue(robot, concurrency, max_queued, overflow)
+
 
         # store initial value, used by INCREASE/DECREASE modes
         # and last value, used by BECOMES modes
-        if not self.robot.dummy and not callable(self.var):
+        if not self.robot.dummy and not callable(self.var) and not self.composite:
             self.start_inc_value = self.robot.state[self.var]
             self.start_dec_value = self.robot.state[self.var] 
             self.last_value = self.robot.state[self.var] 
 
-        if not callable(self.var):
+        if not callable(self.var) and not self.composite:
             if value is not None:
                 self.mode = EventMonitor.VALUE
                 self.target = value
@@ -194,6 +432,34 @@ class EventMonitor:
             self.mode = None
             self.target= None
 
+        if hysteresis and self.mode not in (EventMonitor.ABOVE, EventMonitor.BELOW):
+            raise Exception("Hysteresis is only available for 'above' and 'below' events")
+        if (debounce or min_duration) and self.mode is None:
+            raise Exception("Debouncing is only available for events on a single state entry")
+
+        self.hysteresis = hysteresis
+        self._latched = False # for hysteresis: has the threshold been crossed?
+
+        # 'compile' the condition
+        self._check_condition = self._checker(self.mode)
+
+        # edge-triggered, filtered condition: the monitor needs to see every
+        # update, including those that do not satisfy the condition.
+        self._check_raw = self._check_condition
+        self.filter = None
+        if hysteresis or debounce or min_duration:
+            self.filter = ConditionFilter(debounce, min_duration)
+            self._check_condition = lambda val: self.filter.update(self._check_raw(val), get_clock().time())
+
+        # conditions that can be indexed in a ThresholdIndex
+        self.indexable = self.filter is None and self.mode in (EventMonitor.ABOVE, EventMonitor.BELOW)
+        if self.filter is None and self.mode == EventMonitor.VALUE:
+            try:
+                hash(self.target)
+                self.indexable = True
+            except TypeError:
+                pass
+
 
         logger.info("Added new event monitor: %s" % self)
 
@@ -214,84 +480,276 @@ class EventMonitor:
         self.cbs.append(cb)
         return self # to allow for chaining
 
+    def __and__(self, other):
+        return Condition(self) & other
+
+    def __or__(self, other):
+        return Condition(self) | other
+
+    def __invert__(self):
+        return ~Condition(self)
+
+    def then(self, other, within = None):
+        """ Returns an :class:`.EventExpression` that holds when ``other``
+        holds after this event, within at most ``within`` seconds (if not
+        ``None``).
+        """
+        return Condition(self).then(other, within)
+
     def _monitor(self):
+        try:
+            self._monitor_loop()
+        except ActionCancelled:
+            logger.info("Event monitor on %s cancelled" % self)
+        finally:
+            self._release()
+            self.robot.events._unregister(self)
+
+    def _monitor_loop(self):
 
         threading.current_thread().name = "Event monitor on %s" % self
+        fresh = False
         while self.monitoring:
-            ok = self._wait_for_condition()
-            if not ok: # monitoring has been interrupted!
+            deadline = self.limiter.next_release() if self.limiter else None
+            ok = self._wait_for_condition(fresh, deadline)
+            if not self.monitoring: # monitoring has been interrupted!
                 return
 
+            if ok:
+                fire = self.limiter.trigger() if self.limiter else True
+            else:
+                # the deadline has been reached: a deferred firing can
+                # proceed, or a dropped trigger can be retried
+                fire = self.limiter.release()
+
+            if not fire:
+                # rate limited: wait for a new trigger, until the deadline.
+                # Once it is reached without deferred firing, the condition
+                # is checked again on the current value, as the dropped
+                # trigger would have been.
+                fresh = ok or self.limiter.pending > 0
+                continue
+
+            # callbacks run asynchronously through the callback queue: the
+            # next firing requires a new trigger, or we would keep queueing
+            # firings for the same state update.
+            fresh = self.callbacks is not None
+
             if introspection:
                 introspection.action_event_fired("BROKEN TDB", str(self))
 
-            for cb in self.cbs:
-                if not self.blocking:
-                    cb(self.robot)
-                else:
-                    cb(self.robot).wait()
-
-                    # after a blocking event, reset the reference values for
-                    # events INCREASE and DECREASE
-                    if not callable(self.var):
-                        self.start_inc_value = self.robot.state[self.var]
-                        self.start_dec_value = self.robot.state[self.var]
+            if self.callbacks is not None:
+                self.callbacks.push(list(self.cbs))
+            else:
+                for cb in self.cbs:
+                    if not self.blocking:
+                        cb(self.robot)
+                    else:
+                        cb(self.robot).wait()
+
+                        # after a blocking event, reset the reference values for
+                        # events INCREASE and DECREASE
+                        if not callable(self.var) and not self.composite:
+                            self.start_inc_value = self.robot.state[self.var]
+                            self.start_dec_value = self.robot.state[self.var]
 
             if self.oneshot:
                 logger.info("Removing event on %s" % self)
                 return
-            else:
-                if self.max_firing_freq > 0:
-                    self.robot.sleep(1./self.max_firing_freq)
 
     def stop_monitoring(self):
         self.monitoring = False
+        if self.callbacks is not None:
+            self.callbacks.clear()
+        self._notify()
+        self._release()
+
+    def _release(self):
+        """ Stops listening to the state updates, for composite events.
+        """
+        if self.composite:
+            self.var.unwatch(self)
+
+    def _notify(self):
+        """ Wakes up the thread waiting for the condition (if any).
+        """
+        waker = self._waker
+        if waker is not None:
+            waker.set()
 
     def close(self):
-         if self.valid and self.thread and self.thread.is_alive:
+        if self.valid and self.thread and self.thread.is_alive():
             self.thread.cancel()
             self.thread.join()
+        self._release()
+        self.robot.events._unregister(self)
+
+    def _interrupted(self):
+        """ Returns ``True`` if the current wait must end, because the
+        monitoring has been stopped or the wait deadline is reached.
+        """
+        if not self.monitoring:
+            logger.info("<%s> not monitored anymore" % str(self))
+            return True
+        return self._deadline is not None and get_clock().time() >= self._deadline
+
+    def _timeout(self, timeout = ACTIVE_SLEEP_RESOLUTION):
+        """ Returns how long to wait before checking again the condition (at
+        most ``timeout``, but not beyond the wait deadline, nor beyond the
+        time at which the condition filter needs to be updated).
+        """
+        deadline = self._deadline
+        if self.filter is not None:
+            pending = self.filter.next_deadline()
+            if pending is not None and (deadline is None or pending < deadline):
+                deadline = pending
+
+        if deadline is None:
+            return timeout
+        return max(0., min(timeout, deadline - get_clock().time()))
+
+    def _wait_for_threshold(self, index, fresh):
+        """ Waits for an indexed condition: the thread sleeps until the
+        :class:`.ThresholdIndex` notifies a state update that satisfies it.
+        """
+        state = self.robot.state
+        clock = get_clock()
+
+        self._waker = current_waker()
+        if self.mode == EventMonitor.ABOVE:
+            index.add_above(self.target, self)
+        elif self.mode == EventMonitor.BELOW:
+            index.add_below(self.target, self)
+        else:
+            index.add_value(self.target, self)
 
-    def _check_condition(self, val):
+        try:
+            while fresh or not self._check_condition(state[self.var]):
+                fresh = False
+                if self._interrupted():
+                    return False
+                clock.park(self._waker, self._deadline)
+        finally:
+            index.remove(self)
+            self._waker = None
 
-        ok = False
+        return True
 
-        if self.mode == EventMonitor.VALUE and val == self.target:
-            ok = True
-        elif self.mode == EventMonitor.BECOMES and self.last_value != val and val == self.target:
-            ok = True
-        elif self.mode == EventMonitor.ABOVE and val > self.target:
-            ok = True
-        elif self.mode == EventMonitor.BELOW and val < self.target:
-            ok = True
-        elif self.mode == EventMonitor.INCREASE and val > (self.start_inc_value + self.target):
-            self.start_inc_value = val
-            ok = True
-        elif self.mode == EventMonitor.DECREASE and val < (self.start_dec_value - self.target):
-            self.start_dec_value = val
-            ok = True
+    def _wait_for_predicate(self, fresh):
+        """ Waits for a predicate, only re-evaluating it when one of the state
+        entries it read during its last evaluation is written.
+        """
+        state = self.robot.state
+
+        keys, version = self._dependencies if fresh else (None, None)
+        while True:
+            if keys is None:
+                version = state.version()
+                with state.recording_reads() as keys:
+                    ok = self.var(self.robot)
+                self._dependencies = (keys, version)
+                if ok:
+                    return True
+
+            if not keys:
+                # the predicate does not depend on the state (anymore?)
+                get_clock().sleep(self._timeout())
+
+            while keys and state.wait_for_any(keys, version, self._timeout()) <= version:
+                if self._interrupted():
+                    return False
 
-        # TODO: could be improved with a bit of hysteris filtering
-        if val > self.start_dec_value:
-            self.start_dec_value = val
-        if val < self.start_inc_value:
-            self.start_inc_value = val
+            if self._interrupted():
+                return False
+            keys = None
 
-        self.last_value = val
-        return ok
+    def _wait_for_expression(self, fresh):
+        """ Waits for a composite event: the expression is evaluated on the
+        state updates, and wakes up the thread when it holds.
+        """
+        expr = self.var
+        clock = get_clock()
+
+        self._waker = current_waker()
+        expr.watch(self.robot, self)
+        hits = expr.hits
+        try:
+            if not fresh and expr.value:
+                return True
+            while expr.hits == hits:
+                if self._interrupted():
+                    return False
+                clock.park(self._waker, self._deadline)
+        finally:
+            self._waker = None
+
+        return True
+
+    def _poll_state(self, fresh):
+        """ Waits for a state-based condition by checking it on every update of
+        the state.
+        """
+        state = self.robot.state
+        versioned = hasattr(state, "wait_for_version")
+
+        version = state.version(self.var) if versioned and fresh else None
+        while True:
+            if fresh:
+                fresh = False
+            elif not versioned:
+                if self._check_condition(state[self.var]):
+                    return True
+            elif state.version(self.var) != version:
+                # only evaluate the condition on newly written values
+                version = state.version(self.var)
+                if self._check_condition(state[self.var]):
+                    return True
+            elif self.filter is not None and self.filter.tick(get_clock().time()):
+                # no new value, but the condition has now held long enough
+                return True
+
+            if self._interrupted():
+                return False
+
+            if versioned:
+                state.wait_for_version(self.var, version, self._timeout())
+            else:
+                self.robot.wait_for_state_update(self._timeout())
 
+    def _wait_for_condition(self, fresh = False, deadline = None):
+        """ Blocks until the condition is met.
+
+        :param fresh: if ``True``, the current value does not count: waits
+          for the condition to be met by a new state update.
+        :param deadline: if not ``None``, gives up at that time.
+        :returns: ``True`` if the condition has been met, ``False`` if the
+          monitoring has been stopped or the deadline reached.
+        """
+        self._deadline = deadline
 
-    def _wait_for_condition(self):
-        import time
         if not self.robot.dummy:
 
+            # composite event
+            if self.composite:
+                if not self._wait_for_expression(fresh):
+                    return False
+
             # predicate-based event
-            if callable(self.var):
+            elif callable(self.var):
                 if not self.monitoring:
                     logger.info("<%s> not monitored anymore" % str(self))
                     return False
-                while not self.var(self.robot):
-                    time.sleep(ACTIVE_SLEEP_RESOLUTION)
+
+                if self.track_dependencies and hasattr(self.robot.state, "recording_reads"):
+                    if not self._wait_for_predicate(fresh):
+                        return False
+                else:
+                    if fresh:
+                        get_clock().sleep(self._timeout())
+                    while not self.var(self.robot):
+                        if self._interrupted():
+                            return False
+                        get_clock().sleep(self._timeout())
 
             # state-based event
             else:
@@ -301,16 +759,21 @@ class EventMonitor:
                     while not self.var in self.robot.state:
                         self.robot.wait_for_state_update(2)
 
-                while not self._check_condition(self.robot.state[self.var]):
-                    if not self.monitoring:
-                        logger.info("<%s> not monitored anymore" % str(self))
-                        return False
-                    self.robot.wait_for_state_update(ACTIVE_SLEEP_RESOLUTION)
+                index = self.robot.events._threshold_index(self.var) if self.indexable else None
+                if index is not None:
+                    ok = self._wait_for_threshold(index, fresh)
+                else:
+                    ok = self._poll_state(fresh)
+
+                if not ok:
+                    return False
 
         else:
             #dummy mode. Wait a little bit, and assume the condition is true
 
-            time.sleep(0.2)
+            get_clock().sleep(self._timeout(0.2))
+            if self._deadline is not None and get_clock().time() >= self._deadline:
+                return False
         logger.info("%s is true" % str(self) + (" (dummy mode)" if self.robot.dummy else ""))
         return True
 
@@ -323,8 +786,93 @@ class EventMonitor:
             introspection.action_waiting("BROKEN TDB", str(self))
 
 
+        if not self.thread:
+            # not monitored by a thread: monitor while waiting
+            self.monitoring = True
+
         self._wait_for_condition()
 
+        if not self.thread:
+            self.monitoring = False
+            self._release()
+            if self.oneshot:
+                self.robot.events._unregister(self)
+
+        if introspection:
+            introspection.action_waiting_over("BROKEN TDB")
+
+    def __str__(self):
+        if self.composite:
+            return "condition <%s>" % self.var
+        return "condition <%s %s %s>"% (self.var, self.mode, self.target)
+
+class StateWaiter(_ConditionChecks):
+    """ A one-off wait for a condition on a state entry: the lightweight
+    counterpart of a one-shot :class:`EventMonitor`, used by
+    :meth:`Events.wait`.
+
+    The waiter is not registered as an event monitor. ``value=``, ``above=``
+    and ``below=`` conditions are registered in the :class:`.ThresholdIndex`
+    of the entry, and the waiting thread is only woken up by updates
+    satisfying the condition. Other conditions are checked on each update of
+    the entry.
+    """
+
+    def __init__(self, robot, var, mode, target):
+        self.robot = robot
+        self.var = var
+        self.mode = mode
+        self.target = target
+
+        self.last_value = self.start_inc_value = self.start_dec_value = robot.state[var]
+
+        self._check_condition = self._checker(mode)
+        self._waker = None
+
+    def _notify(self):
+        waker = self._waker
+        if waker is not None:
+            waker.set()
+
+    def _index(self):
+        if self.mode not in (self.VALUE, self.ABOVE, self.BELOW):
+            return None
+        try:
+            hash(self.target)
+        except TypeError:
+            return None
+        return self.robot.events._threshold_index(self.var)
+
+    def wait(self):
+        """ Blocks until the condition is met.
+        """
+        if introspection:
+            introspection.action_waiting("BROKEN TDB", str(self))
+
+        state = self.robot.state
+        clock = get_clock()
+
+        self._waker = current_waker()
+        index = self._index()
+        if index is not None:
+            if self.mode == self.ABOVE:
+                index.add_above(self.target, self)
+            elif self.mode == self.BELOW:
+                index.add_below(self.target, self)
+            else:
+                index.add_value(self.target, self)
+
+        try:
+            version = state.version(self.var)
+            while not self._check_condition(state[self.var]):
+                if index is not None:
+                    clock.park(self._waker)
+                else:
+                    version = state.wait_for_version(self.var, version)
+        finally:
+            if index is not None:
+                index.remove(self)
+            self._waker = None
 
         if introspection:
             introspection.action_waiting_over("BROKEN TDB")
@@ -0,0 +1,77 @@
+# coding=utf-8
+"""
+Temporal filtering of event conditions.
+"""
+
+class ConditionFilter:
+    """ Filters the successive truth values of an event condition, to only
+    fire once per (stable) occurrence of the condition.
+
+    - ``debounce``: the filtered condition only changes (becomes true, or
+      false) once the raw condition has kept its new value for ``debounce``
+      seconds. Shorter glitches and dropouts are ignored.
+    - ``min_duration``: the event only fires once the condition has been
+      true for ``min_duration`` seconds. Contrary to ``debounce``, any
+      dropout restarts the count.
+
+    The event fires once when the filtered condition holds long enough, and
+    is re-armed when the filtered condition becomes false again.
+
+    Time is given by the caller: :meth:`update` is called with each new
+    truth value of the condition, and :meth:`tick` when no new value is
+    available by :meth:`next_deadline`.
+    """
+
+    def __init__(self, debounce = 0., min_duration = 0.):
+        self.debounce = debounce
+        self.min_duration = min_duration
+
+        self.raw = False
+        self.raw_since = None
+
+        self.active = False # filtered condition
+        self.armed = True
+
+    def update(self, raw, now):
+        """ Feeds a new truth value of the condition.
+
+        :returns: ``True`` if the event must fire.
+        """
+        if raw != self.raw or self.raw_since is None:
+            self.raw = raw
+            self.raw_since = now
+
+        return self.tick(now)
+
+    def tick(self, now):
+        """ Updates the filter when time passes without new value.
+
+        :returns: ``True`` if the event must fire.
+        """
+        if self.raw_since is None:
+            return False
+
+        if self.raw != self.active and now - self.raw_since >= self.debounce:
+            self.active = self.raw
+            if self.active:
+                self.active_since = self.raw_since
+            else:
+                self.armed = True
+
+        if self.active and self.armed and now - self.active_since >= self.min_duration:
+            self.armed = False
+            return True
+
+        return False
+
+    def next_deadline(self):
+        """ Returns the time at which :meth:`tick` may fire the event or
+        change the filtered condition, or ``None``.
+        """
+        if self.raw_since is None:
+            return None
+        if self.raw != self.active:
+            return self.raw_since + self.debounce
+        if self.active and self.armed:
+            return self.active_since + self.min_duration
+        return None
@@ -0,0 +1,127 @@
+# coding=utf-8
+"""
+Rate limiting of event firings.
+"""
+import threading
+
+from robots.concurrency import get_clock
+
+class TokenBucket:
+    """ Token bucket limiting how often an event monitor fires.
+
+    The bucket holds at most ``burst`` tokens and is refilled at ``rate``
+    tokens per second. Each firing consumes one token. When the event is
+    triggered while the bucket is empty, the ``policy`` decides what happens
+    to the trigger:
+
+    - :data:`DROP`: the trigger is discarded (counted as *suppressed*). The
+      caller may retry it once a token is available (cf :meth:`next_release`),
+    - :data:`LATEST`: one firing is deferred until a token is available.
+      Further triggers in the meantime are merged into it (counted as
+      *coalesced*),
+    - :data:`QUEUE`: firings are deferred, up to ``max_pending`` of them.
+      Triggers beyond that are suppressed.
+
+    The counters :attr:`fired`, :attr:`suppressed` and :attr:`coalesced` are
+    updated accordingly.
+
+    :param rate: tokens per second. 0 disables the rate limiting.
+    :param burst: capacity of the bucket, ie, the number of events that can
+      fire back to back.
+    """
+
+    DROP = "drop"
+    LATEST = "latest"
+    QUEUE = "queue"
+
+    def __init__(self, rate, burst = 1, policy = DROP, max_pending = 10):
+
+        if policy not in (TokenBucket.DROP, TokenBucket.LATEST, TokenBucket.QUEUE):
+            raise Exception("Unknown rate limiting policy <%s>" % policy)
+
+        self.rate = rate
+        self.burst = burst
+        self.policy = policy
+        self.max_pending = max_pending if policy == TokenBucket.QUEUE else 1
+
+        self.tokens = float(burst)
+        self.last_refill = get_clock().time()
+        self.pending = 0 # deferred firings
+        self.dropped = False # a trigger has been dropped since the last release
+
+        self.fired = 0
+        self.suppressed = 0
+        self.coalesced = 0
+
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = get_clock().time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def _take(self):
+        if not self.rate:
+            return True
+
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def trigger(self):
+        """ To be called when the event is triggered.
+
+        :returns: ``True`` if the event can fire right away.
+        """
+        with self._lock:
+            self.dropped = False
+            if not self.pending and self._take():
+                self.fired += 1
+                return True
+
+            if self.policy == TokenBucket.DROP:
+                self.suppressed += 1
+                self.dropped = True
+            elif self.pending < self.max_pending:
+                self.pending += 1
+            elif self.policy == TokenBucket.LATEST:
+                self.coalesced += 1
+            else:
+                self.suppressed += 1
+            return False
+
+    def release(self):
+        """ Returns ``True`` if a deferred firing can now take place (it is
+        then counted as fired).
+
+        A dropped trigger is never fired by :meth:`release`: the caller is
+        expected to check again its condition, and to call :meth:`trigger`.
+        """
+        with self._lock:
+            self.dropped = False
+            if self.pending and self._take():
+                self.pending -= 1
+                self.fired += 1
+                return True
+            return False
+
+    def next_release(self):
+        """ Returns the time at which the next deferred firing (or the retry
+        of a dropped trigger) can take place, or ``None`` if no firing is
+        deferred nor has been dropped since the last :meth:`release`.
+        """
+        with self._lock:
+            if not self.pending and not self.dropped:
+                return None
+            if not self.rate:
+                return get_clock().time()
+            self._refill()
+            return self.last_refill + max(0., 1 - self.tokens) / self.rate
+
+    def stats(self):
+        return {"fired": self.fired,
+                "suppressed": self.suppressed,
+                "coalesced": self.coalesced,
+                "pending": self.pending}
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+Compiled threshold conditions on one entry of the robot state.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+
+class ThresholdIndex:
+    """ Indexes every ``value=``, ``above=`` and ``below=`` event monitor
+    watching the same entry of the robot state.
+
+    ``above`` and ``below`` thresholds are kept sorted, and ``value`` targets
+    are hashed: upon each update of the entry, :meth:`matching` finds every
+    monitor whose condition holds with one bisection per mode, instead of
+    evaluating each monitor's condition in turn.
+
+    :class:`robots.events.Events` maintains one index per watched entry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # parallel lists, sorted by threshold
+        self._above_thresholds = []
+        self._above = []
+        self._below_thresholds = []
+        self._below = []
+
+        self._values = {} # target -> list of monitors
+
+    def __len__(self):
+        return len(self._above) + len(self._below) + sum(len(m) for m in self._values.values())
+
+    def add_above(self, threshold, monitor):
+        with self._lock:
+            idx = bisect_right(self._above_thresholds, threshold)
+            self._above_thresholds.insert(idx, threshold)
+            self._above.insert(idx, monitor)
+
+    def add_below(self, threshold, monitor):
+        with self._lock:
+            idx = bisect_right(self._below_thresholds, threshold)
+            self._below_thresholds.insert(idx, threshold)
+            self._below.insert(idx, monitor)
+
+    def add_value(self, target, monitor):
+        """ ``target`` must be hashable.
+        """
+        with self._lock:
+            self._values.setdefault(target, []).append(monitor)
+
+    def remove(self, monitor):
+        with self._lock:
+            for thresholds, monitors in [(self._above_thresholds, self._above),
+                                         (self._below_thresholds, self._below)]:
+                for idx, m in enumerate(monitors):
+                    if m is monitor:
+                        del thresholds[idx]
+                        del monitors[idx]
+                        return
+
+            for target, monitors in self._values.items():
+                if monitor in monitors:
+                    monitors.remove(monitor)
+                    if not monitors:
+                        del self._values[target]
+                    return
+
+    def matching(self, value):
+        """ Returns the list of monitors whose condition holds for ``value``.
+        """
+        with self._lock:
+            # 'above' monitors with a threshold strictly lower than value,
+            # 'below' monitors with a threshold strictly greater than value
+            matches = self._above[:bisect_left(self._above_thresholds, value)]
+            matches += self._below[bisect_right(self._below_thresholds, value):]
+            try:
+                matches += self._values.get(value, [])
+            except TypeError: # unhashable value
+                pass
+        return matches
@@ -1,4 +1,5 @@
 # coding=utf-8
+import bisect
 from collections import deque
 
 # enums in Python, thanks http://stackoverflow.com/questions/36932
@@ -30,6 +31,49 @@ class valuefilter:
 
         return self.lastval
 
+class Histogram:
+    """ A histogram of durations (in seconds), with logarithmic buckets
+    (1-2-5 series, from 100us to 1000s): constant memory, O(1) insertion,
+    and percentiles accurate to the bucket.
+    """
+
+    BOUNDS = [m * 10 ** e for e in range(-4, 3) for m in (1, 2, 5)] + [1000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1) # last bucket: above the last bound
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value):
+        idx = bisect.bisect_left(self.BOUNDS, value)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def percentile(self, p):
+        """ Returns the upper bound of the bucket containing the ``p``-th
+        percentile (or the maximum, if smaller).
+        """
+        if not self.count:
+            return 0.
+        rank = p / 100. * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if idx == len(self.BOUNDS):
+                    return self.max
+                return min(self.BOUNDS[idx], self.max)
+        return self.max
+
+    def __str__(self):
+        return "%d samples, mean %.3fs, p50 %.3fs, p99 %.3fs, max %.3fs" % \
+                (self.count, self.mean(), self.percentile(50), self.percentile(99), self.max)
 
 
 ## Taken from http://code.activestate.com/recipes/578389-print-logger-internals/
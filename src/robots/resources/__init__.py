@@ -1,3 +1,4 @@
 # coding=utf-8
 from .resources import *
 from .lock import lock
+from .metrics import all_resources, contention_report, wait_for_graph, find_deadlocks
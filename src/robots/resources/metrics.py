@@ -0,0 +1,153 @@
+# coding=utf-8
+"""
+Contention metrics of the resources, and wait-for graph of the actions.
+
+Every :class:`.Resource` (and :class:`.CompoundResource`) keeps statistics
+on its use (``res.stats``, cf :class:`ResourceStats`): this tells which
+resources serialize the actions of the robot.
+
+.. code-block:: python
+
+    >>> print(contention_report())
+    WHEELS: 153 acquisitions (41 contended, 0 refused), 2 waiting
+        hold: 153 samples, mean 2.310s, p50 2.000s, p99 10.000s, max 8.531s
+        wait: 41 samples, mean 1.104s, p50 1.000s, p99 5.000s, max 4.102s
+    ...
+
+:func:`wait_for_graph` returns who waits for whom (actions waiting for a
+resource owned by another action, or for one of their sub-actions), and
+:func:`find_deadlocks` the cycles of this graph: a group of actions that
+wait for each other, and will never complete.
+"""
+import logging; logger = logging.getLogger("robots.resources")
+
+import weakref
+from threading import Lock
+
+from robots.helpers.misc import Histogram
+
+_registry = weakref.WeakSet() # all the resources
+_registry_lock = Lock()
+
+def register(res):
+    with _registry_lock:
+        _registry.add(res)
+
+def all_resources():
+    """ Returns the existing resources (and compound resources).
+    """
+    with _registry_lock:
+        return list(_registry)
+
+class ResourceStats:
+    """ Usage statistics of a resource.
+
+    :ivar acquisitions: number of times the resource has been acquired
+    :ivar contended: number of acquisitions that had to wait
+    :ivar refused: number of acquisitions that failed (with ``wait = False``)
+    :ivar preemptions: number of owners preempted by a higher priority action
+    :ivar hold: :class:`.Histogram` of the durations the resource was owned
+    :ivar wait: :class:`.Histogram` of the durations waited for the resource
+      (including waits interrupted by a cancellation)
+    """
+    def __init__(self):
+        self.acquisitions = 0
+        self.contended = 0
+        self.refused = 0
+        self.preemptions = 0
+        self.hold = Histogram()
+        self.wait = Histogram()
+
+    def __str__(self):
+        return "%d acquisitions (%d contended, %d refused)" % (self.acquisitions, self.contended, self.refused)
+
+def contention_report():
+    """ Returns a human-readable summary of the use of the resources, the
+    most waited for first.
+    """
+    resources = sorted(all_resources(), key = lambda r: r.stats.wait.total, reverse = True)
+    report = ""
+    for res in resources:
+        report += "%s: %s, %d waiting\n" % (res.name or "<unnamed>", res.stats, res.waiting())
+        report += "    hold: %s\n" % res.stats.hold
+        report += "    wait: %s\n" % res.stats.wait
+    return report
+
+def wait_for_graph():
+    """ Returns the current wait-for graph, as a list of edges ``(waiter,
+    resource, owner)``:
+
+    - ``waiter`` is an action (or the name of the acquirer, for resources
+      not acquired by actions) waiting for ``resource``, owned by ``owner``
+      (an action or the name of the owner),
+    - ``resource`` is ``None`` if ``waiter`` waits for the completion of its
+      sub-action ``owner``.
+    """
+    edges = []
+    actions = {} # id -> action, for the owners met in the graph
+    for res in all_resources():
+        for waiter, owner in res.waits():
+            edges.append((waiter, res, owner))
+            if owner is not None and hasattr(owner, "waiting_for"):
+                actions[id(owner)] = owner
+
+    # owners of resources may themselves wait for their sub-actions
+    visited = set()
+    while actions:
+        aid, action = actions.popitem()
+        visited.add(aid)
+        subaction = action.waiting_for
+        if subaction is not None:
+            edges.append((action, None, subaction))
+            if id(subaction) not in visited:
+                actions[id(subaction)] = subaction
+
+    return edges
+
+def _node(x):
+    """ Key of an action (or an acquirer name) in the wait-for graph.
+    """
+    return ("action", id(x)) if hasattr(x, "waiting_for") else ("name", x)
+
+def find_deadlocks():
+    """ Returns the cycles of the wait-for graph, as lists of edges
+    ``(waiter, resource, owner)`` (cf :func:`wait_for_graph`).
+    """
+    graph = {} # node -> edges from this node
+    for edge in wait_for_graph():
+        graph.setdefault(_node(edge[0]), []).append(edge)
+
+    cycles = []
+    done = set() # nodes fully explored
+    for start in graph:
+        if start in done:
+            continue
+
+        # depth-first search: edges[i] goes from nodes[i] to nodes[i+1]
+        nodes, edges = [start], []
+        onpath = {start: 0}
+        stack = [iter(graph[start])]
+        while stack:
+            edge = next(stack[-1], None)
+            if edge is None:
+                stack.pop()
+                node = nodes.pop()
+                del onpath[node]
+                done.add(node)
+                if edges:
+                    edges.pop()
+                continue
+
+            target = _node(edge[2])
+            if target in onpath:
+                cycles.append(edges[onpath[target]:] + [edge])
+            elif target not in done:
+                onpath[target] = len(nodes)
+                nodes.append(target)
+                edges.append(edge)
+                stack.append(iter(graph.get(target, [])))
+
+    for cycle in cycles:
+        logger.warning("Deadlock: " + " -> ".join(
+                "<%s> waits for %s owned by <%s>" % (w, r.name if r else "sub-action", o) for w, r, o in cycle))
+    return cycles
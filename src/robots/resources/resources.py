@@ -1,12 +1,56 @@
 # coding=utf-8
+import logging; logger = logging.getLogger("robots.resources")
+
+import heapq
+import itertools
 from threading import Lock
-import time
+
+from robots.concurrency import get_clock, PRIORITY_NORMAL
+from robots.concurrency.clock import current_waker
+
+from .metrics import ResourceStats, register
+
+class _Waiter:
+    """ A request for a resource, queued while the resource is owned.
+    """
+    def __init__(self, priority, acquirer, action):
+        self.priority = priority
+        self.acquirer = acquirer
+        self.action = action
+        self.waker = current_waker()
+        self.granted = False
 
 class Resource:
+    """ A resource (wheels, arm, speakers...) that only one action can use at
+    a time.
+
+    Actions waiting for the resource are queued by priority (then by order of
+    arrival): when the resource is released, it is directly handed over to
+    the waiting action with the highest priority.
+
+    If an action requests the resource with ``preempt = True`` while it is
+    owned by an action with a lower priority, the owner is cancelled.
+
+    The use of the resource is recorded in ``stats`` (cf
+    :mod:`robots.resources.metrics`).
+    """
+
     def __init__(self, name = ""):
-        self.lock = Lock()
+        self.lock = Lock() # protects the ownership and the wait queue
         self.name = name
-        self.owner = None
+
+        self.owner = None # name of the owner
+        self.owner_action = None # the RobotAction owning the resource, if any
+        self.owner_priority = PRIORITY_NORMAL
+        self.locked = False
+
+        self._waiters = [] # heap of (-priority, arrival, _Waiter)
+        self._arrivals = itertools.count()
+        self._transfers = [] # owners that temporarly released the resource (cf __enter__)
+
+        self.stats = ResourceStats()
+        self.owner_since = None # clock time at which the current owner acquired the resource
+        register(self)
 
     def __str__(self):
         return self.name + ((" (currently owned by <%s>)" % self.owner) if self.owner else " (not currently owned)")
@@ -19,7 +63,7 @@ class Resource:
         lock ownership to a sub-action:
 
         For instance:
-        
+
         .. code-block::python
 
             @action
@@ -38,40 +82,139 @@ class Resource:
         ``WHEELS``, executing ``move()`` and reacquiring the lock, also if
         ``move()`` raises an exception.
         """
+        self._transfers.append((self.owner, self.owner_priority, self.owner_action))
         self.release()
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.acquire()
+        acquirer, priority, action = self._transfers.pop()
+        self.acquire(acquirer = acquirer, priority = priority, action = action)
         # here, the exception, if any, is automatically propagated
 
-    def acquire(self, wait = True, acquirer = "unknown"):
+    def _take(self, acquirer, priority, action):
+        self.locked = True
+        self.owner = acquirer
+        self.owner_priority = priority
+        self.owner_action = action
+        self.owner_since = get_clock().time()
+        self.stats.acquisitions += 1
+
+    def _record_hold(self):
+        if self.owner_since is not None:
+            self.stats.hold.add(get_clock().time() - self.owner_since)
+            self.owner_since = None
+
+    def acquire(self, wait = True, acquirer = "unknown", priority = PRIORITY_NORMAL, action = None, preempt = False):
+        """ Acquires the resource.
 
-        if not wait:
-            if self.lock.acquire(False):
-                self.owner = acquirer
+        :param wait: if ``False``, returns ``False`` right away if the
+          resource is not available.
+        :param acquirer: name of the new owner
+        :param priority: priority of the request in the wait queue
+        :param action: the :class:`.RobotAction` acquiring the resource, if
+          any. Only actions can be preempted.
+        :param preempt: if ``True`` and the resource is owned by an action
+          with a lower priority, cancels this action.
+        :returns: ``True`` if the resource has been acquired
+        """
+        victim = None
+        with self.lock:
+            if not self.locked:
+                self._take(acquirer, priority, action)
                 return True
-            else:
+            if not wait:
+                self.stats.refused += 1
                 return False
-        else:
-            # we need an active wait to make sure we can properly cancel the actions
-            # that are waiting for the resource
-            while True:
-                if self.lock.acquire(False):
-                    self.owner = acquirer
-                    return True
-                time.sleep(0.1)
+
+            self.stats.contended += 1
+            waiter = _Waiter(priority, acquirer, action)
+            heapq.heappush(self._waiters, (-priority, next(self._arrivals), waiter))
+
+            if preempt and self.owner_action is not None and self.owner_priority < priority:
+                # never preempt our own ancestors
+                if action is None or not action.childof(self.owner_action):
+                    victim = self.owner_action
+                    self.stats.preemptions += 1
+
+        if victim is not None:
+            logger.info("<%s> (priority %s) preempts <%s> (priority %s) on resource %s" % (acquirer, priority, victim, self.owner_priority, self.name))
+            # no need to wait for the victim to complete: the resource is
+            # handed over to us (first in the wait queue) when it releases it
+            victim.signal_cancel()
+
+        # the waker is set when the resource is handed over to us, or when
+        # our thread is signaled (ie, cancelled): the wait can be interrupted.
+        clock = get_clock()
+        start = clock.time()
+        try:
+            while not waiter.granted:
+                clock.park(waiter.waker)
+        except:
+            self.stats.wait.add(clock.time() - start)
+            with self.lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters = [w for w in self._waiters if w[2] is not waiter]
+                    heapq.heapify(self._waiters)
+            if granted:
+                # handed over to us while we were cancelled: pass it on
+                self.release()
+            raise
+
+        self.stats.wait.add(clock.time() - start)
+        return True
 
     def release(self):
-        self.lock.release()
-        self.owner = None
+        with self.lock:
+            if not self.locked:
+                raise RuntimeError("Resource %s released while not owned" % self.name)
+
+            self._record_hold()
+
+            if not self._waiters:
+                self.locked = False
+                self.owner = None
+                self.owner_priority = PRIORITY_NORMAL
+                self.owner_action = None
+                return
+
+            # direct hand-over to the waiter with the highest priority
+            waiter = heapq.heappop(self._waiters)[2]
+            self._take(waiter.acquirer, waiter.priority, waiter.action)
+            waiter.granted = True
+
+        waiter.waker.set()
+
+    def waiting(self):
+        """ Returns the number of requests waiting for the resource.
+        """
+        return len(self._waiters)
+
+    def waits(self):
+        """ Returns the current waits for the resource, as a list of
+        ``(waiter, owner)``, where ``waiter`` and ``owner`` are actions (or
+        names of acquirers, when the resource is not acquired by an action).
+        """
+        with self.lock:
+            owner = self.owner_action if self.owner_action is not None else self.owner
+            return [(w.action if w.action is not None else w.acquirer, owner)
+                    for _, _, w in sorted(self._waiters)]
 
 
 class CompoundResource:
+    """ A group of resources, acquired and released together.
+
+    Its ``stats`` record the acquisitions of the group as a whole (the wait
+    time being the time taken to acquire all the resources).
+    """
     def __init__(self, *args, **kwargs):
         self.resources = args
         self.name = kwargs.get("name", "")
         self.owner = None
 
+        self.stats = ResourceStats()
+        self.owner_since = None
+        register(self)
+
     def __str__(self):
         return self.name + ((" (currently owned by <%s>)" % self.owner) if self.owner else " (not currently owned)")
 
@@ -79,28 +222,59 @@ class CompoundResource:
     def __enter__(self):
         """ cf doc of Resource.__enter__.
         """
-        self.release()
+        for res in self.resources:
+            res.__enter__()
+        self.owner = None
 
     def __exit__(self, exc_type, exc_value, traceback):
         """ cf doc of Resource.__exit__.
         """
-        self.acquire()
+        for res in self.resources:
+            res.__exit__(exc_type, exc_value, traceback)
+        self.owner = self.resources[0].owner if self.resources else None
         # here, the exception, if any, is automatically propagated
 
 
 
-    def acquire(self, wait = True, acquirer = "unknown"):
+    def acquire(self, wait = True, acquirer = "unknown", **kwargs):
+        clock = get_clock()
+        start = clock.time()
+
         ok = True
         for res in self.resources:
-            ok = res.acquire(wait, acquirer) and ok
+            ok = res.acquire(wait, acquirer, **kwargs) and ok
 
         if not ok:
+            self.stats.refused += 1
             return False
 
+        now = clock.time()
+        if now > start:
+            self.stats.contended += 1
+            self.stats.wait.add(now - start)
+        self.stats.acquisitions += 1
+
         self.owner = acquirer
+        self.owner_since = now
+        return True
 
     def release(self):
         for res in self.resources:
             res.release()
         self.owner = None
+        if self.owner_since is not None:
+            self.stats.hold.add(get_clock().time() - self.owner_since)
+            self.owner_since = None
+
+    def waiting(self):
+        """ Returns the largest number of requests waiting for one of the
+        resources.
+        """
+        return max([res.waiting() for res in self.resources] or [0])
+
+    def waits(self):
+        """ The waits are reported by each of the resources (cf
+        :meth:`Resource.waits`).
+        """
+        return []
 
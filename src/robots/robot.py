@@ -3,23 +3,18 @@ import logging; logger = logging.getLogger("robots.robot")
 if (hasattr(logging, "NullHandler")): # python >= 2.7
 	logger.addHandler(logging.NullHandler())
 
-import time
 import pkgutil, sys
 from functools import partial
 
 from robots.helpers.misc import valuefilter
+from robots.state import State
 from robots.poses import PoseManager
 from robots.introspection import introspection
 from robots.events import Events
 from robots.mw import * # ROS, NAOQI...
-from robots.concurrency import RobotActionExecutor, ACTIVE_SLEEP_RESOLUTION
+from robots.concurrency import RobotActionExecutor, ACTIVE_SLEEP_RESOLUTION, get_clock, set_clock
 
 
-class State(dict):
-    __getattr__= dict.__getitem__
-    __setattr__= dict.__setitem__
-    __delattr__= dict.__delitem__
-
 class GenericRobot(object):
     """ This class manages functionalities that are shared across every robot 'backends' (ROS, Aseba,...)
 
@@ -37,10 +32,14 @@ class GenericRobot(object):
     :class:`GenericRobot` defines several important instance variables,
     documented below.
 
-    :ivar state: the state vector of the robot. By default, a simple dictionary.
-      You can overwrite it with a custom object, but it is expected to provide a
-      dictionary-like interface.
+    :ivar state: the state vector of the robot. By default, an instance of
+      :class:`.State`, a dictionary that records the version and time of each
+      write. You can overwrite it with a custom object, but it is expected to
+      provide a dictionary-like interface.
     :ivar poses: an instance of :class:`.PoseManager`.
+    :ivar clock: the clock used to measure time and wait (see
+      :mod:`robots.concurrency.clock`). Use ``robot.clock.time()`` instead of
+      ``time.time()`` to remain compatible with simulated clocks.
     :ivar executor: instance of :class:`.RobotActionExecutor`
       responsible for spawning and starting threads for the robot actions. You
       should not need to access it directly.
@@ -111,6 +110,8 @@ class GenericRobot(object):
     
         - :meth:`running`: prints the list of running tasks (with their IDs)
         - :meth:`actioninfo`: give details on a given action, including the exact line being currently executed
+        - :meth:`stats`: prints the wall, CPU and waiting times of the completed actions
+        - ``executor.start_profiling()``: samples the stacks of the running actions (see :mod:`robots.concurrency.profiler`)
     
     """
 
@@ -119,13 +120,14 @@ class GenericRobot(object):
                  supports = 0, 
                  dummy = False, 
                  immediate = False,
-                 configure_logging = True):
+                 configure_logging = True,
+                 clock = None):
         """
         :param list actions: a list of packages that contains modules with
-          actions (ie, modules with functions decorated with ``@action``). Proxies to
-          these actions are appended to the instance of :class:`.GenericRobot` upon
-          construction and become available as ``myrobot.goto(...)``,
-          ``myrobot.lookat(...)``, etc.
+          actions (ie, modules with functions decorated with ``@action``).
+          These actions become available as ``myrobot.goto(...)``,
+          ``myrobot.lookat(...)``, etc. Proxies to the actions are created on
+          first access (see :meth:`load_actions`).
         :param supports: (default: 0) a mask of middlewares the robot
           supports. Supported middlewares are listed in
           ``robots.mw.__init__.py``.  For example ``supports = ROS|POCOLIBS``
@@ -140,10 +142,28 @@ class GenericRobot(object):
         :param boolean configure_logging: if ``True`` (default), configures
           a default colorized console logging handler. Otherwise, you need to
           configure yourself the Python logger.
+        :param clock: (default: ``None``) if set, the clock used by pyRobots
+          to measure time and wait (see :mod:`robots.concurrency.clock`). For
+          instance, ``GenericRobot(dummy = True, clock = SimulatedClock())``
+          runs the robot in a time-accelerated dummy mode: the time jumps
+          ahead whenever all the actions are blocked. By default, the wall
+          clock is used. The pyRobots clock is shared by the whole process:
+          this installs ``clock`` with :func:`.set_clock` until the robot is
+          closed, and the previous clock is restored then.
         """
 
         self.dummy = dummy
 
+        self._previous_clock = None
+        if clock is not None:
+            self._previous_clock = get_clock()
+            set_clock(clock)
+        self.clock = get_clock()
+
+        # registry of the available actions, by name. Proxies are only bound to
+        # the robot instance when first accessed (cf __getattr__)
+        self._actions = {}
+
         if configure_logging:
             self.configure_console_logging()
 
@@ -154,8 +174,8 @@ class GenericRobot(object):
         else:
             self.loglevel(logging.DEBUG)
 
-        # initially, empty state (a state is actually a simple dictionary, with
-        # direct member accessors). Users are expected to override this member
+        # initially, empty state (a state is actually a versioned dictionary,
+        # with direct member accessors). Users are expected to override this member
         self.state = State()
 
         self.executor = RobotActionExecutor()
@@ -226,6 +246,13 @@ class GenericRobot(object):
         """
         logger.info(str(self.executor))
 
+    def stats(self):
+        """ Print the timings (wall time, CPU time, time waiting for resources
+        and sub-actions) of the completed actions, by action name (cf
+        :mod:`robots.concurrency.metrics`).
+        """
+        logger.info(self.executor.metrics.report())
+
     def actioninfo(self, id):
         """ Print details on a running action (including the current line
         number).
@@ -245,13 +272,48 @@ class GenericRobot(object):
         return bool(self.mw & middleware) and not self.dummy
 
     def load_actions(self, actions):
+        """ Registers the actions found in ``actions`` (a list of packages or
+        of actions).
+
+        Actions are only recorded in a registry: the proxy binding the action
+        to the robot (so that it can be called as ``robot.goto(...)``) is
+        created the first time the action is accessed, and cached afterwards.
+
+        Actions whose name shadows an existing attribute of the robot (like
+        ``sleep`` or ``wait``) are bound immediately, to override it.
+        """
         if not actions:
             logger.warning("No action packages specified when creating an instance of GenericRobot. Likely an error!")
 
         else:
             for action in self._available_actions(actions):
-                setattr(self, action.__name__, partial(action, self))
-                logger.info("Added " + action.__name__ + " as available action.")
+                name = action.__name__
+                shadows = hasattr(type(self), name) or \
+                          (name in self.__dict__ and name not in self._actions)
+                self._actions[name] = action
+
+                if shadows:
+                    setattr(self, name, partial(action, self))
+                else:
+                    self.__dict__.pop(name, None) # drop a previously cached proxy, if any
+
+            logger.info("%d actions available." % len(self._actions))
+            logger.debug("Available actions: %s" % ", ".join(sorted(self._actions)))
+
+    def __getattr__(self, name):
+        """ Only called when the normal attribute lookup fails: resolves
+        action proxies on first access.
+        """
+        actions = self.__dict__.get("_actions")
+        if not actions or name not in actions:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+        proxy = partial(actions[name], self)
+        setattr(self, name, proxy) # cache it: next lookups won't go through __getattr__
+        return proxy
+
+    def __dir__(self):
+        return sorted(set(dir(type(self))) | set(self.__dict__) | set(self.__dict__.get("_actions", {})))
 
 
     def wait_for_state_update(self, timeout = None):
@@ -261,10 +323,15 @@ class GenericRobot(object):
         should almost certainly be overriden in your implementation of a
         GenericRobot subclass.
 
-        The default implementation simply waits ``ACTIVE_SLEEP_RESOLUTION``
-        seconds.
+        The default implementation blocks until an entry of ``robot.state``
+        is written (or ``timeout`` elapses) if the state is versioned (cf
+        :class:`.State`), and otherwise simply waits
+        ``ACTIVE_SLEEP_RESOLUTION`` seconds.
         """
-        time.sleep(ACTIVE_SLEEP_RESOLUTION)
+        if hasattr(self.state, "wait_for_update"):
+            self.state.wait_for_update(timeout)
+        else:
+            get_clock().sleep(ACTIVE_SLEEP_RESOLUTION)
 
     def __enter__(self):
         return self
@@ -275,6 +342,13 @@ class GenericRobot(object):
     def close(self):
         self.cancel_all()
         self.events.close()
+        self.executor.processes.shutdown()
+        self.executor.stop_profiling()
+
+        # restores the clock replaced by our own (cf __init__)
+        if self._previous_clock is not None and get_clock() is self.clock:
+            set_clock(self._previous_clock)
+            self._previous_clock = None
 
         if self.supports(ROS):
             import rospy
@@ -285,26 +359,31 @@ class GenericRobot(object):
     def sleep(duration):
         """ Active sleep. Must used by actions to make sure they can be quickly
         cancelled.
-        """
-
-        tot_time = 0
-        while tot_time // duration == 0:
-            time.sleep(ACTIVE_SLEEP_RESOLUTION)
-            tot_time += ACTIVE_SLEEP_RESOLUTION
 
-        time.sleep(duration % ACTIVE_SLEEP_RESOLUTION)
+        The sleep is measured with the pyRobots clock (cf
+        :mod:`robots.concurrency.clock`). Within a robot action (or an event
+        monitor), it returns at the deadline, or as soon as the action is
+        cancelled or paused (the corresponding signal is then raised in the
+        action). Sleeping actions do not consume any CPU.
+        """
+        get_clock().sleep(duration)
 
     def wait(self, var, **kwargs):
         """ Alias to wait on a given condition. Cf :class:`robots.events.Events`
         for details on the acceptable conditions.
         """
-        self.on(var, **kwargs).wait()
+        self.events.wait(var, **kwargs)
 
-    def cancel_all(self):
+    def cancel_all(self, wait = True):
         """ Sends a 'cancel' signal (ie, the
         :class:`.ActionCancelled` exception is raised) to all
         running actions.
 
+        By default, blocks until all the actions are stopped. For emergency
+        stops, pass ``wait = False``: all the actions are signaled at once,
+        and the returned :class:`.Cancellation` handle can be used to wait
+        for them later (``robot.cancel_all(wait = False).wait()``).
+
         Note that, if called within a running action, this action *is cancelled
         as well*. If this is not what you want, use
         :meth:`cancel_all_others` instead.
@@ -313,9 +392,9 @@ class GenericRobot(object):
         availability) are simply removed for the run queue.
 
         """
-        self.executor.cancel_all()
+        return self.executor.cancel_all(wait)
 
-    def cancel_all_others(self):
+    def cancel_all_others(self, wait = True):
         """ Sends a 'cancel' signal (ie, the
         :class:`.ActionCancelled` exception is raised) to all
         running actions, *except for the action that call*
@@ -325,8 +404,9 @@ class GenericRobot(object):
         Actions that are not yet started (eg, actions waiting on a resource
         availability) are simply removed for the run queue.
 
+        Cf :meth:`cancel_all` for ``wait``.
         """
-        self.executor.cancel_all_others()
+        return self.executor.cancel_all_others(wait)
 
 
     def filtered(self, name, val):
@@ -0,0 +1,4 @@
+# coding=utf-8
+from .state import *
+from .history import *
+from .shared import *
@@ -0,0 +1,108 @@
+# coding=utf-8
+"""
+Fixed-size histories of timestamped values.
+"""
+import threading
+
+import numpy
+
+from robots.concurrency.clock import get_clock
+
+__all__ = ["History"]
+
+class History(object):
+    """ A fixed-size ring buffer of timestamped numerical values, backed by
+    preallocated NumPy arrays.
+
+    Window queries (:meth:`mean`, :meth:`slope`, :meth:`min`, :meth:`max`)
+    are vectorized. They consider the values recorded during the last
+    ``duration`` seconds (measured with the pyRobots clock), or every
+    recorded value if ``duration`` is ``None``. They return ``None`` if no
+    value falls in the window.
+
+    Histories of state entries are created with :meth:`.State.keep_history`.
+
+    :param size: maximum number of values kept
+    """
+
+    def __init__(self, size, dtype = float):
+        self._times = numpy.zeros(size)
+        self._values = numpy.zeros(size, dtype = dtype)
+
+        self._next = 0 # index of the next write
+        self._count = 0
+
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, timestamp = None):
+        """ Records a new value.
+
+        :param timestamp: time of the value. Defaults to the current time of
+          the pyRobots clock. Timestamps are expected to be non-decreasing.
+        """
+        if timestamp is None:
+            timestamp = get_clock().time()
+
+        with self._lock:
+            self._times[self._next] = timestamp
+            self._values[self._next] = value
+            self._next = (self._next + 1) % len(self._times)
+            self._count = min(self._count + 1, len(self._times))
+
+    def window(self, duration = None):
+        """ Returns the values recorded during the last ``duration`` seconds
+        (or all the recorded values if ``duration`` is ``None``), as a tuple
+        of two arrays ``(timestamps, values)``, in chronological order.
+        """
+        with self._lock:
+            if self._count < len(self._times):
+                times = self._times[:self._count].copy()
+                values = self._values[:self._count].copy()
+            else:
+                times = numpy.roll(self._times, -self._next)
+                values = numpy.roll(self._values, -self._next)
+
+        if duration is not None:
+            start = numpy.searchsorted(times, get_clock().time() - duration)
+            times, values = times[start:], values[start:]
+
+        return times, values
+
+    def last(self):
+        """ Returns the last recorded value (or ``None``).
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            return self._values[self._next - 1]
+
+    def mean(self, duration = None):
+        times, values = self.window(duration)
+        return values.mean() if len(values) else None
+
+    def min(self, duration = None):
+        times, values = self.window(duration)
+        return values.min() if len(values) else None
+
+    def max(self, duration = None):
+        times, values = self.window(duration)
+        return values.max() if len(values) else None
+
+    def slope(self, duration = None):
+        """ Returns the rate of change of the values over the window (in
+        units per second), computed by linear least squares.
+
+        At least two values with distinct timestamps are required.
+        """
+        times, values = self.window(duration)
+        if len(values) < 2:
+            return None
+
+        dt = times - times.mean()
+        var = numpy.dot(dt, dt)
+        if var == 0:
+            return None
+        return numpy.dot(dt, values - values.mean()) / var
@@ -0,0 +1,310 @@
+# coding=utf-8
+"""
+A robot state stored in shared memory, to be shared by several processes.
+"""
+import logging; logger = logging.getLogger("robots.state")
+
+import os
+import mmap
+import ctypes
+import zlib
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy
+
+from robots.concurrency import MAX_TIME_TO_COMPLETE
+from robots.concurrency.clock import current_waker, get_clock
+
+__all__ = ["SharedState"]
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+class SharedState(object):
+    """ A robot state whose entries live in a shared memory segment, so that
+    several processes (for instance, perception and planning workers) can
+    publish and read them without serialization nor middleware.
+
+    The entries are defined by a fixed schema: a list of ``(key, dtype)`` or
+    ``(key, dtype, shape)`` tuples. Every process attaching to the segment
+    must use the same schema.
+
+    .. code-block:: python
+
+        SCHEMA = [("sonar", "f8"), ("bumper", "?"), ("scan", "f4", (360,))]
+
+        # in the robot controller process:
+        robot.state = SharedState("myrobot", SCHEMA, create = True)
+        robot.whenever("sonar", below = 0.4).do(on_obstacle_near)
+
+        # in a perception process:
+        state = SharedState("myrobot", SCHEMA)
+        state["scan"] = ranges # directly written in the shared segment
+
+    :class:`SharedState` provides the same dictionary-like interface and
+    versioning API as :class:`.State` (:meth:`version`, :meth:`timestamp`,
+    :meth:`wait_for_version`...), so event monitors can watch its entries.
+
+    Each entry is protected by a *seqlock*: the writer increments the entry's
+    sequence number before and after writing, and readers retry if the
+    sequence number was odd or has changed while they were copying the
+    value. Readers never block writers, but each entry must only have one
+    writer at a time.
+
+    Every write also stores a new *generation* in the header of the segment,
+    so that :meth:`version` of the whole state only sums the sequence
+    numbers again when some entry has actually been written.
+
+    Writes from other processes can not wake up local waiters: they are
+    detected by polling the sequence numbers every :data:`POLL_PERIOD`
+    seconds.
+
+    :param name: name of the shared memory segment
+    :param schema: list of ``(key, dtype[, shape])`` tuples
+    :param create: if ``True``, creates the segment if needed. An existing
+      segment with another schema is reset in place: it is never truncated,
+      as processes may still be attached to it. Otherwise, attaches to an
+      existing segment.
+    """
+
+    POLL_PERIOD = 0.01 # sec
+
+    MAGIC = b"PYROBOTS"
+    HEADER = struct.Struct("=8sI")
+    GENERATION_OFFSET = HEADER.size + (-HEADER.size % 8) # int64
+
+    def __init__(self, name, schema, create = False):
+
+        self.name = name
+        self.path = os.path.join(SHM_DIR, "pyrobots-%s" % name)
+
+        # layout of each entry: sequence number (int64), timestamp
+        # (float64), data (padded to 8 bytes)
+        self._layout = OrderedDict()
+        offset = self.GENERATION_OFFSET + 8
+        for entry in schema:
+            key, dtype = entry[0], numpy.dtype(entry[1])
+            shape = tuple(entry[2]) if len(entry) > 2 else ()
+            nbytes = dtype.itemsize * int(numpy.prod(shape))
+            self._layout[key] = (offset, dtype, shape)
+            offset += 16 + nbytes + (-nbytes % 8)
+        size = offset
+
+        signature = ";".join("%s:%s:%s" % (k, d.str, s) for k, (o, d, s) in self._layout.items())
+        checksum = zlib.crc32(signature.encode("utf-8")) & 0xffffffff
+
+        # truncating a segment (or shrinking it) would crash the processes
+        # still attached to it (SIGBUS): it is only ever grown.
+        fd = os.open(self.path, os.O_RDWR | (os.O_CREAT if create else 0))
+        try:
+            if os.fstat(fd).st_size < size:
+                if not create:
+                    raise RuntimeError("Shared state <%s> does not match the schema!" % name)
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        header = self.HEADER.pack(self.MAGIC, checksum)
+        if self._mmap[:self.HEADER.size] != header:
+            if not create:
+                self._mmap.close()
+                raise RuntimeError("Shared state <%s> does not match the schema!" % name)
+            self._mmap[self.HEADER.size:] = b"\0" * (size - self.HEADER.size)
+            self._mmap[:self.HEADER.size] = header
+
+        # sequence numbers and generation are accessed through ctypes, so
+        # that each of their reads and writes is a single (atomic) aligned
+        # 8 bytes memory access
+        self._generation = ctypes.c_int64.from_buffer(self._mmap, self.GENERATION_OFFSET)
+        self._seqs = {}
+        self._timestamps = {}
+        self._data = {}
+        for key, (offset, dtype, shape) in self._layout.items():
+            self._seqs[key] = ctypes.c_int64.from_buffer(self._mmap, offset)
+            self._timestamps[key] = numpy.ndarray((), numpy.float64, buffer = self._mmap, offset = offset + 8)
+            self._data[key] = numpy.ndarray(shape, dtype, buffer = self._mmap, offset = offset + 16)
+
+        self._lock = threading.Lock()
+        self._fence = threading.Lock()
+        self._waiters = {} # key (None for any) -> set of wakers (local waiters only)
+
+        # generations written by this process: unique among all the writers
+        self._writes = (os.getpid() & 0xffffff) << 39
+        self._version = (None, 0) # (generation, version of the whole state)
+
+        logger.info("%s shared state <%s> (%d entries, %d bytes)" % ("Created" if create else "Attached to", name, len(self._layout), size))
+
+    def _barrier(self):
+        """ Memory barrier: the atomic operations of a lock acquisition and
+        release prevent the CPU from reordering the memory accesses around
+        them (Python does not expose memory fences).
+        """
+        with self._fence:
+            pass
+
+    def __getitem__(self, key):
+        seq, data = self._seqs[key], self._data[key]
+
+        start = time.time()
+        backoff = 0
+        while True:
+            before = seq.value
+            if not before % 2:
+                self._barrier()
+                value = data.copy() if data.shape else data[()]
+                self._barrier()
+                if seq.value == before:
+                    return value
+            if time.time() - start > MAX_TIME_TO_COMPLETE:
+                raise RuntimeError("Entry <%s> of shared state <%s> is stuck in the middle of a write (writer crashed?)" % (key, self.name))
+
+            # the writer may be waiting for the CPU we are spinning on
+            time.sleep(backoff)
+            backoff = min(backoff * 2 or 1e-5, 1e-3)
+
+    def __setitem__(self, key, value):
+        if key not in self._layout:
+            raise KeyError("<%s> is not part of the schema of shared state <%s>" % (key, self.name))
+
+        seq = self._seqs[key]
+        with self._lock:
+            # only one writer per entry: this read-modify-write of the
+            # sequence number is not racing with any other write
+            current = seq.value
+            seq.value = current + 1 # odd: write in progress
+            self._barrier()
+            try:
+                self._timestamps[key][...] = get_clock().time()
+                self._data[key][...] = value
+            finally:
+                self._barrier()
+                seq.value = current + 2
+                self._barrier()
+                self._writes += 1
+                self._generation.value = self._writes
+
+            waiters = self._waiters.pop(key, ())
+            anywaiters = self._waiters.pop(None, ())
+
+        for waker in waiters:
+            waker.set()
+        for waker in anywaiters:
+            waker.set()
+
+    def __getattr__(self, key):
+        # only called if normal lookup fails
+        if key in self.__dict__.get("_layout", ()):
+            return self[key]
+        raise AttributeError("'SharedState' object has no attribute '%s'" % key)
+
+    def __setattr__(self, key, value):
+        if key in self.__dict__.get("_layout", ()):
+            self[key] = value
+        else:
+            object.__setattr__(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._layout
+
+    def __iter__(self):
+        return iter(self._layout)
+
+    def __len__(self):
+        return len(self._layout)
+
+    def keys(self):
+        return list(self._layout)
+
+    def get(self, key, default = None):
+        return self[key] if key in self._layout else default
+
+    def view(self, key):
+        """ Returns a (zero-copy) NumPy view on the value of ``key`` in the
+        shared segment. Contrary to ``state[key]``, reading from the view is
+        not protected against concurrent writes.
+
+        The view remains valid after :meth:`close`: the segment is only
+        unmapped once the last view is garbage collected.
+        """
+        return self._data[key]
+
+    def version(self, key = None):
+        """ Returns the number of writes to ``key`` (0 if never written), or to
+        any entry if ``key`` is ``None``.
+        """
+        if key is None:
+            generation, version = self._version
+            if self._generation.value != generation:
+                generation = self._generation.value
+                self._barrier()
+                version = sum(seq.value // 2 for seq in self._seqs.values())
+                self._version = (generation, version)
+            return version
+        return self._seqs[key].value // 2
+
+    def timestamp(self, key):
+        """ Returns the time of the last write to ``key``, as given by the
+        pyRobots clock of the writer, or ``None`` if ``key`` has never been
+        written.
+        """
+        if not self.version(key):
+            return None
+        return float(self._timestamps[key])
+
+    def wait_for_version(self, key, version, timeout = None):
+        """ Blocks until the version of ``key`` (of any entry if ``key`` is
+        ``None``) is greater than ``version``, or until ``timeout`` seconds
+        have elapsed (if not ``None``).
+
+        :returns: the current version of ``key``
+        """
+        clock = get_clock()
+        waker = current_waker()
+        deadline = clock.time() + timeout if timeout is not None else None
+
+        while True:
+            with self._lock:
+                current = self.version(key)
+                if current > version:
+                    return current
+                now = clock.time()
+                if deadline is not None and now >= deadline:
+                    return current
+                self._waiters.setdefault(key, set()).add(waker)
+
+            # writes from other processes are only detected by polling
+            poll = now + self.POLL_PERIOD
+            clock.park(waker, poll if deadline is None else min(poll, deadline))
+
+    def wait_for_update(self, timeout = None):
+        """ Blocks until any entry is written, or until ``timeout`` seconds
+        have elapsed (if not ``None``).
+
+        :returns: ``True`` if the state has been updated.
+        """
+        version = self.version()
+        return self.wait_for_version(None, version, timeout) > version
+
+    def close(self):
+        """ Detaches from the shared memory segment.
+
+        The segment is unmapped when the views returned by :meth:`view` (that
+        reference it) are garbage collected, instead of being unmapped under
+        them.
+        """
+        self._seqs = self._timestamps = self._data = {}
+        self._generation = None
+        self._mmap = None
+
+    def unlink(self):
+        """ Removes the shared memory segment. Processes already attached to
+        it can keep using it.
+        """
+        os.unlink(self.path)
+
+    def __repr__(self):
+        return "SharedState(%s)" % ", ".join("%s=%r" % (k, self[k]) for k in self._layout)
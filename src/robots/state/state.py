@@ -0,0 +1,300 @@
+# coding=utf-8
+"""
+The robot state container.
+"""
+import logging; logger = logging.getLogger("robots.state")
+
+import threading
+from contextlib import contextmanager
+
+from robots.concurrency.clock import current_waker, get_clock
+from .history import History
+
+__all__ = ["State"]
+
+_local = threading.local() # per-thread set of state keys being recorded
+
+class State(dict):
+    """ The state vector of the robot: a dictionary whose entries can also be
+    accessed as attributes (``robot.state.sonar``).
+
+    Every write to an entry is versioned: the state maintains a global,
+    monotonically increasing version number, and records for each entry the
+    version and the time (as given by the pyRobots clock) of its last write.
+    This makes it possible to know if (and when) a value changed, and to
+    wait for an entry to be updated without polling:
+
+    .. code-block:: python
+
+        v = robot.state.version("sonar")
+        # ...
+        robot.state.wait_for_version("sonar", v) # returns as soon as 'sonar'
+                                                 # is written again
+
+    Note that writing an entry bumps its version even if the value is
+    unchanged. Removing an entry (``del``, :meth:`pop`, :meth:`clear`...)
+    counts as a write as well: it bumps the version of the entry and wakes
+    up its waiters (but the listeners are not called).
+
+    The state can also keep a bounded history of the values of numerical
+    entries (cf :meth:`keep_history`), shared by every user of the state
+    (filters, event monitors...):
+
+    .. code-block:: python
+
+        robot.state.keep_history("sonar", size = 200)
+        # ...
+        robot.state.history("sonar").mean(2.) # average over the last 2 sec
+    """
+
+    HISTORY_SIZE = 100
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self)
+
+        # State.__setattr__ writes entries: use object.__setattr__ to set
+        # the actual members
+        object.__setattr__(self, "_lock", threading.Lock())
+        object.__setattr__(self, "_version", 0)
+        object.__setattr__(self, "_versions", {}) # key -> version of last write
+        object.__setattr__(self, "_timestamps", {}) # key -> time of last write
+        object.__setattr__(self, "_waiters", {}) # key (None for any) -> set of wakers
+        object.__setattr__(self, "_histories", {}) # key -> History
+        object.__setattr__(self, "_listeners", [])
+        object.__setattr__(self, "_recorders", 0) # number of threads recording reads
+
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if self._recorders:
+            reads = getattr(_local, "reads", None)
+            if reads is not None:
+                reads.add(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default = None):
+        if self._recorders:
+            reads = getattr(_local, "reads", None)
+            if reads is not None:
+                reads.add(key)
+        return dict.get(self, key, default)
+
+    def _written(self, key, timestamp):
+        """ Bumps the version of ``key`` after a write (or a removal).
+
+        Must be called with the lock held.
+
+        :returns: the wakers to set once the lock is released
+        """
+        object.__setattr__(self, "_version", self._version + 1)
+        self._versions[key] = self._version
+        self._timestamps[key] = timestamp
+        return list(self._waiters.pop(key, ())) + list(self._waiters.pop(None, ()))
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            timestamp = get_clock().time()
+            if key in self._histories:
+                self._histories[key].append(value, timestamp)
+
+            dict.__setitem__(self, key, value)
+            wakers = self._written(key, timestamp)
+
+        for waker in wakers:
+            waker.set()
+
+        for listener in self._listeners:
+            try:
+                listener(key, value)
+            except Exception as e:
+                logger.error("Exception in state listener %s: %s" % (listener, e))
+
+    def __delitem__(self, key):
+        with self._lock:
+            dict.__delitem__(self, key)
+            wakers = self._written(key, get_clock().time())
+
+        for waker in wakers:
+            waker.set()
+
+    def pop(self, key, *default):
+        with self._lock:
+            if key not in self:
+                return dict.pop(self, key, *default)
+            value = dict.pop(self, key)
+            wakers = self._written(key, get_clock().time())
+
+        for waker in wakers:
+            waker.set()
+        return value
+
+    def popitem(self):
+        with self._lock:
+            key, value = dict.popitem(self)
+            wakers = self._written(key, get_clock().time())
+
+        for waker in wakers:
+            waker.set()
+        return key, value
+
+    def clear(self):
+        with self._lock:
+            timestamp = get_clock().time()
+            wakers = []
+            for key in list(self):
+                dict.__delitem__(self, key)
+                wakers += self._written(key, timestamp)
+
+        for waker in wakers:
+            waker.set()
+
+    __getattr__= __getitem__
+    __setattr__= __setitem__
+    __delattr__= __delitem__
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default = None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __reduce__(self):
+        # versions and timestamps are not preserved by copies
+        return (self.__class__, (dict(self),))
+
+    def add_listener(self, listener):
+        """ Registers a callable ``listener(key, value)``, called (in the
+        writer's thread) after each write to the state.
+
+        Listeners must be fast: they delay the writer.
+        """
+        # copy-on-write: writers iterate over the listeners without lock
+        with self._lock:
+            object.__setattr__(self, "_listeners", self._listeners + [listener])
+
+    def remove_listener(self, listener):
+        with self._lock:
+            listeners = list(self._listeners)
+            listeners.remove(listener)
+            object.__setattr__(self, "_listeners", listeners)
+
+    def version(self, key = None):
+        """ Returns the version of the last write to ``key``, or 0 if ``key``
+        has never been written.
+
+        If ``key`` is ``None``, returns the global version of the state (ie,
+        the version of the last write, whatever the entry).
+        """
+        if key is None:
+            return self._version
+        return self._versions.get(key, 0)
+
+    def timestamp(self, key):
+        """ Returns the time of the last write to ``key`` (as given by the
+        pyRobots clock), or ``None`` if ``key`` has never been written.
+        """
+        return self._timestamps.get(key)
+
+    def keep_history(self, key, size = HISTORY_SIZE):
+        """ Starts recording the values written to ``key`` (that must be
+        numerical) in a :class:`.History` of at most ``size`` values.
+
+        :returns: the history of ``key`` (if ``key`` already had an history,
+          it is returned as it is)
+        """
+        with self._lock:
+            history = self._histories.get(key)
+            if history is None:
+                history = self._histories[key] = History(size)
+                if key in self:
+                    history.append(dict.__getitem__(self, key), self._timestamps[key])
+        return history
+
+    def history(self, key):
+        """ Returns the :class:`.History` of ``key``, or ``None`` if
+        :meth:`keep_history` has not been called for this entry.
+        """
+        return self._histories.get(key)
+
+    @contextmanager
+    def recording_reads(self):
+        """ Context manager that records the keys read (with ``state[key]``,
+        ``state.key`` or ``state.get(key)``) by the current thread within the
+        block:
+
+        .. code-block:: python
+
+            with robot.state.recording_reads() as keys:
+                tired = is_tired(robot)
+            # 'keys' is now the set of entries is_tired depends on
+        """
+        keys = set()
+        previous = getattr(_local, "reads", None)
+        _local.reads = keys
+        with self._lock:
+            object.__setattr__(self, "_recorders", self._recorders + 1)
+        try:
+            yield keys
+        finally:
+            _local.reads = previous
+            with self._lock:
+                object.__setattr__(self, "_recorders", self._recorders - 1)
+
+    def wait_for_version(self, key, version, timeout = None):
+        """ Blocks until the version of ``key`` is greater than ``version``,
+        or until ``timeout`` seconds have elapsed (if not ``None``).
+
+        If ``key`` is ``None``, waits for a write to any entry of the state.
+
+        :returns: the current version of ``key`` (not greater than
+          ``version`` if the wait timed out)
+        """
+        return self.wait_for_any([key], version, timeout)
+
+    def wait_for_any(self, keys, version, timeout = None):
+        """ Blocks until one of ``keys`` is written with a version greater
+        than ``version``, or until ``timeout`` seconds have elapsed (if not
+        ``None``). A ``None`` key stands for any entry.
+
+        As versions are global to the state, passing the global version
+        (``state.version()``) waits for the next write to any of ``keys``.
+
+        :returns: the greatest current version of ``keys``
+        """
+        clock = get_clock()
+        waker = current_waker()
+        deadline = clock.time() + timeout if timeout is not None else None
+
+        try:
+            while True:
+                with self._lock:
+                    current = max(self.version(key) for key in keys) if keys else 0
+                    if current > version:
+                        return current
+                    if deadline is not None and clock.time() >= deadline:
+                        return current
+                    for key in keys:
+                        self._waiters.setdefault(key, set()).add(waker)
+
+                clock.park(waker, deadline)
+        finally:
+            # on timeout (or signal), no write has consumed our registrations
+            with self._lock:
+                for key in keys:
+                    waiters = self._waiters.get(key)
+                    if waiters is not None:
+                        waiters.discard(waker)
+                        if not waiters:
+                            del self._waiters[key]
+
+    def wait_for_update(self, timeout = None):
+        """ Blocks until any entry of the state is written, or until
+        ``timeout`` seconds have elapsed (if not ``None``).
+
+        :returns: ``True`` if the state has been updated.
+        """
+        version = self._version
+        return self.wait_for_version(None, version, timeout) > version
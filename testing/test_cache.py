@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gc
+import time
+import unittest
+import robots
+from robots.concurrency import action, SimulatedClock
+
+@action(cache = 60)
+def lookup(robot, place):
+    robot.sleep(1)
+    return place, robot.clock.time()
+
+@action
+def visit(robot):
+    a = robot.lookup("kitchen")
+    b = robot.lookup("kitchen") # in-flight
+    kitchen = a.result()
+    c = robot.lookup("kitchen")
+    hall = robot.lookup("hall").result()
+
+    robot.sleep(100) # expired
+    d = robot.lookup("kitchen")
+    return [b is a, c is a, d is not a], kitchen, hall, d.result()
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self, clock = None):
+        super(MyRobot, self).__init__(actions=[lookup, visit], dummy = True, clock = clock)
+        self.silent()
+
+
+class CacheTests(unittest.TestCase):
+
+    def test_cache(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            # (run from an action: the simulated time does not advance
+            # while it checks the results)
+            self.assertEqual(robot.visit().result(), ([True, True, True], ("kitchen", 1), ("hall", 2), ("kitchen", 103)))
+
+    def test_robots_not_kept_alive(self):
+        lookup.cache.clear()
+        with MyRobot(clock = SimulatedClock()) as robot:
+            robot.lookup("kitchen").result()
+            with MyRobot(clock = SimulatedClock()) as other:
+                a = other.lookup("kitchen")
+                self.assertIsNot(a, robot.lookup("kitchen"))
+                a.result()
+            self.assertEqual(len(lookup.cache), 2)
+
+        del robot, other, a
+        # (the threads of the completed actions may not have released the
+        # robots yet)
+        start = time.time()
+        while lookup.cache and time.time() - start < 5:
+            gc.collect()
+            time.sleep(0.01)
+        self.assertEqual(len(lookup.cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
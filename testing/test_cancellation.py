@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import robots
+from robots.concurrency import action
+
+@action
+def descend(robot, depth):
+    if depth:
+        robot.descend(depth - 1).wait()
+    else:
+        robot.sleep(3600)
+
+@action
+def nap(robot, duration):
+    robot.sleep(duration)
+    return "rested"
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self):
+        super(MyRobot, self).__init__(actions=[descend, nap], dummy = True)
+        self.silent()
+
+
+def wait_until(predicate, timeout = 5.):
+    start = time.time()
+    while not predicate() and time.time() - start < timeout:
+        time.sleep(0.01)
+
+class CancellationTests(unittest.TestCase):
+
+    def test_subtree(self):
+        with MyRobot() as robot:
+            a = robot.descend(15)
+            wait_until(lambda: len(a.subtree()) == 16)
+            tree = a.subtree()
+            self.assertEqual(len(tree), 16)
+
+            # raises if any action of the subtree is still running
+            a.cancel()
+            self.assertTrue(all(f.done() for f in tree))
+            self.assertEqual([f.result() for f in tree], [None] * 16)
+
+    def test_cancel_all_nowait(self):
+        with MyRobot() as robot:
+            naps = [robot.nap(3600) for i in range(10)]
+            cancellation = robot.cancel_all(wait = False)
+            self.assertEqual(set(map(id, cancellation.actions)), set(map(id, naps)))
+            for a in cancellation.pending():
+                self.assertTrue(any(a is n for n in naps))
+
+            cancellation.wait()
+            self.assertTrue(cancellation.done())
+            self.assertEqual(cancellation.pending(), [])
+            self.assertEqual([a.result() for a in naps], [None] * 10)
+
+            # nothing left to cancel
+            self.assertTrue(robot.cancel_all(wait = False).done())
+
+    def test_cancel_after_submit(self):
+        with MyRobot() as robot:
+            for i in range(50):
+                a = robot.nap(3600)
+                a.cancel()
+                self.assertTrue(a.done())
+                self.assertIsNone(a.result())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import robots
+from concurrent.futures import TimeoutError
+from robots.concurrency import action, SimulatedClock, get_clock
+
+@action
+def nap(robot, duration):
+    robot.sleep(duration)
+    return robot.clock.time()
+
+@action
+def patrol(robot):
+    a = robot.nap(3600)
+    robot.nap(1800).wait()
+    robot.sleep(10)
+    return a.wait(), robot.clock.time()
+
+@action
+def impatient(robot):
+    return robot.nap(3600).wait(timeout = 60)
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self, clock = None):
+        super(MyRobot, self).__init__(actions=[nap, patrol, impatient], dummy = True, clock = clock)
+        self.silent()
+
+
+class ClockTests(unittest.TestCase):
+
+    def test_clock_restored(self):
+        clock = get_clock()
+        with MyRobot(clock = SimulatedClock()) as robot:
+            self.assertIsNot(robot.clock, clock)
+            self.assertIs(get_clock(), robot.clock)
+        self.assertIs(get_clock(), clock)
+
+    def test_simulated_sleep(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            start = time.time()
+            self.assertEqual(robot.nap(7200).wait(), 7200)
+            self.assertLess(time.time() - start, 1)
+
+            robot.sleep(100)
+            self.assertEqual(robot.clock.time(), 7300)
+
+    def test_simulated_subactions(self):
+        with MyRobot(clock = SimulatedClock(start = 100)) as robot:
+            self.assertEqual(robot.patrol().wait(), (3700, 3700))
+
+    def test_deadlines(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            self.assertEqual(robot.nap(10).wait(timeout = 60), 10)
+            # (waited for from an action: the main thread does not hold the
+            # simulated time between starting the action and waiting for it)
+            self.assertRaises(TimeoutError, robot.impatient().result)
+            self.assertLess(robot.clock.time() - 70, 0.1)
+            self.assertEqual(robot.executor.deadline_misses, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
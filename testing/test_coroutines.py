@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import robots
+from robots.concurrency import action, SimulatedClock
+
+@action
+def nap(robot, duration):
+    robot.sleep(duration)
+    return robot.clock.time()
+
+@action
+def blink(robot, times):
+    start = robot.clock.time()
+    for i in range(times):
+        yield 60
+    end = yield robot.nap(10)
+    raise StopIteration(end - start)
+
+@action
+def abort(robot):
+    yield 1
+    raise SystemExit()
+
+@action
+def take_over(robot):
+    yield 1
+    # the other coroutines run in the same thread, but are cancelled
+    cancellation = robot.cancel_all_others(wait = False)
+    while not cancellation.done():
+        yield 0.1
+    raise StopIteration(len(cancellation.actions))
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self, clock = None):
+        super(MyRobot, self).__init__(actions=[nap, blink, abort, take_over], dummy = True, clock = clock)
+        self.silent()
+
+
+class CoroutinesTests(unittest.TestCase):
+
+    def test_coroutines(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            blinks = [robot.blink(i) for i in range(100)]
+            self.assertEqual([b.wait() for b in blinks], [i * 60 + 10 for i in range(100)])
+
+            a = robot.blink(1000)
+            robot.sleep(100)
+            a.cancel()
+            self.assertTrue(a.done())
+
+    def test_exceptions(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            a = robot.abort()
+            self.assertRaises(SystemExit, a.result)
+
+            # the scheduler survived
+            self.assertEqual(robot.blink(1).wait(), 70)
+
+    def test_cancel_others(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            blinks = [robot.blink(100) for i in range(3)]
+            a = robot.take_over()
+            self.assertEqual(a.result(), 3)
+            self.assertTrue(all(b.done() for b in blinks))
+
+
+if __name__ == '__main__':
+    unittest.main()
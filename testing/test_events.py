@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gc
+import time
+import unittest
+import robots
+from concurrent.futures import Future
+from robots.concurrency import action, SimulatedClock, set_clock, RealClock
+from robots.events.thresholds import ThresholdIndex
+from robots.events.ratelimit import TokenBucket
+from robots.events.dispatch import CallbackQueue
+
+@action
+def record(robot):
+    robot.fired.append(robot.state.sonar)
+
+@action
+def approach(robot):
+    for value in [0.8, 0.6, 0.3, 0.1]:
+        robot.sleep(1)
+        robot.state.sonar = value
+
+@action
+def watch(robot):
+    robot.wait("sonar", below = 0.5)
+    near = robot.state.sonar
+    robot.wait(lambda robot: robot.state.sonar < 0.2)
+    return near, robot.state.sonar
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self, clock = None):
+        super(MyRobot, self).__init__(actions=[record, approach, watch], clock = clock)
+        self.silent()
+        self.fired = []
+        self.state.sonar = 1.
+        self.state.speed = 0.
+
+def wait_until(predicate, timeout = 1.):
+    start = time.time()
+    while not predicate() and time.time() - start < timeout:
+        time.sleep(0.01)
+
+class EventsTests(unittest.TestCase):
+
+    def test_monitors_lifecycle(self):
+        with MyRobot() as robot:
+            for i in range(100):
+                robot.on("sonar", below = 0.4)
+            gc.collect()
+            self.assertEqual(robot.events.count(), 0)
+
+            robot.on("sonar", below = 0.4).do(record)
+            robot.whenever("sonar", above = 2.).do(record)
+            self.assertEqual(robot.events.count(), 2)
+
+            robot.state.sonar = 0.3
+            wait_until(lambda: robot.events.count() == 1)
+            self.assertEqual(robot.events.count(), 1)
+
+        self.assertEqual(robot.events.count(), 0)
+
+    def test_threshold_index(self):
+        index = ThresholdIndex()
+        index.add_above(0.5, "above 0.5")
+        index.add_above(2., "above 2")
+        index.add_below(0.5, "below 0.5")
+        index.add_below(0.4, "below 0.4")
+        index.add_value(1., "is 1")
+        self.assertEqual(len(index), 5)
+
+        self.assertEqual(sorted(index.matching(0.3)), ["below 0.4", "below 0.5"])
+        self.assertEqual(index.matching(0.5), []) # strict thresholds
+        self.assertEqual(sorted(index.matching(1.)), ["above 0.5", "is 1"])
+        self.assertEqual(sorted(index.matching(3.)), ["above 0.5", "above 2"])
+        self.assertNotIn("is 1", index.matching([1.])) # unhashable value
+
+        index.remove("below 0.4")
+        index.remove("is 1")
+        self.assertEqual(index.matching(0.3), ["below 0.5"])
+        self.assertEqual(index.matching(1.), ["above 0.5"])
+        self.assertEqual(len(index), 3)
+
+    def test_wait(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            # (waited for from an action: the simulated time does not advance
+            # while it checks the state after waking up)
+            a = robot.watch()
+            robot.approach()
+            self.assertEqual(a.result(), (0.3, 0.1))
+            self.assertEqual(robot.events.count(), 0)
+
+    def test_predicate_dependencies(self):
+        with MyRobot() as robot:
+            with robot.state.recording_reads() as keys:
+                robot.state.sonar
+                robot.state.get("speed")
+            robot.state.sonar
+            self.assertEqual(keys, set(["sonar", "speed"]))
+
+            evaluations = []
+            def near(robot):
+                evaluations.append(robot.state.sonar)
+                return robot.state.sonar < 0.4
+
+            robot.on(near, track_dependencies = True).do(record)
+            wait_until(lambda: evaluations)
+
+            # not re-evaluated periodically (every ACTIVE_SLEEP_RESOLUTION)
+            time.sleep(0.3)
+            self.assertEqual(evaluations, [1.])
+
+            # the predicate only reads 'sonar': it is not re-evaluated
+            # when other entries are written
+            for i in range(10):
+                robot.state.speed = i
+            time.sleep(0.3)
+            self.assertEqual(evaluations, [1.])
+
+            robot.state.sonar = 0.3
+            wait_until(lambda: robot.fired)
+            self.assertEqual(evaluations, [1., 0.3])
+            self.assertEqual(robot.fired, [0.3])
+
+    def test_token_bucket(self):
+        clock = SimulatedClock()
+        set_clock(clock)
+        try:
+            bucket = TokenBucket(1, burst = 2)
+            self.assertEqual([bucket.trigger() for i in range(3)], [True, True, False])
+            self.assertEqual(bucket.next_release(), 1) # retry of the dropped trigger
+            self.assertFalse(bucket.release())
+            self.assertIsNone(bucket.next_release())
+            clock.sleep(1)
+            self.assertTrue(bucket.trigger())
+            self.assertEqual(bucket.stats(), {"fired": 3, "suppressed": 1, "coalesced": 0, "pending": 0})
+
+            bucket = TokenBucket(1, policy = TokenBucket.LATEST)
+            self.assertEqual([bucket.trigger() for i in range(3)], [True, False, False])
+            self.assertEqual(bucket.next_release(), 2)
+            self.assertFalse(bucket.release())
+            clock.sleep(1)
+            self.assertTrue(bucket.release())
+            self.assertEqual(bucket.stats(), {"fired": 2, "suppressed": 0, "coalesced": 1, "pending": 0})
+
+            bucket = TokenBucket(1, policy = TokenBucket.QUEUE, max_pending = 2)
+            self.assertEqual([bucket.trigger() for i in range(4)], [True, False, False, False])
+            clock.sleep(1)
+            # deferred firings go first
+            self.assertFalse(bucket.trigger())
+            self.assertTrue(bucket.release())
+            self.assertEqual(bucket.stats(), {"fired": 2, "suppressed": 2, "coalesced": 0, "pending": 1})
+
+            bucket = TokenBucket(0) # no rate limiting
+            self.assertTrue(all(bucket.trigger() for i in range(100)))
+
+            self.assertRaises(Exception, TokenBucket, 1, policy = "oldest")
+        finally:
+            set_clock(RealClock())
+
+    def test_rate_limited_refiring(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            robot.whenever("sonar", below = 0.5, max_firing_freq = 1).do(record)
+            robot.state.sonar = 0.3
+            robot.sleep(9.5)
+            # no new write, but the condition still holds: the event keeps
+            # firing at the maximum frequency
+            self.assertEqual(robot.fired, [0.3] * 10)
+
+            robot.state.sonar = 1.
+            robot.sleep(3)
+            self.assertEqual(len(robot.fired), 10)
+
+    def test_callback_queue(self):
+        for overflow, expected in [(CallbackQueue.DROP, [0, 1, 2]),
+                                   (CallbackQueue.DROP_OLDEST, [0, 2, 3])]:
+            started = []
+            futures = [Future() for i in range(4)]
+            def callback(i):
+                def cb(robot):
+                    started.append(i)
+                    return futures[i]
+                return cb
+
+            queue = CallbackQueue(None, concurrency = 1, max_queued = 2, overflow = overflow)
+            for i in range(4):
+                queue.push([callback(i)])
+            self.assertEqual(started, [0])
+            self.assertEqual(queue.stats(), {"dispatched": 1, "dropped": 1, "running": 1, "queued": 2})
+
+            # the next firing starts when the callbacks of the previous one
+            # complete
+            for i in expected:
+                futures[i].set_result(None)
+            self.assertEqual(started, expected)
+            self.assertEqual(queue.stats(), {"dispatched": 3, "dropped": 1, "running": 0, "queued": 0})
+
+    def test_hysteresis(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            robot.whenever("sonar", below = 0.5, hysteresis = 0.1, max_firing_freq = 0).do(record)
+            for value in [0.4, 0.55, 0.45, 0.58, 0.65, 0.4]:
+                robot.state.sonar = value
+                robot.sleep(1) # until the monitor has processed the value
+            self.assertEqual(robot.fired, [0.4, 0.4])
+
+    def test_composite(self):
+        with MyRobot() as robot:
+            near = robot.on("sonar", below = 0.4)
+            fast = robot.on("speed", above = 1.)
+            robot.whenever(near & ~fast, max_firing_freq = 0).do(record)
+
+            robot.state.speed = 2.
+            robot.state.sonar = 0.3
+            time.sleep(0.1)
+            self.assertEqual(robot.fired, [])
+
+            robot.state.speed = 0.5
+            wait_until(lambda: robot.fired)
+            self.assertEqual(robot.fired[0], 0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import robots
+from concurrent.futures import TimeoutError
+from robots.concurrency import action, SimulatedClock
+
+@action
+def nap(robot, duration):
+    robot.sleep(duration)
+    return robot.clock.time()
+
+@action
+def patrol(robot):
+    a = robot.nap(3600)
+    robot.nap(1800).wait()
+    robot.sleep(10)
+    return a.wait(), robot.clock.time()
+
+@action
+def blink(robot, times):
+    start = robot.clock.time()
+    for i in range(times):
+        yield 60
+    end = yield robot.nap(10)
+    raise StopIteration(end - start)
+
+@action
+def impatient(robot):
+    return robot.nap(3600).wait(timeout = 60)
+
+@action
+def abandon(robot):
+    a = robot.nap(3600)
+    robot.sleep(1)
+    a.cancel()
+
+@action
+def crash(robot):
+    raise ValueError("crashed")
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self, clock = None):
+        super(MyRobot, self).__init__(actions=[nap, patrol, blink, impatient, abandon, crash], dummy = True, clock = clock)
+        self.silent()
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_metrics(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            a = robot.patrol()
+            a.wait()
+            self.assertAlmostEqual(a.subaction_wait, 3590, places = 3)
+            self.assertIsNotNone(a.cpu_time)
+
+            metrics = robot.executor.metrics
+            self.assertEqual(metrics["nap"].count, 2)
+            self.assertEqual(metrics["patrol"].count, 1)
+            self.assertAlmostEqual(metrics["patrol"].wall.total, 3600, places = 3)
+
+            b = robot.blink(2)
+            self.assertEqual(b.wait(), 130)
+            self.assertAlmostEqual(b.subaction_wait, 10, places = 3)
+            self.assertIsNotNone(b.cpu_time)
+
+    def test_outcomes(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            self.assertRaises(TimeoutError, robot.impatient().result)
+            robot.abandon().result()
+            self.assertRaises(ValueError, robot.crash().result)
+
+            metrics = robot.executor.metrics
+            nap = metrics["nap"]
+            self.assertEqual((nap.count, nap.failed, nap.cancelled, nap.timed_out), (2, 0, 1, 1))
+            self.assertEqual(metrics["crash"].failed, 1)
+            self.assertEqual(metrics["impatient"].failed, 1) # raised TimeoutError
+            self.assertEqual(metrics["abandon"].failed, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
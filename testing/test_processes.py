@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import robots
+from robots.concurrency import action
+
+@action(process = True)
+def crunch(robot, n):
+    return robot, sum(i * i for i in range(n))
+
+@action(process = True)
+def fail(robot):
+    raise ValueError("bad input")
+
+@action(process = True)
+def spin(robot):
+    while True:
+        pass
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self):
+        super(MyRobot, self).__init__(actions=[crunch, fail, spin])
+        self.silent()
+
+
+class ProcessesTests(unittest.TestCase):
+
+    def test_process_actions(self):
+        with MyRobot() as robot:
+            self.assertEqual(robot.crunch(10).result(), (None, 285))
+            self.assertRaises(ValueError, robot.fail().result)
+
+            a = robot.spin()
+            time.sleep(0.2)
+            start = time.time()
+            a.cancel()
+            self.assertLess(time.time() - start, 0.5)
+
+            # the worker process is replaced
+            self.assertEqual(robot.crunch(4).result(), (None, 14))
+
+if __name__ == '__main__':
+    unittest.main()
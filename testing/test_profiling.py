@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import unittest
+import robots
+from robots.concurrency import action
+
+STOP = [] # spin() runs until this list is not empty
+
+@action
+def spin(robot):
+    while not STOP:
+        pass
+
+@action
+def nap(robot, duration):
+    robot.sleep(duration)
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self):
+        super(MyRobot, self).__init__(actions=[spin, nap], dummy = True)
+        self.silent()
+
+
+def wait_until_in(action, function, timeout = 5.):
+    """ Waits until the thread of ``action`` runs ``function`` (possibly
+    blocked in the threading module, but not in a callee of ``function``).
+    """
+    start = time.time()
+    while time.time() - start < timeout:
+        frame = sys._current_frames().get(action.thread().ident)
+        while frame is not None and frame.f_globals.get("__name__") == "threading":
+            frame = frame.f_back
+        if frame is not None and frame.f_code.co_name == function:
+            return True
+        time.sleep(0.01)
+    return False
+
+class ProfilingTests(unittest.TestCase):
+
+    def test_profiling(self):
+        with MyRobot() as robot:
+            # samples are taken by hand, not by the profiler thread
+            profiler = robot.executor.start_profiling(interval = 3600, include_waiting = False)
+            a, b = robot.spin(), robot.nap(3600)
+            self.assertTrue(wait_until_in(a, "spin"))
+            self.assertTrue(wait_until_in(b, "park"))
+
+            for i in range(20):
+                profiler.sample()
+            STOP.append(True)
+            a.wait()
+            b.cancel()
+            self.assertIs(robot.executor.stop_profiling(), profiler)
+
+            self.assertEqual(profiler.count, 20)
+            self.assertEqual(profiler.by_action(), {"spin": 20}) # nap() only waits
+
+            for line in profiler.collapsed().splitlines():
+                self.assertTrue(line.startswith("spin;"))
+                self.assertIn(";spin (test_profiling.py)", line)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import robots
+from robots.concurrency import action, SimulatedClock, PRIORITY_LOW, PRIORITY_HIGH, PRIORITY_CRITICAL
+from robots.resources import Resource, lock, find_deadlocks
+
+WHEELS = Resource("WHEELS")
+ARM = Resource("ARM")
+BASE = Resource("BASE")
+
+@action
+@lock(WHEELS)
+def move(robot):
+    robot.sleep(10)
+
+@action
+@lock(ARM)
+def grab(robot):
+    robot.sleep(1)
+
+@action
+@lock(ARM)
+def pick(robot):
+    # grab() needs the arm we own: deadlock
+    robot.grab().wait()
+
+@action
+def tour(robot):
+    moves = [robot.move() for i in range(3)]
+    for m in moves:
+        m.wait()
+
+@action
+@lock(BASE)
+def drive(robot):
+    robot.sleep(10)
+    return "arrived"
+
+@action(priority = PRIORITY_LOW)
+@lock(BASE)
+def wander(robot):
+    robot.sleep(1)
+    return robot.clock.time()
+
+@action(priority = PRIORITY_HIGH)
+@lock(BASE)
+def dock(robot):
+    robot.sleep(1)
+    return robot.clock.time()
+
+@action(priority = PRIORITY_CRITICAL, preempt = True)
+@lock(BASE)
+def halt(robot):
+    return robot.clock.time()
+
+@action(timeout = 5)
+@lock(BASE)
+def hurry(robot):
+    robot.sleep(2)
+    return robot.clock.time()
+
+@action
+def queue_up(robot):
+    d = robot.drive()
+    robot.sleep(1) # drive() owns the base
+    low, high = robot.wander(), robot.dock()
+    return d.result(), low.result(), high.result()
+
+@action
+def interrupt(robot):
+    d = robot.drive()
+    robot.sleep(1)
+    return d, robot.halt().result()
+
+@action
+@lock(BASE)
+def shutdown(robot):
+    h = robot.halt() # waits for us, but does not preempt its parent
+    robot.sleep(1)
+    return h
+
+@action
+def rush(robot):
+    d = robot.drive()
+    robot.sleep(1)
+    return robot.hurry().result()
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self, clock = None):
+        super(MyRobot, self).__init__(actions=[move, grab, pick, tour, drive, wander, dock, halt, hurry, queue_up, interrupt, shutdown, rush], dummy = True, clock = clock)
+        self.silent()
+
+
+class ResourcesTests(unittest.TestCase):
+
+    def test_contention(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            robot.tour().wait()
+            self.assertAlmostEqual(robot.executor.metrics["move"].resource_wait.total, 30, places = 3)
+
+            stats = WHEELS.stats
+            self.assertEqual(stats.acquisitions, 3)
+            self.assertEqual(stats.contended, 2)
+            self.assertEqual(stats.hold.count, 3)
+            self.assertAlmostEqual(stats.hold.mean(), 10, places = 3)
+            # the 2nd move waits 10s, the 3rd 20s
+            self.assertAlmostEqual(stats.wait.total, 30, places = 3)
+
+    def test_priorities(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            # the high priority dock() is handed over the base first, even
+            # though wander() was waiting for it before
+            self.assertEqual(robot.queue_up().result(), ("arrived", 12, 11))
+
+    def test_preemption(self):
+        preemptions = BASE.stats.preemptions
+        with MyRobot(clock = SimulatedClock()) as robot:
+            d, t = robot.interrupt().result()
+            self.assertIsNone(d.result()) # cancelled
+            self.assertEqual(t, 1)
+            self.assertEqual(BASE.stats.preemptions, preemptions + 1)
+
+            a = robot.shutdown()
+            h = a.result()
+            self.assertIsNotNone(h) # not cancelled by its child
+            self.assertEqual(h.result(), t + 1) # once shutdown() completes
+            self.assertEqual(BASE.stats.preemptions, preemptions + 1)
+
+    def test_timeout(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            # waits 9s for the base: the timeout only starts with the action
+            self.assertEqual(robot.rush().result(), 12)
+
+    def test_release(self):
+        res = Resource("GRIPPER")
+        self.assertRaises(RuntimeError, res.release)
+        res.acquire()
+        res.release()
+        self.assertRaises(RuntimeError, res.release)
+
+    def test_deadlock(self):
+        with MyRobot() as robot:
+            a = robot.pick()
+
+            deadlocks = []
+            start = time.time()
+            while not deadlocks and time.time() - start < 2:
+                time.sleep(0.05)
+                deadlocks = find_deadlocks()
+
+            self.assertEqual(len(deadlocks), 1)
+            cycle = deadlocks[0]
+            self.assertEqual(len(cycle), 2)
+            self.assertEqual(set((w.actionname, r.name if r else None, o.actionname) for w, r, o in cycle),
+                             set([("grab()", "ARM", "pick()"), ("pick()", None, "grab()")]))
+
+            a.cancel()
+            self.assertEqual(find_deadlocks(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
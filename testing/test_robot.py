@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import unittest
+import robots
+from robots.concurrency import action
+
+@action
+def goto(robot, target):
+    return target
+
+@action
+def wait(robot, var):
+    return "waited for %s" % var
+
+@action
+def nap(robot, duration):
+    robot.sleep(duration)
+    return "rested"
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self, actions = None):
+        super(MyRobot, self).__init__(actions = actions or [goto], dummy = True)
+        self.silent()
+
+
+def wait_until_parked(action, timeout = 5.):
+    """ Waits until the thread of ``action`` is parked on the clock.
+    """
+    start = time.time()
+    while time.time() - start < timeout:
+        frame = sys._current_frames().get(action.thread().ident)
+        while frame is not None:
+            if frame.f_code.co_name == "park":
+                return True
+            frame = frame.f_back
+        time.sleep(0.01)
+    return False
+
+class RobotTests(unittest.TestCase):
+
+    def test_lazy_proxies(self):
+        with MyRobot() as robot:
+            self.assertNotIn("goto", robot.__dict__) # not bound yet
+            self.assertIn("goto", dir(robot))
+
+            proxy = robot.goto
+            self.assertIn("goto", robot.__dict__) # bound on first access...
+            self.assertIs(robot.goto, proxy) # ...and cached
+            self.assertEqual(proxy("kitchen").result(), "kitchen")
+
+            self.assertRaises(AttributeError, getattr, robot, "fly")
+
+    def test_shadowing_actions(self):
+        with MyRobot(actions = [goto, wait]) as robot:
+            # 'wait' shadows GenericRobot.wait: bound right away
+            self.assertIn("wait", robot.__dict__)
+            self.assertEqual(robot.wait("sonar").result(), "waited for sonar")
+
+            # reloading an action drops its cached proxy
+            robot.goto
+            robot.load_actions([goto])
+            self.assertNotIn("goto", robot.__dict__)
+            self.assertEqual(robot.goto("hall").result(), "hall")
+
+    def test_sleep_cancellation(self):
+        with MyRobot(actions = [nap]) as robot:
+            a = robot.nap(3600)
+            self.assertTrue(wait_until_parked(a))
+
+            # the sleeping thread is woken up by the cancellation signal,
+            # instead of polling
+            start = time.time()
+            a.cancel()
+            self.assertTrue(a.done())
+            self.assertIsNone(a.result())
+            self.assertLess(time.time() - start, 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
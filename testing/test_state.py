@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import copy
+import time
+import threading
+import unittest
+from robots.state import State, SharedState
+from robots.concurrency import RealClock, SimulatedClock, set_clock
+
+class StateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.state = State(sonar = 1.)
+
+    def test_accessors(self):
+        state = self.state
+        self.assertEqual(state.sonar, 1.)
+        state.sonar = 2.
+        self.assertEqual(state["sonar"], 2.)
+        self.assertEqual(copy.copy(state), {"sonar": 2.})
+
+    def test_versions(self):
+        state = self.state
+        self.assertEqual(state.version("sonar"), 1)
+        self.assertEqual(state.version("speed"), 0)
+        self.assertIsNone(state.timestamp("speed"))
+
+        state.speed = 0.
+        state.sonar = 1.
+        self.assertEqual(state.version("speed"), 2)
+        self.assertEqual(state.version("sonar"), 3)
+        self.assertEqual(state.version(), 3)
+        self.assertGreaterEqual(state.timestamp("sonar"), state.timestamp("speed"))
+
+    def test_wait_for_version(self):
+        state = self.state
+
+        def publish():
+            time.sleep(0.1)
+            state.sonar = 0.5
+        threading.Thread(target = publish).start()
+
+        self.assertEqual(state.wait_for_version("sonar", 1, timeout = 2), 2)
+        self.assertEqual(state.sonar, 0.5)
+
+        start = time.time()
+        self.assertEqual(state.wait_for_version("sonar", 2, timeout = 0.1), 2)
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        self.assertFalse(state.wait_for_update(timeout = 0.1))
+
+    def test_removals(self):
+        state = self.state
+        state.speed = 0.
+
+        def remove():
+            time.sleep(0.1)
+            del state.sonar
+        threading.Thread(target = remove).start()
+
+        self.assertEqual(state.wait_for_version("sonar", 1, timeout = 2), 3)
+        self.assertNotIn("sonar", state)
+
+        self.assertEqual(state.pop("speed"), 0.)
+        self.assertIsNone(state.pop("speed", None))
+        self.assertEqual(state.version("speed"), 4)
+
+        state.sonar = 1.
+        state.clear()
+        self.assertEqual(state, {})
+        self.assertEqual(state.version("sonar"), 6)
+
+    def test_waiters_cleanup(self):
+        state = self.state
+        self.assertEqual(state.wait_for_any(["sonar", None], 1, timeout = 0.05), 1)
+        self.assertEqual(state._waiters, {})
+
+    def test_history(self):
+        clock = SimulatedClock()
+        set_clock(clock)
+        try:
+            state = self.state
+            history = state.keep_history("sonar", size = 5)
+            self.assertEqual(len(history), 1)
+
+            for i in range(10):
+                clock.sleep(1)
+                state.sonar = 2. * i
+
+            self.assertEqual(len(history), 5)
+            self.assertEqual(list(history.window()[1]), [10., 12., 14., 16., 18.])
+            self.assertEqual(list(history.window(2)[0]), [8., 9., 10.])
+            self.assertEqual(history.mean(2), 16.)
+            self.assertEqual(history.min(), 10.)
+            self.assertEqual(history.max(), 18.)
+            self.assertAlmostEqual(history.slope(), 2.)
+            self.assertEqual(history.last(), 18.)
+
+            clock.sleep(0.5)
+            self.assertIsNone(history.mean(0.2))
+        finally:
+            set_clock(RealClock())
+
+
+class SharedStateTests(unittest.TestCase):
+
+    SCHEMA = [("sonar", "f8"), ("scan", "f4", (4,))]
+
+    def setUp(self):
+        self.state = SharedState("test_shared_state", self.SCHEMA, create = True)
+
+    def tearDown(self):
+        self.state.close()
+        self.state.unlink()
+
+    def test_shared_entries(self):
+        state = self.state
+        other = SharedState("test_shared_state", self.SCHEMA)
+
+        self.assertEqual(other.version("sonar"), 0)
+        state.sonar = 0.5
+        state["scan"] = [1, 2, 3, 4]
+
+        self.assertEqual(other.sonar, 0.5)
+        self.assertEqual(list(other["scan"]), [1., 2., 3., 4.])
+        self.assertEqual(other.version("sonar"), 1)
+        self.assertEqual(other.version(), 2)
+        self.assertEqual(other.wait_for_version("sonar", 0, timeout = 0.1), 1)
+
+        self.assertRaises(KeyError, state.__setitem__, "speed", 1.)
+        self.assertRaises(RuntimeError, SharedState, "test_shared_state", self.SCHEMA[:1])
+        other.close()
+
+    def test_reattach(self):
+        state = self.state
+        state["scan"] = [1, 2, 3, 4]
+        scan = state.view("scan")
+
+        # creating the segment again does not truncate it under attached
+        # processes
+        other = SharedState("test_shared_state", self.SCHEMA, create = True)
+        self.assertEqual(list(state["scan"]), [1., 2., 3., 4.])
+
+        other.sonar = 0.5
+        self.assertEqual(state.version(), 2) # written by another 'process'
+        self.assertEqual(state.version(), 2)
+        other.close()
+
+        # the views keep the segment mapped
+        state.close()
+        self.assertEqual(list(scan), [1., 2., 3., 4.])
+        self.state = SharedState("test_shared_state", self.SCHEMA)
+
+if __name__ == '__main__':
+    unittest.main()
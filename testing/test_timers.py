@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from robots.concurrency import SimulatedClock, RealClock, set_clock
+from robots.concurrency.timers import TimerWheel
+
+class TimersTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SimulatedClock()
+        set_clock(self.clock)
+
+    def tearDown(self):
+        set_clock(RealClock())
+
+    def test_rounded_ticks(self):
+        wheel = TimerWheel(resolution = 0.05)
+        fired = []
+        # 43 * 0.05 / 0.05 < 43: the wheel used to spin on this tick,
+        # holding the simulated time forever
+        wheel.schedule(43 * 0.05, lambda: fired.append(self.clock.time()))
+
+        sleeper = threading.Thread(target = self.clock.sleep, args = (10,))
+        sleeper.daemon = True
+        sleeper.start()
+        sleeper.join(5)
+        self.assertFalse(sleeper.is_alive())
+        self.assertEqual(fired, [43 * 0.05])
+        self.assertEqual(len(wheel), 0)
+
+    def test_last_cancel(self):
+        # the time does not advance while the main thread runs
+        self.clock.add_participant(threading.current_thread())
+        try:
+            wheel = TimerWheel()
+            timer = wheel.schedule(100, lambda: None)
+            thread = wheel._thread
+            start = time.time()
+            while thread not in self.clock._parked and time.time() - start < 5:
+                time.sleep(0.01)
+
+            # the thread stops right away, instead of sleeping until its
+            # next planned wake-up
+            wheel.cancel(timer)
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(self.clock.time(), 0)
+        finally:
+            self.clock.remove_participant(threading.current_thread())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import robots
+from robots.concurrency import action, SimulatedClock
+from robots.concurrency.tracing import Tracer
+
+@action
+def nap(robot, duration):
+    robot.sleep(duration)
+    return robot.clock.time()
+
+@action
+def patrol(robot):
+    a = robot.nap(3600)
+    robot.nap(1800).wait()
+    robot.sleep(10)
+    return a.wait(), robot.clock.time()
+
+class MyRobot(robots.GenericRobot):
+
+    def __init__(self, clock = None):
+        super(MyRobot, self).__init__(actions=[nap, patrol], dummy = True, clock = clock)
+        self.silent()
+
+
+class TracingTests(unittest.TestCase):
+
+    def test_tracing(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            tracer = robot.executor.start_tracing()
+            robot.patrol().wait()
+            robot.executor.stop_tracing()
+
+            events = [(event, name) for idx, t, event, aid, name, tid, arg in tracer.events()]
+            self.assertEqual(events.count(("start", "nap(3600)")), 1)
+            self.assertEqual(events.count(("parent", "nap(1800)")), 1)
+            self.assertEqual(events[-1], ("end", "patrol()"))
+            self.assertEqual(len(tracer), len(events))
+
+            # timestamped with the (simulated) clock of the robot
+            self.assertEqual(tracer.events()[-1][1], 3600)
+
+            spans = [e for e in tracer.chrome_trace()["traceEvents"] if e.get("cat") == "action"]
+            self.assertEqual(len(spans), 6) # begin/end of the 3 actions
+
+    def test_ring_buffer(self):
+        with MyRobot(clock = SimulatedClock()) as robot:
+            tracer = Tracer(capacity = 4)
+            a = robot.nap(1)
+            for i in range(3):
+                tracer.record("ping", a)
+            self.assertEqual(len(tracer), 3)
+            for i in range(3):
+                tracer.record("ping", a)
+            self.assertEqual(len(tracer), 4)
+            self.assertEqual([e[0] for e in tracer.events()], [2, 3, 4, 5]) # most recent ones
+
+            tracer.clear()
+            self.assertEqual(len(tracer), 0)
+            tracer.record("ping", a)
+            self.assertEqual(len(tracer), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()